@@ -1,17 +1,33 @@
 import os
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
-from flask import Flask
-import threading
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+from postgrest.exceptions import APIError
+import httpx
 from dotenv import load_dotenv
 import datetime
 import aiohttp
+from aiohttp import web
 from discord import PermissionOverwrite, Permissions, Colour
 from discord.ext import commands
 import json
 import asyncio
+import contextlib
+import contextvars
+import functools
+import gzip
+import re
+import shutil
+import signal
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 # ==============================
 # CARGAR VARIABLES DEL ENTORNO
@@ -20,11 +36,1241 @@ load_dotenv()
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+DB_MAX_CONCURRENCIA = int(os.getenv("DB_MAX_CONCURRENCIA", "8"))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "10"))
+CONFIG_CACHE_TTL = float(os.getenv("CONFIG_CACHE_TTL", "600"))
+CONFIG_CACHE_MAX = int(os.getenv("CONFIG_CACHE_MAX", "5000"))
+WARNS_CACHE_TTL = float(os.getenv("WARNS_CACHE_TTL", "300"))
+WARNS_CACHE_MAX = int(os.getenv("WARNS_CACHE_MAX", "5000"))
+WARNS_POR_PAGINA = 10  # advertencias por página de /warnings (un embed admite 25 campos)
+USUARIOS_LOTE_MAX = int(os.getenv("USUARIOS_LOTE_MAX", "200"))
+USUARIOS_LOTE_MS = int(os.getenv("USUARIOS_LOTE_MS", "500"))
+TICKETS_BLOQUE = int(os.getenv("TICKETS_BLOQUE", "10"))
+ESTADISTICAS_INTERVALO = int(os.getenv("ESTADISTICAS_INTERVALO", "300"))
+ESTADISTICAS_CONTEO = os.getenv("ESTADISTICAS_CONTEO", "estimated")  # exact | planned | estimated
+TRANSCRIPTS_DIR = os.getenv("TRANSCRIPTS_DIR", "transcripts")
+TRANSCRIPTS_BUCKET = os.getenv("TRANSCRIPTS_BUCKET")  # bucket de Supabase Storage (opcional)
+LATENCIA_PRESUPUESTO = float(os.getenv("LATENCIA_PRESUPUESTO", "2.5"))
+CANALES_INTERVALO = float(os.getenv("CANALES_INTERVALO", "0.5"))
+CANALES_REINTENTOS = int(os.getenv("CANALES_REINTENTOS", "5"))
+LOGS_INTERVALO = float(os.getenv("LOGS_INTERVALO", "2"))  # segundos que se acumulan embeds de log antes de enviarlos
+DM_CONCURRENCIA = int(os.getenv("DM_CONCURRENCIA", "2"))
+DM_POR_SEGUNDO = float(os.getenv("DM_POR_SEGUNDO", "1"))  # ritmo global de DMs (anti-spam de Discord)
+DM_CERRADOS_TTL = float(os.getenv("DM_CERRADOS_TTL", "3600"))  # segundos sin reintentar a quien tiene los DMs cerrados
+DM_COLA_MAX = int(os.getenv("DM_COLA_MAX", "1000"))
+TICKET_CIERRE_SEGUNDOS = float(os.getenv("TICKET_CIERRE_SEGUNDOS", "5"))
+PORT = int(os.getenv("PORT", "5000"))
+HEALTH_HEARTBEAT_MAX = float(os.getenv("HEALTH_HEARTBEAT_MAX", "90"))  # segundos sin ACK del gateway
+HEALTH_DB_TTL = float(os.getenv("HEALTH_DB_TTL", "30"))  # una consulta correcta más reciente evita el sondeo
+LOOP_WATCHDOG_MS = float(os.getenv("LOOP_WATCHDOG_MS", "0"))  # 0 = desactivado; p. ej. 100
+LOOP_WATCHDOG_INFORME = os.getenv("LOOP_WATCHDOG_INFORME", "loop_watchdog.json")
+LOOP_WATCHDOG_MAX = int(os.getenv("LOOP_WATCHDOG_MAX", "50"))  # bloqueos recientes que se guardan con su pila
+SHARD_COUNT = os.getenv("SHARD_COUNT")  # total de shards o "auto"; sin definir = una sola conexión
+SHARD_IDS = os.getenv("SHARD_IDS")      # shards de este proceso, p. ej. "0-3" o "0,2,4" (requiere SHARD_COUNT)
+MEMBER_CACHE = os.getenv("MEMBER_CACHE", "voz")  # completo | voz | ninguno
+MIEMBROS_CACHE_MAX = int(os.getenv("MIEMBROS_CACHE_MAX", "1000"))
+RAID_ENTRADAS = int(os.getenv("RAID_ENTRADAS", "10"))       # entradas dentro de RAID_VENTANA que activan el modo raid (0 = desactivado)
+RAID_VENTANA = float(os.getenv("RAID_VENTANA", "10"))
+RAID_DURACION = float(os.getenv("RAID_DURACION", "120"))    # segundos sin picos hasta salir del modo raid
+RAID_RESUMEN = float(os.getenv("RAID_RESUMEN", "15"))       # cada cuánto se publica la bienvenida agrupada
+ENTRADAS_RECIENTES_MAX = int(os.getenv("ENTRADAS_RECIENTES_MAX", "500"))  # entradas por servidor que recuerda `recientes` de los comandos masivos
+MASIVO_CONCURRENCIA = int(os.getenv("MASIVO_CONCURRENCIA", "4"))  # acciones de Discord en vuelo por comando masivo
+MASIVO_MAX = int(os.getenv("MASIVO_MAX", "100"))                 # usuarios por comando masivo
+MASIVO_PROGRESO = float(os.getenv("MASIVO_PROGRESO", "2"))       # segundos entre ediciones del mensaje de progreso
+# Diario local de escrituras: un archivo por proceso (con SHARD_IDS, uno por grupo de shards)
+DIARIO_RUTA = os.getenv("DIARIO_RUTA", f"diario_escrituras{'-' + SHARD_IDS.replace(',', '_') if SHARD_IDS else ''}.db")
+DIARIO_LOTE = int(os.getenv("DIARIO_LOTE", "100"))                     # escrituras leídas del diario por vuelta
+DIARIO_REINTENTO = float(os.getenv("DIARIO_REINTENTO", "1"))           # espera tras el primer fallo (se duplica)
+DIARIO_REINTENTO_MAX = float(os.getenv("DIARIO_REINTENTO_MAX", "60"))
+DIARIO_CIRCUITO_FALLOS = int(os.getenv("DIARIO_CIRCUITO_FALLOS", "5"))  # fallos seguidos que abren el circuito
+DIARIO_CIRCUITO_SEGUNDOS = float(os.getenv("DIARIO_CIRCUITO_SEGUNDOS", "30"))
+DIARIO_CIERRE = float(os.getenv("DIARIO_CIERRE", "5"))                 # segundos para vaciarlo al apagar
+DIARIO_REINTENTAR_RECHAZADAS = os.getenv("DIARIO_REINTENTAR_RECHAZADAS", "0") == "1"  # devolver `rechazadas` al diario al arrancar
+REPLICA_INTERVALO = float(os.getenv("REPLICA_INTERVALO", "5"))         # segundos entre deltas de la réplica local (0 = desactivada)
+REPLICA_RESINCRONIZAR = float(os.getenv("REPLICA_RESINCRONIZAR", "3600"))  # recarga completa (recoge borrados externos)
+REPLICA_SOLAPE = float(os.getenv("REPLICA_SOLAPE", "5"))               # margen hacia atrás de cada delta
+REPLICA_LOTE = int(os.getenv("REPLICA_LOTE", "1000"))                  # filas por página de la carga y de cada delta
 
 # ==============================
 # CONEXIÓN A SUPABASE
 # ==============================
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    options=ClientOptions(postgrest_client_timeout=DB_TIMEOUT)
+)
+
+# ==============================
+# PRESUPUESTO DE LATENCIA
+# ==============================
+# Cada handler decorado con @diferido acumula el tiempo de sus fases
+# (supabase, discord, ...) y, si supera LATENCIA_PRESUPUESTO, se registra
+# qué fase se llevó el tiempo.
+_fases_actuales = contextvars.ContextVar("fases_actuales", default=None)
+
+@contextlib.contextmanager
+def fase(nombre):
+    """Medir una fase del handler en curso (no hace nada fuera de un handler)"""
+    fases = _fases_actuales.get()
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        if fases is not None:
+            fases[nombre] = fases.get(nombre, 0) + time.perf_counter() - inicio
+
+# ==============================
+# MÉTRICAS (FORMATO PROMETHEUS)
+# ==============================
+# Contadores e histogramas en memoria. Se actualizan y se exportan (/metrics)
+# desde el event loop del bot, así que no necesitan locks. Los valores
+# instantáneos (latencia del gateway, colas, cachés) se leen al exportar.
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _formatear_valor(valor):
+    if valor != valor:
+        return "NaN"
+    if valor in (float("inf"), float("-inf")):
+        return "+Inf" if valor > 0 else "-Inf"
+    return str(valor) if isinstance(valor, int) else repr(float(valor))
+
+def _formatear_etiquetas(etiquetas):
+    if not etiquetas:
+        return ""
+    pares = []
+    for nombre, valor in etiquetas:
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pares.append(f'{nombre}="{valor}"')
+    return "{" + ",".join(pares) + "}"
+
+class Metricas:
+    def __init__(self, buckets=BUCKETS_SEGUNDOS):
+        self.buckets = buckets
+        self._tipos = {}        # nombre -> (tipo, descripción)
+        self._contadores = {}   # (nombre, etiquetas) -> valor
+        self._histogramas = {}  # (nombre, etiquetas) -> [cubeta_0, ..., cubeta_n, +Inf, suma]
+        self._medidores = {}    # nombre -> función que devuelve un número o {etiquetas: valor}
+
+    def contador(self, nombre, descripcion):
+        self._tipos[nombre] = ("counter", descripcion)
+
+    def histograma(self, nombre, descripcion):
+        self._tipos[nombre] = ("histogram", descripcion)
+
+    def medidor(self, nombre, descripcion, funcion):
+        """Registrar un valor instantáneo que se calcula al exportar"""
+        self._tipos[nombre] = ("gauge", descripcion)
+        self._medidores[nombre] = funcion
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        cubetas = self._histogramas.get(clave)
+        if cubetas is None:
+            cubetas = self._histogramas[clave] = [0] * (len(self.buckets) + 2)
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                break
+        else:
+            i = len(self.buckets)
+        cubetas[i] += 1
+        cubetas[-1] += valor
+
+    def exponer(self):
+        """Texto en el formato de exposición de Prometheus (0.0.4)"""
+        series = {}
+        for (nombre, etiquetas), valor in list(self._contadores.items()):
+            series.setdefault(nombre, []).append(f"{nombre}{_formatear_etiquetas(etiquetas)} {_formatear_valor(valor)}")
+
+        for (nombre, etiquetas), cubetas in list(self._histogramas.items()):
+            cubetas = list(cubetas)
+            lineas = series.setdefault(nombre, [])
+            acumulado = 0
+            for limite, cantidad in zip([*self.buckets, float("inf")], cubetas):
+                acumulado += cantidad
+                le = (("le", _formatear_valor(limite)),)
+                lineas.append(f"{nombre}_bucket{_formatear_etiquetas(etiquetas + le)} {acumulado}")
+            lineas.append(f"{nombre}_sum{_formatear_etiquetas(etiquetas)} {_formatear_valor(cubetas[-1])}")
+            lineas.append(f"{nombre}_count{_formatear_etiquetas(etiquetas)} {acumulado}")
+
+        for nombre, funcion in list(self._medidores.items()):
+            try:
+                valor = funcion()
+            except Exception as e:
+                print(f"⚠️ Error calculando la métrica {nombre}: {e}")
+                continue
+            valores = valor if isinstance(valor, dict) else {(): valor}
+            series[nombre] = [
+                f"{nombre}{_formatear_etiquetas(tuple(sorted(dict(etiquetas).items())))} {_formatear_valor(v)}"
+                for etiquetas, v in valores.items()
+            ]
+
+        salida = []
+        for nombre, (tipo, descripcion) in self._tipos.items():
+            salida.append(f"# HELP {nombre} {descripcion}")
+            salida.append(f"# TYPE {nombre} {tipo}")
+            salida.extend(series.get(nombre, []))
+        return "\n".join(salida) + "\n"
+
+metricas = Metricas()
+metricas.contador("dragons_comandos_total", "Interacciones atendidas por comando y resultado")
+metricas.histograma("dragons_comando_segundos", "Tiempo hasta responder al usuario por comando")
+metricas.contador("dragons_supabase_consultas_total", "Consultas a Supabase por tabla")
+metricas.contador("dragons_supabase_errores_total", "Consultas a Supabase fallidas por tabla y tipo de error")
+metricas.histograma("dragons_supabase_segundos", "Duración de las consultas a Supabase por tabla")
+metricas.contador("dragons_cache_config_total", "Lecturas de la caché de configuración por tabla y resultado")
+metricas.histograma("dragons_loop_retraso_segundos", "Retraso del event loop respecto a lo programado")
+
+async def medir_retraso_loop(intervalo=1.0):
+    """Muestrear cuánto tarda el event loop en despertar una tarea dormida"""
+    while True:
+        inicio = time.perf_counter()
+        await asyncio.sleep(intervalo)
+        metricas.observar("dragons_loop_retraso_segundos", max(0.0, time.perf_counter() - inicio - intervalo))
+
+# ==============================
+# VIGILANTE DEL EVENT LOOP
+# ==============================
+# Opcional (LOOP_WATCHDOG_MS > 0). Una tarea del loop marca un latido cada
+# pocos milisegundos y un hilo aparte comprueba que llegue a tiempo; si el
+# loop lleva más de LOOP_WATCHDOG_MS sin latir, el hilo copia la pila del hilo
+# del loop con sys._current_frames(), la atribuye al handler que se estaba
+# ejecutando y, cuando el loop se recupera, añade el bloqueo al informe
+# LOOP_WATCHDOG_INFORME. Desactivado no arranca ni la tarea ni el hilo.
+metricas.contador("dragons_loop_bloqueos_total", "Bloqueos del event loop por encima de LOOP_WATCHDOG_MS por handler")
+
+# Funciones intermedias que no identifican al culpable de un bloqueo
+_FUNCIONES_INTERMEDIAS = {"wrapper", "_atender", "_ejecutar", "_db_ejecutar", "_bucle"}
+
+def _atribuir_bloqueo(pila):
+    """Nombre del handler más externo de Dragons.py en la pila"""
+    for marco in pila:
+        if marco.filename == os.path.abspath(__file__) and marco.name not in _FUNCIONES_INTERMEDIAS | {"<module>"}:
+            return marco.name
+    return pila[-1].name if pila else "desconocido"
+
+class VigilanteLoop:
+    def __init__(self, umbral_ms, informe, max_bloqueos):
+        self.umbral = umbral_ms / 1000
+        self.intervalo = self.umbral / 4
+        self.informe = informe
+        self._latido = time.monotonic()
+        self._hilo_loop = None
+        self._loop = None
+        self._tarea = None
+        self._parar = threading.Event()
+        self._bloqueos = deque(maxlen=max_bloqueos)
+        self._por_handler = {}  # handler -> {"bloqueos", "ms_total", "ms_max"}
+
+    def iniciar(self):
+        self._loop = asyncio.get_running_loop()
+        self._hilo_loop = threading.get_ident()
+        self._latido = time.monotonic()
+        self._tarea = asyncio.create_task(self._latir())
+        threading.Thread(target=self._vigilar, name="loop-watchdog", daemon=True).start()
+        print(f"🐕 Vigilante del event loop activo (umbral {self.umbral * 1000:.0f}ms, informe {self.informe})")
+
+    def detener(self):
+        self._parar.set()
+        if self._tarea:
+            self._tarea.cancel()
+
+    async def _latir(self):
+        while True:
+            self._latido = time.monotonic()
+            await asyncio.sleep(self.intervalo)
+
+    def _vigilar(self):
+        bloqueo = None
+        while not self._parar.wait(self.intervalo):
+            # El latido puede llevar hasta `intervalo` de retraso sin que haya bloqueo
+            retraso = time.monotonic() - self._latido - self.intervalo
+            if retraso >= self.umbral:
+                if bloqueo is None:
+                    marco = sys._current_frames().get(self._hilo_loop)
+                    pila = traceback.extract_stack(marco) if marco else []
+                    bloqueo = {
+                        "inicio": datetime.datetime.utcnow().isoformat(),
+                        "handler": _atribuir_bloqueo(pila),
+                        "pila": traceback.format_list(pila[-15:]),
+                    }
+                bloqueo["ms"] = round(retraso * 1000, 1)
+            elif bloqueo is not None:
+                self._registrar(bloqueo)
+                bloqueo = None
+
+    def _registrar(self, bloqueo):
+        handler = bloqueo["handler"]
+        print(f"⚠️ Event loop bloqueado {bloqueo['ms']:.0f}ms en {handler}")
+        self._bloqueos.append(bloqueo)
+        resumen = self._por_handler.setdefault(handler, {"bloqueos": 0, "ms_total": 0.0, "ms_max": 0.0})
+        resumen["bloqueos"] += 1
+        resumen["ms_total"] = round(resumen["ms_total"] + bloqueo["ms"], 1)
+        resumen["ms_max"] = max(resumen["ms_max"], bloqueo["ms"])
+        # Las métricas solo se tocan desde el loop
+        self._loop.call_soon_threadsafe(lambda: metricas.incrementar("dragons_loop_bloqueos_total", handler=handler))
+        self._escribir_informe()
+
+    def _escribir_informe(self):
+        informe = {
+            "umbral_ms": self.umbral * 1000,
+            "actualizado": datetime.datetime.utcnow().isoformat(),
+            "por_handler": dict(sorted(self._por_handler.items(), key=lambda h: -h[1]["ms_total"])),
+            "ultimos": list(self._bloqueos),
+        }
+        try:
+            temporal = f"{self.informe}.tmp"
+            with open(temporal, "w", encoding="utf-8") as archivo:
+                json.dump(informe, archivo, indent=2, ensure_ascii=False)
+            os.replace(temporal, self.informe)
+        except OSError as e:
+            print(f"❌ Error escribiendo el informe del vigilante: {e}")
+
+vigilante_loop = VigilanteLoop(LOOP_WATCHDOG_MS, LOOP_WATCHDOG_INFORME, LOOP_WATCHDOG_MAX) if LOOP_WATCHDOG_MS > 0 else None
+
+# ==============================
+# CAPA DE ACCESO A DATOS (ASÍNCRONA)
+# ==============================
+# El cliente de Supabase es síncrono: cada .execute() bloquea el event loop
+# (heartbeats incluidos). Todas las consultas pasan por db_query(), que las
+# ejecuta en un pool de hilos acotado con un límite de concurrencia y un
+# timeout por llamada.
+_db_executor = ThreadPoolExecutor(max_workers=DB_MAX_CONCURRENCIA, thread_name_prefix="supabase")
+_db_semaforo = asyncio.Semaphore(DB_MAX_CONCURRENCIA)
+_db_ultimo_exito = 0.0  # time.monotonic() de la última consulta correcta (para /health)
+
+async def _db_ejecutar(funcion, timeout, tabla):
+    global _db_ultimo_exito
+    loop = asyncio.get_running_loop()
+    with fase("supabase"):
+        async with _db_semaforo:
+            metricas.incrementar("dragons_supabase_consultas_total", tabla=tabla)
+            inicio = time.perf_counter()
+            try:
+                resultado = await asyncio.wait_for(loop.run_in_executor(_db_executor, funcion), timeout)
+                _db_ultimo_exito = time.monotonic()
+                return resultado
+            except Exception as e:
+                metricas.incrementar("dragons_supabase_errores_total", tabla=tabla, error=type(e).__name__)
+                raise
+            finally:
+                metricas.observar("dragons_supabase_segundos", time.perf_counter() - inicio, tabla=tabla)
+
+async def db_query(tabla, construir, timeout=DB_TIMEOUT):
+    """Ejecutar una consulta de Supabase sin bloquear el event loop.
+
+    `construir` recibe `supabase.table(tabla)` y devuelve la consulta, por ejemplo:
+    `await db_query("tickets", lambda t: t.select("*").eq("guild_id", guild_id))`
+    """
+    return await _db_ejecutar(lambda: construir(supabase.table(tabla)).execute(), timeout, tabla)
+
+async def db_rpc(funcion, parametros, timeout=DB_TIMEOUT):
+    """Llamar a una función de Postgres (RPC) sin bloquear el event loop"""
+    return await _db_ejecutar(lambda: supabase.rpc(funcion, parametros).execute(), timeout, f"rpc/{funcion}")
+
+# ==============================
+# DIARIO LOCAL DE ESCRITURAS
+# ==============================
+# Los handlers no esperan a Supabase para escribir: anotan la escritura en un
+# diario SQLite local (modo WAL, sobrevive a caídas y reinicios del proceso) y
+# siguen. Un bucle lo vacía en orden; los insert consecutivos a una tabla con
+# las mismas columnas salen en un único insert masivo. Si Supabase no responde
+# se reintenta con espera exponencial y, tras DIARIO_CIRCUITO_FALLOS fallos
+# seguidos, el circuito se abre durante DIARIO_CIRCUITO_SEGUNDOS antes de volver
+# a probar. Lo que PostgREST rechaza por los datos (restricciones, columnas...)
+# no se reintenta: pasa a la tabla `rechazadas` del diario para revisarlo a mano
+# y, una vez corregida la causa, se devuelve al diario arrancando con
+# DIARIO_REINTENTAR_RECHAZADAS=1.
+#
+# Cada fila de un insert lleva una clave `diario_id` generada al anotarla
+# (sql/diario_idempotencia.sql) y se envía como upsert que ignora duplicados,
+# así reenviar un lote cuyo resultado se desconoce (timeout cuando Supabase ya
+# lo había guardado, apagado a mitad de envío) no duplica filas. Sin esa
+# migración, un insert con resultado desconocido no se reenvía: se aparta.
+ESQUEMA_DIARIO = """
+CREATE TABLE IF NOT EXISTS escrituras (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tabla TEXT NOT NULL,
+    operacion TEXT NOT NULL,  -- insert | upsert | update | delete
+    datos TEXT,               -- JSON con la fila o las filas
+    filtros TEXT,             -- JSON [[método, columna, valor], ...] de update/delete
+    on_conflict TEXT,
+    creado REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rechazadas (
+    id INTEGER PRIMARY KEY,
+    tabla TEXT NOT NULL,
+    operacion TEXT NOT NULL,
+    datos TEXT,
+    filtros TEXT,
+    on_conflict TEXT,
+    creado REAL NOT NULL,
+    error TEXT,
+    rechazado REAL NOT NULL
+);
+"""
+
+def _codigo_error(error):
+    return str(getattr(error, "code", "") or "") if isinstance(error, APIError) else ""
+
+def _error_definitivo(error):
+    """True si PostgREST rechazó la escritura por sus datos (reintentarla no sirve)"""
+    codigo = _codigo_error(error)
+    # 22xxx/23xxx: datos y restricciones; 42703/PGRST204: columna inexistente; 42P01: tabla inexistente.
+    # Permisos (42501) y el resto de errores de PostgREST se arreglan sin tocar la fila: esos se reintentan.
+    # Lo rechazado no bloquea el resto del diario y se recupera con DIARIO_REINTENTAR_RECHAZADAS=1
+    return codigo[:2] in ("22", "23") or codigo in ("42703", "42P01", "PGRST204")
+
+def _resultado_desconocido(error):
+    """True si la escritura pudo llegar a guardarse aunque falló (no hubo respuesta de PostgREST)"""
+    if isinstance(error, APIError):
+        return not _codigo_error(error)
+    return not isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+def _con_clave(grupo):
+    """True si todas las filas de un grupo de insert llevan clave de idempotencia"""
+    return all("diario_id" in fila for entrada in grupo
+               for fila in (entrada[3] if isinstance(entrada[3], list) else [entrada[3]]))
+
+class DiarioEscrituras:
+    def __init__(self, ruta=DIARIO_RUTA, lote=DIARIO_LOTE, circuito_fallos=DIARIO_CIRCUITO_FALLOS,
+                 circuito_segundos=DIARIO_CIRCUITO_SEGUNDOS):
+        self.ruta = ruta
+        self.lote = lote
+        self.circuito_fallos = circuito_fallos
+        self.circuito_segundos = circuito_segundos
+        # Un solo hilo: SQLite no bloquea el event loop y las escrituras se anotan en orden de llegada
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="diario")
+        self._conexion = None
+        self._conteo = None      # futuro con las escrituras que quedaron de la ejecución anterior
+        self._pendientes = None
+        self._sin_idempotencia = set()  # tablas sin la columna diario_id
+        self._al_confirmar = {}  # id -> callback tras llegar a Supabase (solo en memoria)
+        self._hay_datos = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._tarea = None
+        self._fallos = 0
+        self._circuito_hasta = 0.0
+
+    # ---------- SQLite (hilo del diario) ----------
+    def _abrir(self):
+        if self._conexion is None:
+            directorio = os.path.dirname(self.ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            # Con WAL, NORMAL ya garantiza lo confirmado ante una caída del proceso
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            conexion.executescript(ESQUEMA_DIARIO)
+            self._conexion = conexion
+        return self._conexion
+
+    def _contar(self):
+        return self._abrir().execute("SELECT COUNT(*) FROM escrituras").fetchone()[0]
+
+    def _anotar(self, fila):
+        conexion = self._abrir()
+        with conexion:
+            cursor = conexion.execute(
+                "INSERT INTO escrituras (tabla, operacion, datos, filtros, on_conflict, creado) VALUES (?, ?, ?, ?, ?, ?)", fila
+            )
+        return cursor.lastrowid
+
+    def _leer(self, limite):
+        filas = self._abrir().execute(
+            "SELECT id, tabla, operacion, datos, filtros, on_conflict FROM escrituras ORDER BY id LIMIT ?", (limite,)
+        ).fetchall()
+        return [(id_, tabla, operacion, json.loads(datos), json.loads(filtros) if filtros else None, on_conflict)
+                for id_, tabla, operacion, datos, filtros, on_conflict in filas]
+
+    def _borrar(self, ids):
+        conexion = self._abrir()
+        with conexion:
+            conexion.executemany("DELETE FROM escrituras WHERE id = ?", [(id_,) for id_ in ids])
+
+    def _rechazar(self, id_, error):
+        conexion = self._abrir()
+        with conexion:
+            conexion.execute(
+                "INSERT INTO rechazadas SELECT id, tabla, operacion, datos, filtros, on_conflict, creado, ?, ? "
+                "FROM escrituras WHERE id = ?", (error, time.time(), id_)
+            )
+            conexion.execute("DELETE FROM escrituras WHERE id = ?", (id_,))
+
+    def _recuperar(self):
+        conexion = self._abrir()
+        with conexion:
+            movidas = conexion.execute(
+                "INSERT INTO escrituras (tabla, operacion, datos, filtros, on_conflict, creado) "
+                "SELECT tabla, operacion, datos, filtros, on_conflict, creado FROM rechazadas ORDER BY id"
+            ).rowcount
+            conexion.execute("DELETE FROM rechazadas")
+        return movidas
+
+    def _buscar(self, tabla):
+        return [json.loads(datos) for (datos,) in self._abrir().execute(
+            "SELECT datos FROM escrituras WHERE tabla = ? AND operacion IN ('insert', 'upsert') ORDER BY id", (tabla,)
+        )]
+
+    def _cerrar(self):
+        if self._conexion is not None:
+            self._conexion.close()
+            self._conexion = None
+
+    async def _sql(self, funcion, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, funcion, *args)
+
+    # ---------- API ----------
+    async def escribir(self, tabla, operacion, datos=None, filtros=None, on_conflict=None, al_confirmar=None):
+        """Anotar una escritura y volver en cuanto está en el diario (no cuando llega a Supabase).
+
+        `filtros` son (método, columna, valor) para update/delete, p. ej. `[("eq", "canal_id", canal_id)]`.
+        `al_confirmar()` se llama cuando Supabase la acepta (por ejemplo, para invalidar una caché).
+        """
+        if operacion == "insert":
+            # Clave de idempotencia: si el envío se repite, Supabase ignora la fila que ya guardó
+            datos = ([dict(f, diario_id=str(uuid.uuid4())) for f in datos] if isinstance(datos, list)
+                     else dict(datos, diario_id=str(uuid.uuid4())))
+        fila = (tabla, operacion, json.dumps(datos), json.dumps(filtros) if filtros else None, on_conflict, time.time())
+        self.iniciar()
+        with fase("diario"):
+            await self._contado()
+            # Se cuenta antes de anotarla: vaciar() puede enviarla (y descontarla) antes de que vuelva _anotar
+            self._pendientes += 1
+            try:
+                # shield: si quien escribe se cancela, la escritura sigue y ya está contada
+                id_ = await asyncio.shield(self._sql(self._anotar, fila))
+            except Exception:
+                self._pendientes -= 1
+                raise
+        if al_confirmar:
+            self._al_confirmar[id_] = al_confirmar
+        metricas.incrementar("dragons_diario_total", resultado="anotada")
+        self._hay_datos.set()
+        return id_
+
+    async def reintentar_rechazadas(self):
+        """Devolver al diario las escrituras de `rechazadas` (tras corregir la causa); devuelve cuántas"""
+        await self._contado()
+        # Con el lock, vaciar() no puede descontarlas antes de sumarlas
+        async with self._lock:
+            movidas = await self._sql(self._recuperar)
+            self._pendientes += movidas
+        if movidas:
+            print(f"📒 {movidas} escrituras rechazadas vuelven al diario.")
+            self._hay_datos.set()
+        return movidas
+
+    async def pendientes_de(self, tabla, **campos):
+        """Filas de insert/upsert a `tabla` que aún no llegaron a Supabase y coinciden con `campos`"""
+        filas = []
+        for datos in await self._sql(self._buscar, tabla):
+            filas.extend(f for f in (datos if isinstance(datos, list) else [datos])
+                         if all(f.get(columna) == valor for columna, valor in campos.items()))
+        return filas
+
+    def pendientes(self):
+        return self._pendientes or 0
+
+    def circuito_abierto(self):
+        return self._circuito_hasta > time.monotonic()
+
+    def iniciar(self):
+        if self._conteo is None:
+            # Antes de anotar nada (el hilo del diario va en orden): lo que haya son restos de la ejecución anterior
+            self._conteo = asyncio.get_running_loop().run_in_executor(self._executor, self._contar)
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._bucle())
+
+    async def _contado(self):
+        if self._conteo is None:
+            self._conteo = asyncio.get_running_loop().run_in_executor(self._executor, self._contar)
+        restos = await asyncio.shield(self._conteo)
+        if self._pendientes is None:
+            self._pendientes = restos
+            if restos:
+                print(f"📒 Reanudando {restos} escrituras pendientes del diario.")
+                self._hay_datos.set()
+
+    async def detener(self, timeout=DIARIO_CIERRE):
+        """Parar el bucle, intentar vaciar el diario durante `timeout` segundos y cerrarlo"""
+        if self._tarea:
+            self._tarea.cancel()
+            self._tarea = None
+        try:
+            await asyncio.wait_for(self.vaciar(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        if self.pendientes():
+            print(f"📒 Quedan {self.pendientes()} escrituras en el diario; se enviarán al volver a arrancar.")
+        await self._sql(self._cerrar)
+
+    async def _bucle(self):
+        await self._contado()
+        if DIARIO_REINTENTAR_RECHAZADAS:
+            await self.reintentar_rechazadas()
+        while True:
+            await self._hay_datos.wait()
+            espera = self._circuito_hasta - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            if not await self.vaciar():
+                await asyncio.sleep(min(DIARIO_REINTENTO_MAX, DIARIO_REINTENTO * 2 ** (self._fallos - 1)))
+
+    async def vaciar(self):
+        """Enviar a Supabase todo lo anotado, en orden; devuelve False si Supabase falló"""
+        async with self._lock:
+            self._hay_datos.clear()
+            if self.circuito_abierto():
+                self._hay_datos.set()
+                return False
+            await self._contado()
+            while True:
+                entradas = await self._sql(self._leer, self.lote)
+                if not entradas:
+                    return True
+                grupos = deque(self._agrupar(entradas))
+                while grupos:
+                    grupo = grupos.popleft()
+                    try:
+                        await self._enviar(grupo)
+                    except asyncio.CancelledError:
+                        if self._sin_clave(grupo):
+                            await asyncio.shield(self._apartar(grupo, "envío interrumpido al apagar (resultado desconocido)"))
+                        raise
+                    except Exception as e:
+                        if self._sin_clave(grupo) and _resultado_desconocido(e):
+                            # Sin clave de idempotencia, reenviarla podría duplicar lo que Supabase sí guardó
+                            await self._apartar(grupo, f"resultado desconocido: {e!r}")
+                        elif _error_definitivo(e) and len(grupo) > 1:
+                            # Reenviar una a una para rechazar solo la escritura con datos inválidos
+                            grupos.extendleft(reversed([[entrada] for entrada in grupo]))
+                            continue
+                        elif _error_definitivo(e):
+                            await self._apartar(grupo, str(e))
+                            continue
+                        self._registrar_fallo(e)
+                        self._hay_datos.set()
+                        return False
+                    await self._sql(self._borrar, [entrada[0] for entrada in grupo])
+                    self._pendientes -= len(grupo)
+                    metricas.incrementar("dragons_diario_total", len(grupo), resultado="enviada")
+                    for entrada in grupo:
+                        callback = self._al_confirmar.pop(entrada[0], None)
+                        if callback:
+                            callback()
+                    self._registrar_exito()
+
+    def _sin_clave(self, grupo):
+        """True si el grupo es un insert que se envía sin clave de idempotencia"""
+        return grupo[0][2] == "insert" and (grupo[0][1] in self._sin_idempotencia or not _con_clave(grupo))
+
+    async def _apartar(self, grupo, error):
+        """Pasar las escrituras del grupo a `rechazadas` sin reintentarlas"""
+        for entrada in grupo:
+            await self._sql(self._rechazar, entrada[0], error)
+            self._al_confirmar.pop(entrada[0], None)
+        self._pendientes -= len(grupo)
+        metricas.incrementar("dragons_diario_total", len(grupo), resultado="rechazada")
+        print(f"❌ {len(grupo)} escrituras del diario a {grupo[0][1]} guardadas en `rechazadas`: {error}")
+
+    @staticmethod
+    def _agrupar(entradas):
+        """Unir en un grupo los insert consecutivos a la misma tabla con las mismas columnas"""
+        grupos, clave_anterior = [], None
+        for entrada in entradas:
+            _, tabla, operacion, datos, _, _ = entrada
+            clave = None
+            if operacion == "insert":
+                filas = datos if isinstance(datos, list) else [datos]
+                clave = (tabla, frozenset(k for fila in filas for k in fila))
+            if clave is not None and clave == clave_anterior:
+                grupos[-1].append(entrada)
+            else:
+                grupos.append([entrada])
+            clave_anterior = clave
+        return grupos
+
+    async def _enviar(self, grupo):
+        _, tabla, operacion, datos, filtros, on_conflict = grupo[0]
+        if operacion == "insert":
+            filas = [fila for entrada in grupo for fila in (entrada[3] if isinstance(entrada[3], list) else [entrada[3]])]
+            if tabla in self._sin_idempotencia or not _con_clave(grupo):
+                filas = [{k: v for k, v in fila.items() if k != "diario_id"} for fila in filas]
+                await db_query(tabla, lambda t: t.insert(filas, returning="minimal"))
+                return
+            try:
+                await db_query(tabla, lambda t: t.upsert(
+                    filas, returning="minimal", on_conflict="diario_id", ignore_duplicates=True
+                ))
+            except APIError as e:
+                # Falta la columna diario_id o su índice único: la migración no está aplicada en esta tabla.
+                # Otra columna inexistente es un problema de la fila y acaba en `rechazadas`
+                falta_columna = e.code in ("42703", "PGRST204") and "diario_id" in str(e.message or "")
+                if not (falta_columna or e.code == "42P10"):
+                    raise
+                print(f"⚠️ Falta diario_id en {tabla} (sql/diario_idempotencia.sql): sus insert del diario no son idempotentes.")
+                self._sin_idempotencia.add(tabla)
+                await self._enviar(grupo)
+        elif operacion == "upsert":
+            await db_query(tabla, lambda t: t.upsert(datos, returning="minimal", on_conflict=on_conflict or ""))
+        else:
+            def construir(t):
+                consulta = t.update(datos, returning="minimal") if operacion == "update" else t.delete(returning="minimal")
+                for metodo, columna, valor in filtros:
+                    consulta = getattr(consulta, metodo)(columna, valor)
+                return consulta
+            await db_query(tabla, construir)
+
+    def _registrar_fallo(self, error):
+        self._fallos += 1
+        metricas.incrementar("dragons_diario_fallos_total", error=type(error).__name__)
+        if self._fallos == 1:
+            print(f"⚠️ Supabase no acepta escrituras, se reintentará desde el diario: {error}")
+        if self._fallos >= self.circuito_fallos:
+            if not self.circuito_abierto():
+                print(f"🔌 Circuito del diario abierto {self.circuito_segundos:g}s tras {self._fallos} fallos seguidos.")
+            self._circuito_hasta = time.monotonic() + self.circuito_segundos
+
+    def _registrar_exito(self):
+        if self._fallos:
+            print(f"✅ Supabase vuelve a aceptar escrituras ({self.pendientes()} pendientes en el diario).")
+        self._fallos = 0
+        self._circuito_hasta = 0.0
+
+diario = DiarioEscrituras()
+metricas.contador("dragons_diario_total", "Escrituras del diario local por resultado (anotada, enviada, rechazada)")
+metricas.contador("dragons_diario_fallos_total", "Intentos de vaciar el diario que fallaron por Supabase")
+metricas.medidor("dragons_diario_pendientes", "Escrituras anotadas en el diario que aún no llegaron a Supabase", lambda: diario.pendientes())
+metricas.medidor("dragons_diario_circuito_abierto", "1 si el circuito del diario está abierto", lambda: int(diario.circuito_abierto()))
+
+# ==============================
+# CACHÉ DE CONFIGURACIÓN POR SERVIDOR
+# ==============================
+# Las filas de bienvenidas, despedidas y ticket_config solo cambian cuando un
+# admin usa /crear-bienvenida, /crear-despedida o /ticket-config, así que se
+# guardan en memoria (TTL + LRU). Esos comandos escriben directamente en la
+# caché y las cargas concurrentes de la misma fila comparten una sola consulta.
+class CacheConfig:
+    def __init__(self, ttl=CONFIG_CACHE_TTL, max_entradas=CONFIG_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()  # (tabla, guild_id) -> (expira, fila)
+        self._cargando = {}          # (tabla, guild_id) -> Future en curso
+        self._escrituras = 0
+
+    async def obtener(self, tabla, guild_id):
+        """Devolver la fila de configuración del servidor (o None si no existe)"""
+        if replica.lista:
+            metricas.incrementar("dragons_cache_config_total", tabla=tabla, resultado="replica")
+            return replica.fila(tabla, guild_id)
+        clave = (tabla, guild_id)
+        entrada = self._datos.get(clave)
+        if entrada and entrada[0] > time.monotonic():
+            self._datos.move_to_end(clave)
+            metricas.incrementar("dragons_cache_config_total", tabla=tabla, resultado="acierto")
+            return entrada[1]
+
+        futuro = self._cargando.get(clave)
+        if futuro is None:
+            metricas.incrementar("dragons_cache_config_total", tabla=tabla, resultado="fallo")
+            futuro = asyncio.ensure_future(self._cargar(tabla, guild_id))
+            self._cargando[clave] = futuro
+            futuro.add_done_callback(lambda _: self._cargando.pop(clave, None))
+        else:
+            metricas.incrementar("dragons_cache_config_total", tabla=tabla, resultado="compartida")
+        # shield: si un handler se cancela, la carga sigue para los demás
+        return await asyncio.shield(futuro)
+
+    async def _cargar(self, tabla, guild_id):
+        escrituras = self._escrituras
+        data = await db_query(tabla, lambda t: t.select("*").eq("guild_id", guild_id))
+        fila = data.data[0] if data.data else None
+        # Si un comando escribió mientras tanto, no pisar su valor con uno viejo
+        if escrituras == self._escrituras:
+            self._guardar(tabla, guild_id, fila)
+        return fila
+
+    def _guardar(self, tabla, guild_id, fila):
+        clave = (tabla, guild_id)
+        self._datos[clave] = (time.monotonic() + self.ttl, fila)
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+
+    def guardar(self, tabla, guild_id, fila):
+        """Escritura directa desde los comandos de configuración"""
+        self._escrituras += 1
+        self._guardar(tabla, guild_id, fila)
+        replica.guardar(tabla, fila)
+
+    def invalidar(self, tabla, guild_id):
+        self._escrituras += 1
+        self._datos.pop((tabla, guild_id), None)
+
+    def __len__(self):
+        return len(self._datos)
+
+config_cache = CacheConfig()
+
+# ==============================
+# CACHÉ DE ADVERTENCIAS POR USUARIO
+# ==============================
+# Las advertencias son por servidor (sql/warns_guild.sql). /userinfo solo
+# necesita cuántas tiene un usuario y /warnings su primera página; ambas cosas
+# solo cambian con /warn y /unwarns, que invalidan la entrada. El total sale de
+# un conteo sin descargar filas y, si ya se pidió la primera página, de la misma
+# consulta que la trae. Las páginas siguientes usan paginación por clave
+# (warned_at, id) sobre el índice (guild_id, user_id, warned_at, id).
+def _consulta_pagina(tabla, guild_id, user_id):
+    return (tabla.eq("guild_id", guild_id).eq("user_id", user_id)
+            .order("warned_at", desc=True).order("id", desc=True).limit(WARNS_POR_PAGINA + 1))
+
+class CacheWarns:
+    def __init__(self, ttl=WARNS_CACHE_TTL, max_entradas=WARNS_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()  # (guild_id, user_id) -> {"expira", "total", "primera"}
+        self._escrituras = 0
+
+    def _vigente(self, clave):
+        entrada = self._datos.get(clave)
+        if entrada and entrada["expira"] > time.monotonic():
+            self._datos.move_to_end(clave)
+            return entrada
+        return None
+
+    def _guardar(self, clave, escrituras, **valores):
+        # Si /warn o /unwarns invalidaron mientras tanto, no guardar un valor viejo
+        if escrituras != self._escrituras:
+            return
+        entrada = self._vigente(clave) or {"total": None, "primera": None}
+        entrada.update(valores, expira=time.monotonic() + self.ttl)
+        self._datos[clave] = entrada
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+
+    async def contar(self, guild_id, user_id):
+        """Número de advertencias del usuario en el servidor"""
+        if replica.warns_al_dia():
+            metricas.incrementar("dragons_cache_warns_total", consulta="contar", resultado="replica")
+            return replica.contar_warns(guild_id, user_id)
+        clave = (guild_id, user_id)
+        entrada = self._vigente(clave)
+        if entrada and entrada["total"] is not None:
+            metricas.incrementar("dragons_cache_warns_total", consulta="contar", resultado="acierto")
+            return entrada["total"]
+        metricas.incrementar("dragons_cache_warns_total", consulta="contar", resultado="fallo")
+        escrituras = self._escrituras
+        data = await db_query("warns", lambda t: t.select("id", count="exact", head=True)
+                              .eq("guild_id", guild_id).eq("user_id", user_id))
+        self._guardar(clave, escrituras, total=data.count or 0)
+        return data.count or 0
+
+    async def pagina(self, guild_id, user_id, despues_de=None):
+        """(total, advertencias de la página, hay_más), de la más reciente a la más antigua.
+
+        `despues_de` es (warned_at, id) de la última advertencia de la página anterior.
+        """
+        clave = (guild_id, user_id)
+        if despues_de is None:
+            entrada = self._vigente(clave)
+            if entrada and entrada["primera"] is not None:
+                metricas.incrementar("dragons_cache_warns_total", consulta="pagina", resultado="acierto")
+                total, filas = entrada["total"], entrada["primera"]
+            else:
+                metricas.incrementar("dragons_cache_warns_total", consulta="pagina", resultado="fallo")
+                escrituras = self._escrituras
+                data = await db_query("warns", lambda t: _consulta_pagina(t.select("*", count="exact"), guild_id, user_id))
+                total, filas = (data.count if data.count is not None else len(data.data)), data.data
+                self._guardar(clave, escrituras, total=total, primera=filas)
+        else:
+            warned_at, warn_id = despues_de
+            data = await db_query("warns", lambda t: _consulta_pagina(
+                t.select("*").or_(f'warned_at.lt."{warned_at}",and(warned_at.eq."{warned_at}",id.lt.{warn_id})'),
+                guild_id, user_id
+            ))
+            filas = data.data
+            total = await self.contar(guild_id, user_id)
+        return total, filas[:WARNS_POR_PAGINA], len(filas) > WARNS_POR_PAGINA
+
+    def invalidar(self, guild_id, user_id):
+        self._escrituras += 1
+        self._datos.pop((guild_id, user_id), None)
+
+    def __len__(self):
+        return len(self._datos)
+
+cache_warns = CacheWarns()
+metricas.contador("dragons_cache_warns_total", "Lecturas de la caché de advertencias por consulta y resultado")
+
+def warns_guardados(guild_id, user_ids):
+    """Tras llegar a Supabase nuevas advertencias: invalidar sus cachés y traerlas a la réplica"""
+    for user_id in user_ids:
+        cache_warns.invalidar(guild_id, user_id)
+    replica.sincronizar_pronto()
+
+# ==============================
+# RÉPLICA LOCAL DE LECTURA
+# ==============================
+# Las lecturas calientes (configuraciones de bienvenida, despedida y tickets,
+# tickets abiertos y número de advertencias) se sirven desde una copia en
+# memoria en lugar de ir a Supabase. Al arrancar se descargan las tablas por
+# páginas y cada REPLICA_INTERVALO segundos se piden solo las filas con
+# `updated_at` posterior a la última sincronización (sql/replica_updated_at.sql),
+# con REPLICA_SOLAPE segundos de margen. Los borrados no se ven por `updated_at`:
+# los del propio bot se aplican al momento y el resto llega con la recarga
+# completa cada REPLICA_RESINCRONIZAR segundos. Si Supabase cae se sigue
+# sirviendo la última copia. Lo que escribe el bot se aplica a la réplica al
+# instante; esas claves no se pisan con filas de Supabase hasta que el diario
+# de escrituras se vacía. Las advertencias nuevas del bot solo llegan con los
+# deltas, así que sin la migración de `updated_at` los conteos van a Supabase.
+# Con SHARD_IDS cada proceso guarda solo las filas de los servidores de sus
+# shards (PostgREST no puede filtrar por shard, así que se descartan al llegar).
+CLAVES_REPLICA = {"ticket_config": "guild_id", "bienvenidas": "guild_id", "despedidas": "guild_id", "tickets": "canal_id"}
+
+class ReplicaLocal:
+    def __init__(self, intervalo=REPLICA_INTERVALO, resincronizar=REPLICA_RESINCRONIZAR, solape=REPLICA_SOLAPE, lote=REPLICA_LOTE):
+        self.intervalo = intervalo
+        self.resincronizar = resincronizar
+        self.solape = datetime.timedelta(seconds=solape)
+        self.lote = lote
+        self.lista = False
+        self._filas = {tabla: {} for tabla in CLAVES_REPLICA}  # tabla -> clave -> fila (tickets: solo abiertos)
+        self._abiertos = {}        # (guild_id, user_id) -> {canal_id: ticket abierto}
+        self._warns = {}           # (guild_id, user_id) -> ids de sus advertencias
+        self._tocadas = {}         # (tabla, clave) -> time.monotonic() de la última escritura del bot
+        self._desde = None         # updated_at a partir del cual pedir el siguiente delta
+        self._sin_deltas = False   # la migración de updated_at no está aplicada
+        self._ultima_carga = 0.0
+        self._ultima_sincronizacion = None
+        self._despertar = asyncio.Event()
+        self._tarea = None
+
+    # ---------- lecturas (en memoria) ----------
+    def fila(self, tabla, clave):
+        return self._filas[tabla].get(clave)
+
+    def tickets_abiertos(self, guild_id, user_id):
+        return list(self._abiertos.get((guild_id, user_id), {}).values())
+
+    def warns_al_dia(self):
+        """False si las advertencias que guarda el bot no pueden llegar a la réplica (sin deltas)"""
+        return self.lista and not self._sin_deltas
+
+    def contar_warns(self, guild_id, user_id):
+        return len(self._warns.get((guild_id, user_id), ()))
+
+    def segundos_desde_sincronizacion(self):
+        if self._ultima_sincronizacion is None:
+            return None
+        return time.monotonic() - self._ultima_sincronizacion
+
+    def tamanos(self):
+        return {**{tabla: len(filas) for tabla, filas in self._filas.items()}, "warns": sum(map(len, self._warns.values()))}
+
+    @staticmethod
+    def _propia(fila):
+        """True si la fila es de un servidor de los shards de este proceso"""
+        shard_ids = opciones_shards.get("shard_ids")
+        return not shard_ids or (int(fila["guild_id"]) >> 22) % opciones_shards["shard_count"] in shard_ids
+
+    def _poner(self, tabla, clave, fila):
+        self._quitar(tabla, clave)
+        self._filas[tabla][clave] = fila
+        if tabla == "tickets":
+            self._abiertos.setdefault((fila["guild_id"], fila["user_id"]), {})[clave] = fila
+
+    def _quitar(self, tabla, clave):
+        fila = self._filas[tabla].pop(clave, None)
+        if tabla == "tickets" and fila is not None:
+            abiertos = self._abiertos.get((fila["guild_id"], fila["user_id"]), {})
+            abiertos.pop(clave, None)
+            if not abiertos:
+                self._abiertos.pop((fila["guild_id"], fila["user_id"]), None)
+
+    # ---------- escrituras del propio bot ----------
+    def guardar(self, tabla, fila):
+        clave = fila[CLAVES_REPLICA[tabla]]
+        self._poner(tabla, clave, fila)
+        self._tocadas[(tabla, clave)] = time.monotonic()
+
+    def borrar(self, tabla, clave):
+        self._quitar(tabla, clave)
+        self._tocadas[(tabla, clave)] = time.monotonic()
+
+    def olvidar_warns(self, guild_id, user_id, warn_id=None):
+        """Quitar advertencias borradas por el bot (todas las del usuario si no hay `warn_id`)"""
+        if warn_id is None:
+            self._warns.pop((guild_id, user_id), None)
+        else:
+            self._warns.get((guild_id, user_id), set()).discard(warn_id)
+
+    def sincronizar_pronto(self):
+        self._despertar.set()
+
+    # ---------- sincronización ----------
+    def iniciar(self):
+        if self.intervalo > 0 and self._tarea is None:
+            self._tarea = asyncio.create_task(self._bucle())
+
+    def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            self._tarea = None
+
+    async def _bucle(self):
+        fallando = False
+        while True:
+            completa = not self.lista or time.monotonic() - self._ultima_carga >= self.resincronizar
+            try:
+                await (self.cargar() if completa else self.sincronizar())
+                metricas.incrementar("dragons_replica_sincronizaciones_total", tipo="completa" if completa else "delta", resultado="ok")
+                if fallando:
+                    print("✅ Réplica local sincronizada de nuevo.")
+                fallando = False
+            except Exception as e:
+                metricas.incrementar("dragons_replica_sincronizaciones_total", tipo="completa" if completa else "delta", resultado="error")
+                if not fallando:
+                    print(f"⚠️ No se pudo sincronizar la réplica local (se sirve la última copia): {e}")
+                fallando = True
+            self._despertar.clear()
+            try:
+                await asyncio.wait_for(self._despertar.wait(), self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+
+    def _olvidar_tocadas(self):
+        # Con el diario vacío, todo lo que escribió el bot hasta ahora ya está en Supabase
+        if diario.pendientes() == 0:
+            self._tocadas.clear()
+
+    async def _paginas(self, tabla, construir):
+        """Todas las filas de `construir(t)` (ordenada por una columna única), de REPLICA_LOTE en REPLICA_LOTE"""
+        filas = []
+        while True:
+            data = await db_query(tabla, lambda t: construir(t).limit(self.lote).offset(len(filas)))
+            filas.extend(data.data)
+            if len(data.data) < self.lote:
+                return filas
+
+    async def cargar(self):
+        """Descargar las tablas completas y reemplazar la copia local"""
+        desde = datetime.datetime.now(datetime.timezone.utc)
+        self._olvidar_tocadas()
+        filas = {}
+        for tabla, clave in CLAVES_REPLICA.items():
+            consulta = (lambda t: t.select("*").eq("estado", "abierto").order("id")) if tabla == "tickets" \
+                else (lambda t, clave=clave: t.select("*").order(clave))
+            filas[tabla] = {fila[clave]: fila for fila in await self._paginas(tabla, consulta) if self._propia(fila)}
+
+        # Advertencias: solo sus claves, paginadas por id para no usar offset sobre una tabla grande
+        warns, ultimo = {}, 0
+        while True:
+            data = await db_query("warns", lambda t: t.select("id, guild_id, user_id").gt("id", ultimo).order("id").limit(self.lote))
+            for warn in data.data:
+                if warn["guild_id"] is not None and self._propia(warn):
+                    warns.setdefault((warn["guild_id"], warn["user_id"]), set()).add(warn["id"])
+            if len(data.data) < self.lote:
+                break
+            ultimo = data.data[-1]["id"]
+
+        # Lo que el bot escribió durante la carga (o sigue en el diario) manda sobre lo descargado
+        for tabla, clave in self._tocadas:
+            local = self._filas[tabla].get(clave)
+            if local is None:
+                filas[tabla].pop(clave, None)
+            else:
+                filas[tabla][clave] = local
+        abiertos = {}
+        for canal_id, ticket in filas["tickets"].items():
+            abiertos.setdefault((ticket["guild_id"], ticket["user_id"]), {})[canal_id] = ticket
+        self._filas, self._abiertos, self._warns, self._desde = filas, abiertos, warns, desde
+        self._ultima_carga = self._ultima_sincronizacion = time.monotonic()
+        if not self.lista:
+            self.lista = True
+            print(f"📚 Réplica local cargada: {self.tamanos()}")
+
+    async def sincronizar(self):
+        """Aplicar las filas cambiadas desde la última sincronización"""
+        if self._sin_deltas:
+            return
+        desde = self._desde - self.solape
+        marca = self._desde
+        self._olvidar_tocadas()
+        cambios = {}
+        try:
+            for tabla in (*CLAVES_REPLICA, "warns"):
+                columnas = "id, guild_id, user_id, updated_at" if tabla == "warns" else "*"
+                data = await db_query(tabla, lambda t: t.select(columnas).gte("updated_at", desde.isoformat())
+                                      .order("updated_at").limit(self.lote))
+                if len(data.data) == self.lote:
+                    # Demasiados cambios para un delta: mejor recargar todo
+                    self._ultima_carga = 0.0
+                    self.sincronizar_pronto()
+                    return
+                cambios[tabla] = data.data
+        except APIError as e:
+            if e.code != "42703":  # columna inexistente: falta sql/replica_updated_at.sql
+                raise
+            print("⚠️ Falta la columna updated_at (sql/replica_updated_at.sql): la réplica solo se recarga completa.")
+            self._sin_deltas = True
+            return
+
+        for tabla, filas in cambios.items():
+            for fila in filas:
+                marca = max(marca, datetime.datetime.fromisoformat(fila["updated_at"]))
+                if fila.get("guild_id") is None or not self._propia(fila):
+                    continue
+                if tabla == "warns":
+                    ids = self._warns.setdefault((fila["guild_id"], fila["user_id"]), set())
+                    if fila["id"] not in ids:
+                        ids.add(fila["id"])
+                        cache_warns.invalidar(fila["guild_id"], fila["user_id"])
+                    continue
+                clave = fila[CLAVES_REPLICA[tabla]]
+                if (tabla, clave) in self._tocadas:
+                    continue
+                if tabla == "tickets" and fila.get("estado") != "abierto":
+                    self._quitar(tabla, clave)
+                else:
+                    self._poner(tabla, clave, fila)
+        self._desde = marca
+        self._ultima_sincronizacion = time.monotonic()
+
+replica = ReplicaLocal()
+metricas.contador("dragons_replica_sincronizaciones_total", "Sincronizaciones de la réplica local por tipo y resultado")
+metricas.medidor("dragons_replica_filas", "Filas en la réplica local por tabla",
+                 lambda: {(("tabla", tabla),): n for tabla, n in replica.tamanos().items()})
+metricas.medidor("dragons_replica_segundos_desde_sincronizacion", "Antigüedad de la réplica local",
+                 lambda: replica.segundos_desde_sincronizacion() or 0)
+
+# ==============================
+# ESCRITURA DIFERIDA POR LOTES
+# ==============================
+# Acumula filas y las anota en el diario como un único upsert masivo cada
+# `max_filas` filas o `intervalo_ms` milisegundos (lo que ocurra primero), así
+# las entradas repetidas se unen antes de llegar a Supabase. Se vacía al apagar el bot.
+class EscritorPorLotes:
+    def __init__(self, tabla, clave, max_filas, intervalo_ms):
+        self.tabla = tabla
+        self.clave = clave
+        self.max_filas = max_filas
+        self.intervalo = intervalo_ms / 1000
+        self._pendientes = {}  # clave -> fila (PostgREST rechaza la misma clave dos veces en un upsert)
+        self._hay_datos = asyncio.Event()
+        self._lleno = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._tarea = None
+
+    def agregar(self, fila):
+        self._pendientes[fila[self.clave]] = fila
+        self._hay_datos.set()
+        if len(self._pendientes) >= self.max_filas:
+            self._lleno.set()
+
+    def pendientes(self):
+        return len(self._pendientes)
+
+    def iniciar(self):
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            self._tarea = None
+        await self.vaciar()
+
+    async def _bucle(self):
+        while True:
+            await self._hay_datos.wait()
+            try:
+                await asyncio.wait_for(self._lleno.wait(), self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+            await self.vaciar()
+
+    async def vaciar(self):
+        """Anotar las filas pendientes en el diario en upserts de hasta `max_filas` filas"""
+        async with self._lock:
+            self._hay_datos.clear()
+            self._lleno.clear()
+            while self._pendientes:
+                claves = list(self._pendientes)[:self.max_filas]
+                filas = [self._pendientes.pop(clave) for clave in claves]
+                enviado = False
+                try:
+                    await diario.escribir(self.tabla, "upsert", filas)
+                    enviado = True
+                except Exception as e:
+                    print(f"❌ Error guardando lote de {self.tabla} ({len(filas)} filas): {e}")
+                finally:
+                    if not enviado:
+                        # Reencolar sin pisar datos más nuevos que hayan llegado mientras tanto
+                        for fila in filas:
+                            self._pendientes.setdefault(fila[self.clave], fila)
+                        self._hay_datos.set()
+                if not enviado:
+                    break
+
+registro_usuarios = EscritorPorLotes("usuarios", "user_id", USUARIOS_LOTE_MAX, USUARIOS_LOTE_MS)
+
+# ==============================
+# NUMERACIÓN DE TICKETS
+# ==============================
+# Cada servidor tiene un contador atómico en Supabase (sql/ticket_contadores.sql).
+# Se reservan bloques de TICKETS_BLOQUE números con una sola llamada RPC y se
+# reparten localmente; al reiniciar el bot, los números no usados del bloque
+# se pierden (quedan huecos, nunca duplicados). Sin la RPC, el siguiente número
+# sale del mayor entre Supabase, el diario y lo ya repartido por este proceso.
+class NumeradorTickets:
+    def __init__(self, bloque=TICKETS_BLOQUE):
+        self.bloque = bloque
+        self._bloques = {}  # guild_id -> [siguiente, ultimo]
+        self._locks = {}    # guild_id -> asyncio.Lock
+        self._sin_rpc = False
+
+    async def siguiente(self, guild_id):
+        """Devolver el siguiente número de ticket del servidor"""
+        lock = self._locks.setdefault(guild_id, asyncio.Lock())
+        async with lock:
+            bloque = self._bloques.get(guild_id)
+            if not bloque or bloque[0] > bloque[1]:
+                bloque = await self._reservar(guild_id)
+                self._bloques[guild_id] = bloque
+            numero = bloque[0]
+            bloque[0] += 1
+            return numero
+
+    async def _reservar(self, guild_id):
+        if not self._sin_rpc:
+            try:
+                data = await db_rpc("reservar_tickets", {"p_guild_id": guild_id, "p_cantidad": self.bloque})
+                ultimo = int(data.data)
+                return [ultimo - self.bloque + 1, ultimo]
+            except APIError as e:
+                # PGRST202: la migración aún no está aplicada, usar el último número guardado
+                if e.code != "PGRST202":
+                    raise
+                print("⚠️ RPC reservar_tickets no disponible, usando el último número guardado.")
+                self._sin_rpc = True
+
+        data = await db_query("tickets", lambda t: t.select("numero").eq("guild_id", guild_id).order("numero", desc=True).limit(1))
+        # Los tickets aún en el diario no están en Supabase, y el último número repartido aquí tampoco tiene por qué
+        anterior = self._bloques.get(guild_id)
+        ultimo = max(
+            [int(data.data[0]["numero"]) if data.data else 0, anterior[1] if anterior else 0]
+            + [int(t["numero"]) for t in await diario.pendientes_de("tickets", guild_id=guild_id)]
+        )
+        return [ultimo + 1, ultimo + 1]
+
+numerador_tickets = NumeradorTickets()
 
 # ==============================
 # CONFIGURACIÓN DEL BOT
@@ -32,10 +1278,190 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+
+# Sharding opcional: con SHARD_COUNT el bot abre una conexión al gateway por
+# shard (AutoShardedBot). Para repartir shards entre procesos, cada proceso usa
+# el mismo SHARD_COUNT, su propio rango en SHARD_IDS y su propio PORT.
+def _parsear_shards(texto):
+    ids = []
+    for parte in texto.split(","):
+        inicio, _, fin = parte.strip().partition("-")
+        ids.extend(range(int(inicio), int(fin or inicio) + 1))
+    return sorted(set(ids))
+
+opciones_shards = {}
+if SHARD_COUNT and SHARD_COUNT.lower() != "auto":
+    opciones_shards["shard_count"] = int(SHARD_COUNT)
+    if SHARD_IDS:
+        opciones_shards["shard_ids"] = _parsear_shards(SHARD_IDS)
+        fuera = [i for i in opciones_shards["shard_ids"] if i >= opciones_shards["shard_count"]]
+        if fuera:
+            raise RuntimeError(f"SHARD_IDS {fuera} fuera de rango para SHARD_COUNT={SHARD_COUNT}")
+elif SHARD_IDS:
+    raise RuntimeError("SHARD_IDS requiere SHARD_COUNT con el número total de shards")
+BotBase = commands.AutoShardedBot if SHARD_COUNT else commands.Bot
+
+# Caché de miembros: con "completo" discord.py pide (chunk) y guarda todos los
+# miembros de cada servidor al arrancar, y la memoria crece con el total de
+# miembros. Los handlers solo usan al miembro que entra o sale y a los usuarios
+# de las interacciones, que llegan en el propio evento, así que por defecto solo
+# se guardan los miembros en canales de voz; el resto se pide a Discord cuando
+# hace falta (miembros_recientes). Medición: python tools/memoria_miembros.py
+POLITICAS_MIEMBROS = {
+    # política -> (MemberCacheFlags, chunk_guilds_at_startup)
+    "completo": (discord.MemberCacheFlags.all(), True),
+    "voz": (discord.MemberCacheFlags(voice=True, joined=False), False),
+    "ninguno": (discord.MemberCacheFlags.none(), False),
+}
+if MEMBER_CACHE not in POLITICAS_MIEMBROS:
+    raise RuntimeError(f"MEMBER_CACHE debe ser uno de {', '.join(POLITICAS_MIEMBROS)}, no {MEMBER_CACHE!r}")
+flags_miembros, chunk_al_iniciar = POLITICAS_MIEMBROS[MEMBER_CACHE]
+
+class DragonsBot(BotBase):
+    async def setup_hook(self):
+        # Vistas persistentes: los botones de paneles y tickets existentes siguen funcionando tras reiniciar
+        self.add_view(TicketButton())
+        self.add_view(TicketControls())
+        diario.iniciar()
+        replica.iniciar()
+        registro_usuarios.iniciar()
+        actualizar_estadisticas.start()
+        self._retraso_loop = asyncio.create_task(medir_retraso_loop())
+        if vigilante_loop:
+            vigilante_loop.iniciar()
+        self._servidor_web = await iniciar_servidor_web()
+        # Render y Docker paran el proceso con SIGTERM: cerrar limpiamente para vaciar los lotes
+        try:
+            self.loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.close()))
+        except NotImplementedError:
+            pass
+
+    async def close(self):
+        actualizar_estadisticas.cancel()
+        if getattr(self, "_retraso_loop", None):
+            self._retraso_loop.cancel()
+        if vigilante_loop:
+            vigilante_loop.detener()
+        replica.detener()
+        await registro_usuarios.detener()
+        await diario.detener()
+        await logs_agrupados.vaciar()
+        await repartidor_dms.detener()
+        if getattr(self, "_servidor_web", None):
+            await self._servidor_web.cleanup()
+        await super().close()
+
+bot = DragonsBot(
+    command_prefix="!",
+    intents=intents,
+    member_cache_flags=flags_miembros,
+    chunk_guilds_at_startup=chunk_al_iniciar,
+    **opciones_shards
+)
 
 start_time = datetime.datetime.utcnow()
 
+# ==============================
+# MIEMBROS Y USUARIOS BAJO DEMANDA
+# ==============================
+# Lo que no está en la caché de discord.py (ver MEMBER_CACHE) se pide a la API
+# y se guarda en una LRU pequeña para no repetir la petición.
+class CacheMiembros:
+    def __init__(self, max_entradas=MIEMBROS_CACHE_MAX):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()  # (guild_id, user_id) -> Member; guild_id 0 -> User
+
+    def _leer(self, clave):
+        valor = self._datos.get(clave)
+        metricas.incrementar("dragons_cache_miembros_total", resultado="acierto" if valor else "fallo")
+        if valor is not None:
+            self._datos.move_to_end(clave)
+        return valor
+
+    def _guardar(self, clave, valor):
+        self._datos[clave] = valor
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+
+    async def miembro(self, guild, user_id):
+        """Devolver el miembro del servidor (o None si ya no está)"""
+        miembro = guild.get_member(user_id) or self._leer((guild.id, user_id))
+        if miembro is None:
+            try:
+                with fase("discord"):
+                    miembro = await guild.fetch_member(user_id)
+            except discord.NotFound:
+                return None
+            self._guardar((guild.id, user_id), miembro)
+        return miembro
+
+    async def usuario(self, user_id):
+        """Devolver el usuario de Discord (lanza discord.NotFound si no existe)"""
+        usuario = bot.get_user(user_id) or self._leer((0, user_id))
+        if usuario is None:
+            with fase("discord"):
+                usuario = await bot.fetch_user(user_id)
+            self._guardar((0, user_id), usuario)
+        return usuario
+
+    def olvidar(self, guild_id, user_id):
+        self._datos.pop((guild_id, user_id), None)
+
+    def __len__(self):
+        return len(self._datos)
+
+miembros_recientes = CacheMiembros()
+metricas.contador("dragons_cache_miembros_total", "Lecturas de la LRU de miembros y usuarios pedidos a la API")
+
+# ==============================
+# RESPUESTAS DIFERIDAS
+# ==============================
+# Discord exige reconocer cada interacción en 3 segundos. @diferido hace el
+# defer al instante, ejecuta el handler y las respuestas se envían con
+# responder(), que usa followup cuando la interacción ya fue reconocida.
+def diferido(ephemeral=False):
+    def decorador(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            interaction = next(arg for arg in args if isinstance(arg, discord.Interaction))
+            fases = {}
+            token = _fases_actuales.set(fases)
+            inicio = time.perf_counter()
+            resultado = "error"
+            try:
+                with fase("defer"):
+                    await interaction.response.defer(ephemeral=ephemeral, thinking=True)
+                interaction.extras["respuesta_publica"] = not ephemeral
+                respuesta = await func(*args, **kwargs)
+                resultado = "ok"
+                return respuesta
+            finally:
+                _fases_actuales.reset(token)
+                # Se mide hasta la respuesta al usuario, no lo que el handler haga después
+                total = interaction.extras.get("respondido_at", time.perf_counter()) - inicio
+                metricas.incrementar("dragons_comandos_total", comando=func.__name__, resultado=resultado)
+                metricas.observar("dragons_comando_segundos", total, comando=func.__name__)
+                if total > LATENCIA_PRESUPUESTO:
+                    detalle = ", ".join(f"{nombre}={t * 1000:.0f}ms" for nombre, t in sorted(fases.items(), key=lambda f: -f[1]))
+                    print(f"⚠️ {func.__name__} tardó {total * 1000:.0f}ms (presupuesto {LATENCIA_PRESUPUESTO * 1000:.0f}ms): {detalle}")
+        return wrapper
+    return decorador
+
+async def responder(interaction, *args, **kwargs):
+    """Responder a la interacción, con followup si ya fue diferida"""
+    with fase("discord"):
+        if not interaction.response.is_done():
+            mensaje = await interaction.response.send_message(*args, **kwargs)
+        else:
+            # El primer followup reemplaza el "pensando..." y hereda su visibilidad:
+            # para un mensaje efímero en un comando público se borra primero.
+            if interaction.extras.pop("respuesta_publica", False) and kwargs.get("ephemeral"):
+                await interaction.delete_original_response()
+            mensaje = await interaction.followup.send(*args, **kwargs)
+    interaction.extras.setdefault("respondido_at", time.perf_counter())
+    return mensaje
+
 # ==============================
 # EMOJIS PERSONALIZADOS
 # ==============================
@@ -58,6 +1484,129 @@ EMOJI_LOCK = "🔒"
 EMOJI_UNLOCK = "🔓"
 EMOJI_CLOSE = "❌"
 
+# ==============================
+# DETECCIÓN DE RAIDS
+# ==============================
+# Cada servidor guarda los instantes de sus últimas RAID_ENTRADAS entradas en
+# un anillo (O(1) por evento): si la más antigua tiene menos de RAID_VENTANA
+# segundos, el servidor entra en modo raid. Mientras dure, las bienvenidas se
+# agrupan en un único embed cada RAID_RESUMEN segundos y se avisa en el canal
+# de logs de ticket_config. El modo termina tras RAID_DURACION segundos sin picos.
+class DetectorRaids:
+    def __init__(self, entradas=RAID_ENTRADAS, ventana=RAID_VENTANA, duracion=RAID_DURACION, resumen=RAID_RESUMEN):
+        self.entradas = entradas
+        self.ventana = ventana
+        self.duracion = duracion
+        self.resumen = resumen
+        self._anillos = {}     # guild_id -> deque(maxlen=entradas) con los instantes de entrada
+        self._raid_hasta = {}  # guild_id -> time.monotonic() en que termina el modo raid
+        self._pendientes = {}  # guild_id -> miembros que aún no salieron en un resumen
+        self._totales = {}     # guild_id -> entradas agrupadas durante el raid en curso
+        self._tareas = {}      # guild_id -> tarea que publica los resúmenes
+        self._recientes = {}   # guild_id -> deque(maxlen=ENTRADAS_RECIENTES_MAX) de (time.time(), user_id)
+
+    def en_raid(self, guild_id):
+        return self._raid_hasta.get(guild_id, 0) > time.monotonic()
+
+    def registrar(self, member):
+        """Anotar la entrada y devolver True si su bienvenida va al resumen del raid"""
+        guild_id = member.guild.id
+        recientes = self._recientes.get(guild_id)
+        if recientes is None:
+            recientes = self._recientes[guild_id] = deque(maxlen=ENTRADAS_RECIENTES_MAX)
+        recientes.append((time.time(), member.id))
+        if self.entradas <= 0:
+            return False
+        ahora = time.monotonic()
+        anillo = self._anillos.get(guild_id)
+        if anillo is None:
+            anillo = self._anillos[guild_id] = deque(maxlen=self.entradas)
+        anillo.append(ahora)
+        if len(anillo) == self.entradas and ahora - anillo[0] <= self.ventana:
+            self._raid_hasta[guild_id] = ahora + self.duracion
+        if not self.en_raid(guild_id):
+            return False
+
+        self._pendientes.setdefault(guild_id, []).append(member)
+        self._totales[guild_id] = self._totales.get(guild_id, 0) + 1
+        if guild_id not in self._tareas:
+            metricas.incrementar("dragons_raids_total")
+            self._tareas[guild_id] = asyncio.create_task(self._atender_raid(member.guild))
+        return True
+
+    def recientes(self, guild_id, minutos):
+        """IDs de quienes entraron al servidor en los últimos `minutos`"""
+        desde = time.time() - minutos * 60
+        return [user_id for instante, user_id in self._recientes.get(guild_id, ()) if instante >= desde]
+
+    def __len__(self):
+        return len(self._tareas)
+
+    async def _atender_raid(self, guild):
+        print(f"🚨 Modo raid activado en {guild.name}")
+        try:
+            await self._alertar(guild, discord.Embed(
+                title=f"{EMOJI_ALERT} Posible raid detectado",
+                description=(
+                    f"Han entrado {self.entradas} cuentas en menos de {self.ventana:g} segundos.\n"
+                    f"Las bienvenidas se agruparán cada {self.resumen:g} segundos hasta que pasen "
+                    f"{self.duracion:g} segundos sin picos de entradas."
+                ),
+                color=discord.Color.red()
+            ))
+            while True:
+                await asyncio.sleep(self.resumen)
+                await self._publicar_resumen(guild)
+                # Sin await entre esta comprobación y quitar la tarea: una entrada posterior abre un raid nuevo
+                if not self.en_raid(guild.id) and not self._pendientes.get(guild.id):
+                    break
+        finally:
+            self._tareas.pop(guild.id, None)
+            self._raid_hasta.pop(guild.id, None)
+            total = self._totales.pop(guild.id, 0)
+        print(f"✅ Modo raid finalizado en {guild.name} ({total} entradas agrupadas)")
+        await self._alertar(guild, discord.Embed(
+            title="✅ Raid finalizado",
+            description=f"Se agruparon las bienvenidas de **{total}** cuentas. Las bienvenidas vuelven a ser individuales.",
+            color=discord.Color.green()
+        ))
+
+    async def _publicar_resumen(self, guild):
+        miembros = self._pendientes.pop(guild.id, [])
+        if not miembros:
+            return
+        try:
+            config = await config_cache.obtener("bienvenidas", str(guild.id))
+            canal = guild.get_channel(int(config["canal_id"])) if config else None
+            if canal is None:
+                return
+            mostrados = " ".join(m.mention for m in miembros[:40])
+            restantes = f"\n...y {len(miembros) - 40} más" if len(miembros) > 40 else ""
+            embed = discord.Embed(
+                title=f"{config['encabezado']} ({len(miembros)} nuevos miembros)",
+                description=mostrados + restantes,
+                color=discord.Color.dark_red()
+            )
+            embed.set_image(url=config["gif"])
+            embed.set_footer(text="🐲 Dragons | Bienvenido al fuego eterno")
+            await canal.send(embed=embed)
+        except Exception as e:
+            print(f"❌ Error publicando el resumen de bienvenidas: {e}")
+
+    async def _alertar(self, guild, embed):
+        try:
+            config = await config_cache.obtener("ticket_config", str(guild.id))
+            canal = guild.get_channel(int(config["canal_logs_id"])) if config and config.get("canal_logs_id") else None
+            if canal:
+                embed.timestamp = datetime.datetime.utcnow()
+                logs_agrupados.publicar(canal, embed, urgente=True)
+        except Exception as e:
+            print(f"❌ Error enviando la alerta de raid: {e}")
+
+detector_raids = DetectorRaids()
+metricas.contador("dragons_raids_total", "Veces que un servidor entró en modo raid")
+metricas.medidor("dragons_servidores_en_raid", "Servidores en modo raid ahora mismo", lambda: len(detector_raids))
+
 # ==============================
 # EVENTOS DE REGISTRO AUTOMÁTICO
 # ==============================
@@ -65,11 +1614,11 @@ EMOJI_CLOSE = "❌"
 async def on_guild_join(guild):
     """Registrar servidor cuando el bot entra"""
     try:
-        supabase.table("servers").upsert({
+        await diario.escribir("servers", "upsert", {
             "guild_id": str(guild.id),
             "guild_name": guild.name,
             "joined_at": datetime.datetime.utcnow().isoformat()
-        }).execute()
+        })
         print(f"✅ Servidor registrado: {guild.name}")
     except Exception as e:
         print(f"❌ Error registrando servidor: {e}")
@@ -78,19 +1627,22 @@ async def on_guild_join(guild):
 async def on_member_join(member):
     """Enviar bienvenida y registrar usuario"""
     try:
-        # Registrar usuario en Supabase
-        supabase.table("usuarios").upsert({
+        # Registrar usuario en Supabase (se envía en lote, no bloquea la bienvenida)
+        registro_usuarios.agregar({
             "user_id": str(member.id),
             "username": member.name,
             "joined_at": datetime.datetime.utcnow().isoformat()
-        }).execute()
+        })
+
+        # En modo raid la bienvenida sale en el resumen agrupado
+        if detector_raids.registrar(member):
+            return
 
         # Buscar configuración de bienvenida
         guild_id = str(member.guild.id)
-        data = supabase.table("bienvenidas").select("*").eq("guild_id", guild_id).execute()
+        config = await config_cache.obtener("bienvenidas", guild_id)
 
-        if data.data:
-            config = data.data[0]
+        if config:
             canal = member.guild.get_channel(int(config["canal_id"]))
             if canal:
                 embed = discord.Embed(
@@ -112,12 +1664,47 @@ async def on_member_join(member):
 @bot.event
 async def on_ready():
     print(f"🐉 El bot {bot.user} está activo y rugiendo.")
+    if not _tickets_reconciliados:
+        try:
+            await reconciliar_tickets()
+        except Exception as e:
+            print(f"❌ Error reconciliando tickets abiertos: {e}")
+    # Los comandos son globales: con varios procesos, solo sincroniza el que tiene el shard 0
+    if getattr(bot, "shard_ids", None) and 0 not in bot.shard_ids:
+        return
     try:
         synced = await bot.tree.sync()
         print(f"✅ {len(synced)} comandos sincronizados.")
     except Exception as e:
         print(f"❌ Error al sincronizar comandos: {e}")
 
+# ==============================
+# EVENTOS DE SHARDS
+# ==============================
+# Solo se emiten con AutoShardedBot. El tiempo hasta el primer READY de cada
+# shard se expone en /metrics para ver cómo crece el arranque con los servidores.
+metricas.contador("dragons_shard_eventos_total", "Conexiones, desconexiones, READY y RESUME por shard")
+_shards_listos_en = {}  # shard_id -> segundos desde el arranque hasta su primer READY
+
+@bot.listen("on_shard_ready")
+async def registrar_shard_listo(shard_id):
+    metricas.incrementar("dragons_shard_eventos_total", shard=shard_id, evento="ready")
+    if shard_id not in _shards_listos_en:
+        _shards_listos_en[shard_id] = (datetime.datetime.utcnow() - start_time).total_seconds()
+        print(f"🧩 Shard {shard_id} listo en {_shards_listos_en[shard_id]:.1f}s")
+
+@bot.listen("on_shard_connect")
+async def registrar_shard_conectado(shard_id):
+    metricas.incrementar("dragons_shard_eventos_total", shard=shard_id, evento="connect")
+
+@bot.listen("on_shard_disconnect")
+async def registrar_shard_desconectado(shard_id):
+    metricas.incrementar("dragons_shard_eventos_total", shard=shard_id, evento="disconnect")
+
+@bot.listen("on_shard_resumed")
+async def registrar_shard_reanudado(shard_id):
+    metricas.incrementar("dragons_shard_eventos_total", shard=shard_id, evento="resumed")
+
 # ==============================
 # COMANDO /CREAR-BIENVENIDA
 # ==============================
@@ -129,6 +1716,7 @@ async def on_ready():
     gif="URL del GIF o imagen.",
     color="Color del embed en formato hexadecimal (ejemplo: #4169e1 o 4169e1)"
 )
+@diferido(ephemeral=True)
 async def crear_bienvenida(interaction: discord.Interaction, canal: discord.TextChannel, encabezado: str, texto: str, gif: str, color: str = "#0099ff"):
     guild_id = str(interaction.guild.id)
 
@@ -137,7 +1725,7 @@ async def crear_bienvenida(interaction: discord.Interaction, canal: discord.Text
     
     # Validar que sea un color hexadecimal válido
     if len(color_limpio) != 6 or not all(c in '0123456789abcdefABCDEF' for c in color_limpio):
-        await interaction.response.send_message(
+        await responder(interaction,
             "❌ **Color inválido.** Usa un formato hexadecimal válido.\n"
             "**Ejemplos:** `#4169e1`, `4169e1`, `#ff0000`, `00ff00`",
             ephemeral=True
@@ -149,14 +1737,16 @@ async def crear_bienvenida(interaction: discord.Interaction, canal: discord.Text
         color_int = int(color_limpio, 16)
         color_embed = discord.Color(color_int)
 
-        supabase.table("bienvenidas").upsert({
+        fila = {
             "guild_id": guild_id,
             "canal_id": canal.id,
             "encabezado": encabezado,
             "texto": texto,
             "gif": gif,
             "color": color_limpio
-        }).execute()
+        }
+        respuesta = await db_query("bienvenidas", lambda t: t.upsert(fila))
+        config_cache.guardar("bienvenidas", guild_id, respuesta.data[0] if respuesta.data else fila)
 
         embed = discord.Embed(
             title=f"{EMOJI_DRAGON} **[ DV ] Dragons Statistics**",
@@ -165,10 +1755,10 @@ async def crear_bienvenida(interaction: discord.Interaction, canal: discord.Text
         )
         embed.set_image(url=gif)
         embed.set_footer(text="Sistema de Bienvenida • Dragons")
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        await responder(interaction, embed=embed, ephemeral=True)
 
     except Exception as e:
-        await interaction.response.send_message(f"❌ Error al guardar la configuración: {e}", ephemeral=True)
+        await responder(interaction, f"❌ Error al guardar la configuración: {e}", ephemeral=True)
 
 # ==============================
 # SISTEMA DE TICKETS - CONFIGURACIÓN
@@ -184,6 +1774,7 @@ async def crear_bienvenida(interaction: discord.Interaction, canal: discord.Text
     color="Color del embed (hex, ej: #4169e1)"
 )
 @app_commands.checks.has_permissions(administrator=True)
+@diferido(ephemeral=True)
 async def ticket_config(
     interaction: discord.Interaction,
     categoria: discord.CategoryChannel,
@@ -197,12 +1788,12 @@ async def ticket_config(
     color_limpio = color.lstrip('#')
     
     if len(color_limpio) != 6 or not all(c in '0123456789abcdefABCDEF' for c in color_limpio):
-        await interaction.response.send_message("❌ Color inválido. Usa formato hexadecimal.", ephemeral=True)
+        await responder(interaction, "❌ Color inválido. Usa formato hexadecimal.", ephemeral=True)
         return
 
     try:
         # Guardar configuración en Supabase
-        supabase.table("ticket_config").upsert({
+        fila = {
             "guild_id": guild_id,
             "categoria_id": str(categoria.id),
             "canal_logs_id": str(canal_logs.id),
@@ -210,7 +1801,9 @@ async def ticket_config(
             "titulo": titulo,
             "descripcion": descripcion,
             "color": color_limpio
-        }).execute()
+        }
+        respuesta = await db_query("ticket_config", lambda t: t.upsert(fila))
+        config_cache.guardar("ticket_config", guild_id, respuesta.data[0] if respuesta.data else fila)
 
         embed = discord.Embed(
             title=f"{EMOJI_TICKET} Configuración de Tickets Guardada",
@@ -224,29 +1817,29 @@ async def ticket_config(
             color=discord.Color(int(color_limpio, 16))
         )
         embed.set_footer(text="Sistema de Tickets • Dragons")
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        await responder(interaction, embed=embed, ephemeral=True)
 
     except Exception as e:
-        await interaction.response.send_message(f"❌ Error al guardar configuración: {e}", ephemeral=True)
+        await responder(interaction, f"❌ Error al guardar configuración: {e}", ephemeral=True)
 
 
 @bot.tree.command(name="ticket-panel", description="Crea el panel de tickets en este canal (solo administradores)")
 @app_commands.checks.has_permissions(administrator=True)
+@diferido(ephemeral=True)
 async def ticket_panel(interaction: discord.Interaction):
     guild_id = str(interaction.guild.id)
     
     try:
         # Obtener configuración
-        config_data = supabase.table("ticket_config").select("*").eq("guild_id", guild_id).execute()
+        config = await config_cache.obtener("ticket_config", guild_id)
         
-        if not config_data.data:
-            await interaction.response.send_message(
+        if not config:
+            await responder(interaction,
                 "❌ No hay configuración de tickets. Usa `/ticket-config` primero.",
                 ephemeral=True
             )
             return
         
-        config = config_data.data[0]
         color = discord.Color(int(config["color"], 16))
         
         # Crear embed del panel
@@ -268,11 +1861,294 @@ async def ticket_panel(interaction: discord.Interaction):
         view = TicketButton()
         
         await interaction.channel.send(embed=embed, view=view)
-        await interaction.response.send_message("✅ Panel de tickets creado correctamente.", ephemeral=True)
+        await responder(interaction, "✅ Panel de tickets creado correctamente.", ephemeral=True)
         
     except Exception as e:
-        await interaction.response.send_message(f"❌ Error al crear panel: {e}", ephemeral=True)
+        await responder(interaction, f"❌ Error al crear panel: {e}", ephemeral=True)
+
+
+# ==============================
+# COLA DE CANALES DE TICKETS
+# ==============================
+# Crear y borrar canales comparte límites de Discord por servidor. Cada servidor
+# tiene su propia cola atendida por un único worker: los trabajos se ejecutan de
+# uno en uno con CANALES_INTERVALO segundos entre ellos y los clics repetidos
+# del mismo usuario se unen al trabajo que ya está en cola. Al chocar con un
+# rate limit solo se reintenta la llamada de crear o borrar el canal
+# (reintentar()), nunca el trabajo entero: repetirlo duplicaría números,
+# canales y filas del ticket.
+class ColaCanales:
+    def __init__(self, intervalo=CANALES_INTERVALO, reintentos=CANALES_REINTENTOS):
+        self.intervalo = intervalo
+        self.reintentos = reintentos
+        self._colas = {}      # guild_id -> deque[(clave, trabajo, futuro)]
+        self._workers = {}    # guild_id -> Task
+        self._en_cola = {}    # (guild_id, clave) -> futuro
+
+    def encolar(self, guild_id, clave, trabajo):
+        """Encolar `trabajo` (coroutine function) y devolver (futuro, posición, es_nuevo)"""
+        cola = self._colas.setdefault(guild_id, deque())
+        existente = self._en_cola.get((guild_id, clave))
+        if existente is not None:
+            posicion = next((i for i, (c, _, _) in enumerate(cola, 1) if c == clave), 1)
+            return existente, posicion, False
+
+        futuro = asyncio.get_running_loop().create_future()
+        cola.append((clave, trabajo, futuro))
+        self._en_cola[(guild_id, clave)] = futuro
+        if guild_id not in self._workers:
+            self._workers[guild_id] = asyncio.create_task(self._atender(guild_id))
+        return futuro, len(cola), True
+
+    def pendientes(self):
+        return sum(len(cola) for cola in self._colas.values())
+
+    async def _atender(self, guild_id):
+        cola = self._colas[guild_id]
+        try:
+            while cola:
+                clave, trabajo, futuro = cola[0]
+                try:
+                    resultado = await trabajo()
+                    # El futuro puede estar cancelado si quien lo esperaba se canceló
+                    if not futuro.done():
+                        futuro.set_result(resultado)
+                except Exception as e:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                finally:
+                    cola.popleft()
+                    self._en_cola.pop((guild_id, clave), None)
+                if cola:
+                    await asyncio.sleep(self.intervalo)
+        finally:
+            del self._workers[guild_id]
+            if not cola:
+                del self._colas[guild_id]
+
+    async def reintentar(self, llamada):
+        """Ejecutar `llamada()` (una sola petición a Discord) reintentándola ante un rate limit"""
+        for intento in range(self.reintentos):
+            ultimo = intento == self.reintentos - 1
+            try:
+                return await llamada()
+            except discord.RateLimited as e:
+                if ultimo:
+                    raise
+                espera = e.retry_after
+            except discord.HTTPException as e:
+                if e.status != 429 or ultimo:
+                    raise
+                espera = 2 ** intento
+            print(f"⚠️ Rate limit creando/borrando canales, reintentando en {espera:.1f}s")
+            await asyncio.sleep(espera)
+
+cola_canales = ColaCanales()
+
+# ==============================
+# LOGS AGRUPADOS POR CANAL
+# ==============================
+# Los embeds de log se acumulan por canal y se envían juntos (hasta 10 por
+# mensaje, el máximo de Discord) cada LOGS_INTERVALO segundos, así un servidor
+# con mucho movimiento no gasta un mensaje (y su rate limit) por evento. Los
+# eventos urgentes vacían la cola del canal al momento. publicar() devuelve un
+# futuro que se resuelve a True cuando el embed se envió. Los adjuntos de un
+# mensaje no pasan del límite de subida del servidor y, si un envío falla, el
+# lote se parte en dos y se reintenta cada mitad en vez de perderlo entero.
+MAX_EMBEDS_MENSAJE = 10
+MAX_CARACTERES_MENSAJE = 6000  # suma de todos los embeds de un mensaje
+MAX_BYTES_MENSAJE = 10 * 1024 * 1024  # límite de subida de Discord sin mejoras
+
+def _tamano_archivo(ruta):
+    if not ruta:
+        return 0
+    try:
+        return os.path.getsize(ruta)
+    except OSError:
+        return 0
+
+class LogsAgrupados:
+    def __init__(self, intervalo=LOGS_INTERVALO):
+        self.intervalo = intervalo
+        self._colas = {}     # canal_id -> list[(embed, ruta_archivo, futuro)]
+        self._urgente = {}   # canal_id -> asyncio.Event
+        self._workers = {}   # canal_id -> Task
+
+    def publicar(self, canal, embed, archivo=None, urgente=False):
+        cola = self._colas.setdefault(canal.id, [])
+        futuro = asyncio.get_running_loop().create_future()
+        cola.append((embed, archivo, futuro))
+        evento = self._urgente.setdefault(canal.id, asyncio.Event())
+        if urgente or len(cola) >= MAX_EMBEDS_MENSAJE:
+            evento.set()
+        if canal.id not in self._workers:
+            self._workers[canal.id] = asyncio.create_task(self._atender(canal))
+        return futuro
+
+    def pendientes(self):
+        return sum(len(cola) for cola in self._colas.values())
+
+    async def vaciar(self):
+        """Enviar ya todo lo pendiente (al apagar el bot)"""
+        for evento in self._urgente.values():
+            evento.set()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    async def _atender(self, canal):
+        cola = self._colas[canal.id]
+        evento = self._urgente[canal.id]
+        try:
+            while cola:
+                try:
+                    await asyncio.wait_for(evento.wait(), self.intervalo)
+                except asyncio.TimeoutError:
+                    pass
+                evento.clear()
+                max_bytes = getattr(canal.guild, "filesize_limit", MAX_BYTES_MENSAJE)
+                while cola:
+                    await self._enviar(canal, self._siguiente_lote(cola, max_bytes))
+        finally:
+            del self._workers[canal.id]
+            if not cola:
+                del self._colas[canal.id]
+                del self._urgente[canal.id]
+
+    @staticmethod
+    def _siguiente_lote(cola, max_bytes=MAX_BYTES_MENSAJE):
+        lote, caracteres, tamano = [], 0, 0
+        for embed, archivo, futuro in cola:
+            peso = _tamano_archivo(archivo)
+            if len(lote) == MAX_EMBEDS_MENSAJE or (lote and (
+                caracteres + len(embed) > MAX_CARACTERES_MENSAJE or tamano + peso > max_bytes
+            )):
+                break
+            lote.append((embed, archivo, futuro))
+            caracteres += len(embed)
+            tamano += peso
+        del cola[:len(lote)]
+        return lote
+
+    async def _enviar(self, canal, lote, con_archivos=True):
+        try:
+            archivos = [discord.File(archivo) for _, archivo, _ in lote if archivo and con_archivos]
+            await canal.send(embeds=[embed for embed, _, _ in lote], files=archivos)
+            metricas.incrementar("dragons_logs_mensajes_total")
+            metricas.incrementar("dragons_logs_embeds_total", len(lote))
+            enviado = True
+        except Exception as e:
+            if len(lote) > 1:
+                # Un embed o adjunto que Discord rechaza no se lleva por delante al resto
+                mitad = len(lote) // 2
+                print(f"⚠️ Error enviando {len(lote)} logs a #{canal.name} ({e}), reintentando en dos partes")
+                await self._enviar(canal, lote[:mitad], con_archivos)
+                await self._enviar(canal, lote[mitad:], con_archivos)
+                return
+            if con_archivos and lote[0][1] and getattr(e, "status", None) == 413:
+                # Transcript demasiado grande para adjuntarlo: el log sale sin él
+                print(f"⚠️ Transcript demasiado grande para #{canal.name}, se envía el log sin adjunto")
+                await self._enviar(canal, lote, con_archivos=False)
+                return
+            print(f"❌ Error enviando log a #{canal.name}: {e}")
+            enviado = False
+        for _, _, futuro in lote:
+            if not futuro.done():
+                futuro.set_result(enviado)
 
+logs_agrupados = LogsAgrupados()
+metricas.contador("dragons_logs_mensajes_total", "Mensajes enviados a canales de logs")
+metricas.contador("dragons_logs_embeds_total", "Embeds de log enviados (varios por mensaje)")
+metricas.medidor("dragons_logs_pendientes", "Embeds de log esperando a enviarse", lambda: logs_agrupados.pendientes())
+
+# ==============================
+# ENVÍO DE DMS EN SEGUNDO PLANO
+# ==============================
+# Los avisos por DM de moderación se encolan y los envían DM_CONCURRENCIA
+# workers a un ritmo global de DM_POR_SEGUNDO, así el comando responde al
+# momento y una moderación masiva no dispara el anti-spam de Discord. Quien
+# tiene los DMs cerrados (403) se salta durante DM_CERRADOS_TTL segundos.
+class RepartidorDMs:
+    def __init__(self, concurrencia=DM_CONCURRENCIA, por_segundo=DM_POR_SEGUNDO,
+                 cerrados_ttl=DM_CERRADOS_TTL, cola_max=DM_COLA_MAX):
+        self.concurrencia = concurrencia
+        self.intervalo = 1 / por_segundo if por_segundo > 0 else 0
+        self.cerrados_ttl = cerrados_ttl
+        self.cola_max = cola_max
+        self._cola = None
+        self._workers = []
+        self._cerrados = OrderedDict()  # user_id -> time.monotonic() hasta el que no se reintenta
+        self._ritmo = asyncio.Lock()
+        self._proximo_envio = 0.0
+
+    def enviar(self, usuario, **kwargs):
+        """Encolar un DM para `usuario`; devuelve False si se descarta sin intentarlo"""
+        if self._dms_cerrados(usuario.id):
+            metricas.incrementar("dragons_dm_total", resultado="omitido")
+            return False
+        if self._cola is None:
+            self._cola = asyncio.Queue(maxsize=self.cola_max)
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrencia)]
+        try:
+            self._cola.put_nowait((time.perf_counter(), usuario, kwargs))
+        except asyncio.QueueFull:
+            metricas.incrementar("dragons_dm_total", resultado="descartado")
+            print(f"⚠️ Cola de DMs llena ({self.cola_max}), se descarta el DM a {usuario}")
+            return False
+        return True
+
+    def pendientes(self):
+        return self._cola.qsize() if self._cola else 0
+
+    async def vaciar(self, timeout=None):
+        """Esperar a que se envíen los DMs en cola"""
+        if self._cola:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._cola.join(), timeout)
+
+    async def detener(self, timeout=5):
+        await self.vaciar(timeout)
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        self._cola = None
+
+    def _dms_cerrados(self, user_id):
+        ahora = time.monotonic()
+        while self._cerrados and next(iter(self._cerrados.values())) <= ahora:
+            self._cerrados.popitem(last=False)
+        return user_id in self._cerrados
+
+    async def _esperar_turno(self):
+        async with self._ritmo:
+            espera = self._proximo_envio - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            self._proximo_envio = time.monotonic() + self.intervalo
+
+    async def _worker(self):
+        while True:
+            encolado, usuario, kwargs = await self._cola.get()
+            try:
+                if self._dms_cerrados(usuario.id):
+                    metricas.incrementar("dragons_dm_total", resultado="omitido")
+                    continue
+                await self._esperar_turno()
+                metricas.observar("dragons_dm_espera_segundos", time.perf_counter() - encolado)
+                await usuario.send(**kwargs)
+                metricas.incrementar("dragons_dm_total", resultado="enviado")
+            except discord.Forbidden:
+                self._cerrados[usuario.id] = time.monotonic() + self.cerrados_ttl
+                self._cerrados.move_to_end(usuario.id)
+                metricas.incrementar("dragons_dm_total", resultado="dms_cerrados")
+            except Exception as e:
+                metricas.incrementar("dragons_dm_total", resultado="error")
+                print(f"❌ Error enviando DM a {usuario}: {e}")
+            finally:
+                self._cola.task_done()
+
+repartidor_dms = RepartidorDMs()
+metricas.contador("dragons_dm_total", "DMs de moderación por resultado")
+metricas.histograma("dragons_dm_espera_segundos", "Tiempo en cola de los DMs hasta su envío")
+metricas.medidor("dragons_dm_pendientes", "DMs de moderación en cola", lambda: repartidor_dms.pendientes())
 
 # ==============================
 # BOTÓN PARA CREAR TICKETS
@@ -282,32 +2158,40 @@ class TicketButton(discord.ui.View):
         super().__init__(timeout=None)
     
     @discord.ui.button(label="Crear Ticket", style=discord.ButtonStyle.green, emoji="🎫", custom_id="create_ticket")
+    @diferido(ephemeral=True)
     async def create_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
         guild_id = str(interaction.guild.id)
         user_id = str(interaction.user.id)
         
         try:
             # Verificar si el usuario ya tiene un ticket abierto
-            existing = supabase.table("tickets").select("*").eq("guild_id", guild_id).eq("user_id", user_id).eq("estado", "abierto").execute()
+            if replica.lista:
+                abiertos = replica.tickets_abiertos(guild_id, user_id)
+            else:
+                existing = await db_query("tickets", lambda t: t.select("*").eq("guild_id", guild_id).eq("user_id", user_id).eq("estado", "abierto"))
+                # Tickets abiertos hace un momento que aún están en el diario
+                abiertos = existing.data + [
+                    t for t in await diario.pendientes_de("tickets", guild_id=guild_id, user_id=user_id)
+                    if int(t["canal_id"]) in tickets_abiertos
+                ]
             
-            if existing.data:
-                await interaction.response.send_message(
-                    f"❌ Ya tienes un ticket abierto: <#{existing.data[0]['canal_id']}>",
+            if abiertos:
+                await responder(interaction,
+                    f"❌ Ya tienes un ticket abierto: <#{abiertos[0]['canal_id']}>",
                     ephemeral=True
                 )
                 return
             
             # Obtener configuración
-            config_data = supabase.table("ticket_config").select("*").eq("guild_id", guild_id).execute()
+            config = await config_cache.obtener("ticket_config", guild_id)
             
-            if not config_data.data:
-                await interaction.response.send_message(
+            if not config:
+                await responder(interaction,
                     "❌ El sistema de tickets no está configurado.",
                     ephemeral=True
                 )
                 return
             
-            config = config_data.data[0]
             categoria = interaction.guild.get_channel(int(config["categoria_id"]))
             rol_soporte = interaction.guild.get_role(int(config["rol_soporte_id"]))
             
@@ -319,59 +2203,181 @@ class TicketButton(discord.ui.View):
                 interaction.guild.me: PermissionOverwrite(view_channel=True, send_messages=True, manage_channels=True)
             }
             
-            ticket_number = len(supabase.table("tickets").select("id").eq("guild_id", guild_id).execute().data) + 1
-            canal_ticket = await categoria.create_text_channel(
-                name=f"ticket-{ticket_number}-{interaction.user.name}",
-                overwrites=overwrites
-            )
-            
-            # Guardar en base de datos
-            supabase.table("tickets").insert({
-                "guild_id": guild_id,
-                "user_id": user_id,
-                "canal_id": str(canal_ticket.id),
-                "numero": ticket_number,
-                "estado": "abierto"
-            }).execute()
-            
-            # Embed de bienvenida en el ticket
-            embed_ticket = discord.Embed(
-                title=f"{EMOJI_TICKET} Ticket #{ticket_number}",
-                description=f"Hola {interaction.user.mention}, bienvenido a tu ticket.\n\n{EMOJI_FIRE} **El equipo de soporte te atenderá pronto.**",
-                color=discord.Color(int(config["color"], 16))
-            )
-            embed_ticket.add_field(
-                name=f"{EMOJI_NOTES} Instrucciones",
-                value="• Explica tu problema con detalle\n• Sé paciente, el staff responderá pronto\n• Usa los botones de abajo para gestionar el ticket",
-                inline=False
-            )
-            embed_ticket.set_footer(text="Sistema de Tickets • Dragons")
-            embed_ticket.timestamp = datetime.datetime.utcnow()
-            
-            # Botones de control del ticket
-            view_controls = TicketControls()
+            async def abrir_ticket():
+                ticket_number = await numerador_tickets.siguiente(guild_id)
+                canal_ticket = await cola_canales.reintentar(lambda: categoria.create_text_channel(
+                    name=f"ticket-{ticket_number}-{interaction.user.name}",
+                    overwrites=overwrites
+                ))
+                iniciar_registro(canal_ticket, ticket_number)
+                
+                # Guardar en base de datos
+                fila_ticket = {
+                    "guild_id": guild_id,
+                    "user_id": user_id,
+                    "canal_id": str(canal_ticket.id),
+                    "numero": ticket_number,
+                    "estado": "abierto"
+                }
+                await diario.escribir("tickets", "insert", fila_ticket)
+                replica.guardar("tickets", fila_ticket)
+                
+                # Embed de bienvenida en el ticket
+                embed_ticket = discord.Embed(
+                    title=f"{EMOJI_TICKET} Ticket #{ticket_number}",
+                    description=f"Hola {interaction.user.mention}, bienvenido a tu ticket.\n\n{EMOJI_FIRE} **El equipo de soporte te atenderá pronto.**",
+                    color=discord.Color(int(config["color"], 16))
+                )
+                embed_ticket.add_field(
+                    name=f"{EMOJI_NOTES} Instrucciones",
+                    value="• Explica tu problema con detalle\n• Sé paciente, el staff responderá pronto\n• Usa los botones de abajo para gestionar el ticket",
+                    inline=False
+                )
+                embed_ticket.set_footer(text="Sistema de Tickets • Dragons")
+                embed_ticket.timestamp = datetime.datetime.utcnow()
+                
+                # Botones de control del ticket
+                view_controls = TicketControls()
+                
+                await canal_ticket.send(f"{interaction.user.mention} {rol_soporte.mention}", embed=embed_ticket, view=view_controls)
+                return canal_ticket, ticket_number
             
-            await canal_ticket.send(f"{interaction.user.mention} {rol_soporte.mention}", embed=embed_ticket, view=view_controls)
+            # Los clics repetidos del mismo usuario se unen al ticket que ya está en cola
+            trabajo, posicion, es_nuevo = cola_canales.encolar(guild_id, ("crear", user_id), abrir_ticket)
+            if posicion > 1:
+                await responder(interaction,
+                    f"⏳ Hay muchos tickets creándose ahora mismo. Estás en la posición **{posicion}** de la cola.",
+                    ephemeral=True
+                )
+            with fase("crear_canal"):
+                canal_ticket, ticket_number = await asyncio.shield(trabajo)
             
             # Log en canal de logs
             canal_logs = interaction.guild.get_channel(int(config["canal_logs_id"]))
-            if canal_logs:
+            if canal_logs and es_nuevo:
                 embed_log = discord.Embed(
                     title=f"{EMOJI_TICKET} Nuevo Ticket Creado",
                     description=f"**Usuario:** {interaction.user.mention}\n**Canal:** {canal_ticket.mention}\n**Ticket:** #{ticket_number}",
                     color=discord.Color.green()
                 )
                 embed_log.timestamp = datetime.datetime.utcnow()
-                await canal_logs.send(embed=embed_log)
+                logs_agrupados.publicar(canal_logs, embed_log)
             
-            await interaction.response.send_message(
+            await responder(interaction,
                 f"✅ Tu ticket ha sido creado: {canal_ticket.mention}",
                 ephemeral=True
             )
             
         except Exception as e:
-            await interaction.response.send_message(f"❌ Error al crear ticket: {e}", ephemeral=True)
+            await responder(interaction, f"❌ Error al crear ticket: {e}", ephemeral=True)
+
 
+# ==============================
+# TRANSCRIPTS DE TICKETS
+# ==============================
+# Cada mensaje de un ticket abierto se añade a TRANSCRIPTS_DIR/<canal_id>.log
+# desde on_message, así que cerrar un ticket solo comprime y sube ese archivo.
+# Los tickets abiertos antes de existir el registro (sin cabecera) se recorren
+# página a página como respaldo y se escriben directamente en un .txt.gz.
+CABECERA_TRANSCRIPT = "Transcript del ticket"
+tickets_abiertos = set()  # canal_id (int) de los tickets con estado "abierto"
+tickets_cerrando = set()  # canal_id (int) de los tickets que alguien está cerrando ahora
+
+def ruta_registro(canal_id):
+    return os.path.join(TRANSCRIPTS_DIR, f"{canal_id}.log")
+
+def ruta_transcript(guild_id, numero):
+    return os.path.join(TRANSCRIPTS_DIR, f"ticket-{guild_id}-{numero}.txt.gz")
+
+def iniciar_registro(canal, numero):
+    """Crear el registro incremental de un ticket recién abierto"""
+    os.makedirs(TRANSCRIPTS_DIR, exist_ok=True)
+    with open(ruta_registro(canal.id), "w", encoding="utf-8") as archivo:
+        archivo.write(f"{CABECERA_TRANSCRIPT} #{numero} ({canal.name})\n\n")
+    tickets_abiertos.add(canal.id)
+
+def registro_completo(canal_id):
+    try:
+        with open(ruta_registro(canal_id), encoding="utf-8") as archivo:
+            return archivo.readline().startswith(CABECERA_TRANSCRIPT)
+    except FileNotFoundError:
+        return False
+
+def _comprimir(origen, destino):
+    with open(origen, "rb") as entrada, gzip.open(destino, "wb", compresslevel=6) as salida:
+        shutil.copyfileobj(entrada, salida)
+    os.remove(origen)
+
+@bot.listen("on_message")
+async def registrar_mensaje_ticket(message):
+    if message.channel.id not in tickets_abiertos:
+        return
+    try:
+        with open(ruta_registro(message.channel.id), "a", encoding="utf-8") as archivo:
+            archivo.write(linea_transcript(message))
+    except OSError as e:
+        print(f"❌ Error registrando mensaje del ticket {message.channel.id}: {e}")
+
+def linea_transcript(msg):
+    linea = f"[{msg.created_at.strftime('%Y-%m-%d %H:%M')}] {msg.author.name}: {msg.content}"
+    for adjunto in msg.attachments:
+        linea += f" [adjunto: {adjunto.url}]"
+    if msg.embeds:
+        linea += f" [{len(msg.embeds)} embed(s)]"
+    return linea + "\n"
+
+async def generar_transcript(canal, guild_id, numero):
+    """Escribir el historial completo del canal en un archivo comprimido y devolver su ruta"""
+    os.makedirs(TRANSCRIPTS_DIR, exist_ok=True)
+    ruta = ruta_transcript(guild_id, numero)
+    with gzip.open(ruta, "wt", encoding="utf-8", compresslevel=6) as archivo:
+        archivo.write(f"{CABECERA_TRANSCRIPT} #{numero} ({canal.name})\n\n")
+        async for msg in canal.history(limit=None, oldest_first=True):
+            archivo.write(linea_transcript(msg))
+    return ruta
+
+async def finalizar_transcript(canal, guild_id, numero):
+    """Cerrar el registro del ticket y devolver la ruta del .txt.gz"""
+    tickets_abiertos.discard(canal.id)
+    if not registro_completo(canal.id):
+        # Ticket sin registro incremental: recorrer el historial como respaldo
+        if os.path.exists(ruta_registro(canal.id)):
+            os.remove(ruta_registro(canal.id))
+        return await generar_transcript(canal, guild_id, numero)
+
+    ruta = ruta_transcript(guild_id, numero)
+    await asyncio.get_running_loop().run_in_executor(None, _comprimir, ruta_registro(canal.id), ruta)
+    return ruta
+
+tareas_archivado = set()  # referencias a las tareas en segundo plano de archivar_tras_log
+
+async def archivar_tras_log(envio_log, ruta, guild_id):
+    """Archivar el transcript cuando el log que lo adjunta ya salió y borrar la copia local.
+
+    Sin TRANSCRIPTS_BUCKET la única copia es la adjunta al log: el archivo local se
+    borra si el log se envió (o si el servidor no tiene canal de logs) y solo se
+    conserva en TRANSCRIPTS_DIR, para recuperarlo a mano, si el envío falló.
+    """
+    enviado = await envio_log if envio_log is not None else None
+    try:
+        if TRANSCRIPTS_BUCKET:
+            await archivar_transcript(ruta, guild_id)
+        elif enviado is False:
+            print(f"⚠️ No se envió el log del ticket: el transcript queda en {ruta}")
+        else:
+            os.remove(ruta)
+    except Exception as e:
+        print(f"❌ Error archivando transcript {ruta}: {e}")
+
+async def archivar_transcript(ruta, guild_id):
+    """Subir el transcript a Supabase Storage y borrar la copia local"""
+    destino = f"{guild_id}/{os.path.basename(ruta)}"
+    await _db_ejecutar(
+        lambda: supabase.storage.from_(TRANSCRIPTS_BUCKET).upload(destino, ruta, {"content-type": "application/gzip"}),
+        timeout=60,
+        tabla=f"storage/{TRANSCRIPTS_BUCKET}"
+    )
+    os.remove(ruta)
 
 # ==============================
 # BOTONES DE CONTROL DEL TICKET
@@ -381,38 +2387,44 @@ class TicketControls(discord.ui.View):
         super().__init__(timeout=None)
     
     @discord.ui.button(label="Cerrar Ticket", style=discord.ButtonStyle.red, emoji="❌", custom_id="close_ticket")
+    @diferido(ephemeral=False)
     async def close_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
         guild_id = str(interaction.guild.id)
         canal_id = str(interaction.channel.id)
         
+        # Reclamar el cierre antes de cualquier await: un segundo clic no debe tocar el mismo registro ni transcript
+        if interaction.channel.id in tickets_cerrando:
+            await responder(interaction, "⏳ Este ticket ya se está cerrando.", ephemeral=True)
+            return
+        tickets_cerrando.add(interaction.channel.id)
         try:
             # Verificar que el ticket existe
-            ticket_data = supabase.table("tickets").select("*").eq("canal_id", canal_id).execute()
+            ticket = replica.fila("tickets", canal_id)
+            if ticket is None:
+                ticket_data = await db_query("tickets", lambda t: t.select("*").eq("canal_id", canal_id))
+                tickets = ticket_data.data or await diario.pendientes_de("tickets", canal_id=canal_id)
+                if not tickets:
+                    await responder(interaction, "❌ No se encontró este ticket.", ephemeral=True)
+                    return
+                ticket = tickets[0]
+            config = await config_cache.obtener("ticket_config", guild_id)
             
-            if not ticket_data.data:
-                await interaction.response.send_message("❌ No se encontró este ticket.", ephemeral=True)
-                return
-            
-            ticket = ticket_data.data[0]
-            config_data = supabase.table("ticket_config").select("*").eq("guild_id", guild_id).execute()
-            
-            # Crear transcript (resumen del chat)
-            messages = []
-            async for msg in interaction.channel.history(limit=100, oldest_first=True):
-                messages.append(f"[{msg.created_at.strftime('%Y-%m-%d %H:%M')}] {msg.author.name}: {msg.content}")
-            
-            transcript = "\n".join(messages)
+            # Crear transcript (historial completo, comprimido)
+            with fase("transcript"):
+                transcript = await finalizar_transcript(interaction.channel, guild_id, ticket["numero"])
             
             # Actualizar estado en BD
-            supabase.table("tickets").update({
+            await diario.escribir("tickets", "update", {
                 "estado": "cerrado",
                 "cerrado_por": str(interaction.user.id),
                 "cerrado_at": datetime.datetime.utcnow().isoformat()
-            }).eq("canal_id", canal_id).execute()
+            }, filtros=[("eq", "canal_id", canal_id)])
+            replica.borrar("tickets", canal_id)
             
             # Enviar log
-            if config_data.data:
-                canal_logs = interaction.guild.get_channel(int(config_data.data[0]["canal_logs_id"]))
+            envio_log = None
+            if config:
+                canal_logs = interaction.guild.get_channel(int(config["canal_logs_id"]))
                 if canal_logs:
                     embed_log = discord.Embed(
                         title=f"{EMOJI_CLOSE} Ticket Cerrado",
@@ -425,14 +2437,92 @@ class TicketControls(discord.ui.View):
                         color=discord.Color.red()
                     )
                     embed_log.timestamp = datetime.datetime.utcnow()
-                    await canal_logs.send(embed=embed_log)
+                    envio_log = logs_agrupados.publicar(canal_logs, embed_log, archivo=transcript)
+            
+            # El transcript se archiva (y puede borrarse) cuando el log que lo adjunta ya salió
+            tarea = asyncio.create_task(archivar_tras_log(envio_log, transcript, guild_id))
+            tareas_archivado.add(tarea)
+            tarea.add_done_callback(tareas_archivado.discard)
             
-            await interaction.response.send_message(f"{EMOJI_CLOSE} Cerrando ticket en 5 segundos...")
-            await asyncio.sleep(5)
-            await interaction.channel.delete()
+            await responder(interaction, f"{EMOJI_CLOSE} Cerrando ticket en {TICKET_CIERRE_SEGUNDOS:g} segundos...")
+            await asyncio.sleep(TICKET_CIERRE_SEGUNDOS)
+            trabajo, _, _ = cola_canales.encolar(
+                guild_id, ("borrar", canal_id), lambda: cola_canales.reintentar(interaction.channel.delete)
+            )
+            await asyncio.shield(trabajo)
             
         except Exception as e:
-            await interaction.response.send_message(f"❌ Error al cerrar ticket: {e}", ephemeral=True)
+            await responder(interaction, f"❌ Error al cerrar ticket: {e}", ephemeral=True)
+        finally:
+            tickets_cerrando.discard(interaction.channel.id)
+
+
+# ==============================
+# RECONCILIACIÓN DE TICKETS AL ARRANCAR
+# ==============================
+# Los tickets abiertos se traen en páginas de RECONCILIAR_LOTE por id (Supabase
+# corta cada respuesta en su máximo de filas, 1000 por defecto) y se comparan
+# con los canales en caché (sin llamadas a la API por ticket). Los que ya no
+# tienen canal se cierran en lote. Solo se recuperan mensajes de los canales cuyo último mensaje
+# (dato que llega con el gateway) es posterior a su registro local.
+RECONCILIAR_LOTE = 1000
+_tickets_reconciliados = False
+
+async def reconciliar_tickets():
+    """Cargar los tickets abiertos, cerrar los huérfanos y recuperar mensajes perdidos"""
+    global _tickets_reconciliados
+    abiertos, ultimo = [], 0
+    while True:
+        data = await db_query("tickets", lambda t: t.select("id, canal_id, guild_id").eq("estado", "abierto")
+                              .gt("id", ultimo).order("id").limit(RECONCILIAR_LOTE))
+        abiertos.extend(data.data)
+        if len(data.data) < RECONCILIAR_LOTE:
+            break
+        ultimo = data.data[-1]["id"]
+
+    huerfanos = []
+    for ticket in abiertos:
+        guild = bot.get_guild(int(ticket["guild_id"]))
+        if guild is None or guild.unavailable:
+            continue  # servidor de otro proceso o caído: no se toca
+        canal_id = int(ticket["canal_id"])
+        if guild.get_channel(canal_id) is None:
+            huerfanos.append(ticket["canal_id"])
+        else:
+            tickets_abiertos.add(canal_id)
+    _tickets_reconciliados = True
+
+    for i in range(0, len(huerfanos), 100):
+        lote = huerfanos[i:i + 100]
+        await diario.escribir("tickets", "update", {
+            "estado": "cerrado",
+            "cerrado_por": str(bot.user.id),
+            "cerrado_at": datetime.datetime.utcnow().isoformat()
+        }, filtros=[("in_", "canal_id", lote)])
+        for canal_id in lote:
+            replica.borrar("tickets", canal_id)
+            if os.path.exists(ruta_registro(canal_id)):
+                os.remove(ruta_registro(canal_id))
+    if huerfanos:
+        print(f"🧹 {len(huerfanos)} tickets sin canal cerrados.")
+
+    for canal_id in list(tickets_abiertos):
+        await recuperar_mensajes(bot.get_channel(canal_id))
+
+async def recuperar_mensajes(canal):
+    """Añadir al registro los mensajes enviados mientras el bot estaba apagado"""
+    if not registro_completo(canal.id) or canal.last_message_id is None:
+        return
+    ruta = ruta_registro(canal.id)
+    desde = datetime.datetime.fromtimestamp(os.path.getmtime(ruta), tz=datetime.timezone.utc)
+    if discord.utils.snowflake_time(canal.last_message_id) <= desde:
+        return
+    try:
+        with open(ruta, "a", encoding="utf-8") as archivo:
+            async for msg in canal.history(limit=None, after=desde, oldest_first=True):
+                archivo.write(linea_transcript(msg))
+    except Exception as e:
+        print(f"❌ Error recuperando mensajes del ticket {canal.id}: {e}")
 
 
 # ==============================
@@ -442,14 +2532,15 @@ class TicketControls(discord.ui.View):
 @bot.tree.command(name="unban", description="Desbanea a un usuario (solo administradores).")
 @app_commands.describe(usuario="ID del usuario que deseas desbanear")
 @app_commands.checks.has_permissions(administrator=True)
+@diferido(ephemeral=False)
 async def eliminar_ban(interaction: discord.Interaction, usuario: str):
     try:
         # Verificar si el usuario tiene permisos de administrador
         if not interaction.user.guild_permissions.administrator:
-            await interaction.response.send_message("🚫 No tienes permisos para usar este comando.", ephemeral=True)
+            await responder(interaction, "🚫 No tienes permisos para usar este comando.", ephemeral=True)
             return
 
-        user = await bot.fetch_user(int(usuario))
+        user = await miembros_recientes.usuario(int(usuario))
         await interaction.guild.unban(user)
 
         embed = discord.Embed(
@@ -458,12 +2549,12 @@ async def eliminar_ban(interaction: discord.Interaction, usuario: str):
             color=discord.Color.blue()
         )
         embed.set_footer(text=f"Acción realizada por: {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
-        await interaction.response.send_message(embed=embed)
+        await responder(interaction, embed=embed)
 
     except discord.NotFound:
-        await interaction.response.send_message("No se encontró ese usuario en la lista de baneos.", ephemeral=True)
+        await responder(interaction, "No se encontró ese usuario en la lista de baneos.", ephemeral=True)
     except Exception as e:
-        await interaction.response.send_message(f"❌ Ocurrió un error: {e}", ephemeral=True)
+        await responder(interaction, f"❌ Ocurrió un error: {e}", ephemeral=True)
 
 
 # ==============================
@@ -471,10 +2562,11 @@ async def eliminar_ban(interaction: discord.Interaction, usuario: str):
 # ==============================
 @bot.tree.command(name="warn", description="Advierte a un usuario y guarda la advertencia en Supabase (solo admins).")
 @app_commands.describe(usuario="Usuario a advertir", motivo="Motivo de la advertencia")
+@diferido(ephemeral=False)
 async def warn(interaction: discord.Interaction, usuario: discord.Member, motivo: str):
     # 🔒 Verificación de permisos
     if not interaction.user.guild_permissions.administrator:
-        await interaction.response.send_message(
+        await responder(interaction,
             "No tienes permiso para usar este comando. Solo administradores pueden advertir.",
             ephemeral=True
         )
@@ -482,12 +2574,15 @@ async def warn(interaction: discord.Interaction, usuario: discord.Member, motivo
 
     try:
         # Guardar advertencia en Supabase
-        supabase.table("warns").insert({
-            "user_id": str(usuario.id),
+        # La caché se invalida cuando la advertencia llega a Supabase
+        guild_id, user_id = str(interaction.guild.id), str(usuario.id)
+        await diario.escribir("warns", "insert", {
+            "guild_id": guild_id,
+            "user_id": user_id,
             "username": usuario.name,
             "reason": motivo,
             "warned_by": interaction.user.name
-        }).execute()
+        }, al_confirmar=lambda: warns_guardados(guild_id, [user_id]))
 
         # Crear embed de confirmación
         embed = discord.Embed(
@@ -500,56 +2595,105 @@ async def warn(interaction: discord.Interaction, usuario: discord.Member, motivo
             color=discord.Color.blue()
         )
         embed.set_footer(text="Sistema de Advertencias • Dragons")
-        await interaction.response.send_message(embed=embed)
+        await responder(interaction, embed=embed)
 
-        # Intentar enviar DM al usuario advertido
-        try:
-            dm_embed = discord.Embed(
-                title=f"{EMOJI_ALERT} Has sido advertido en {interaction.guild.name}",
-                description=f"**Motivo:** {motivo}\n**Moderador:** {interaction.user.name}",
-                color=discord.Color.blue()
-            )
-            dm_embed.set_footer(text="Sistema de Advertencias • Dragons")
-            await usuario.send(embed=dm_embed)
-        except:
-            pass  # si el usuario tiene los DMs cerrados, ignorar el error
+        # Avisar al usuario advertido por DM (en segundo plano)
+        dm_embed = discord.Embed(
+            title=f"{EMOJI_ALERT} Has sido advertido en {interaction.guild.name}",
+            description=f"**Motivo:** {motivo}\n**Moderador:** {interaction.user.name}",
+            color=discord.Color.blue()
+        )
+        dm_embed.set_footer(text="Sistema de Advertencias • Dragons")
+        repartidor_dms.enviar(usuario, embed=dm_embed)
 
     except Exception as e:
-        await interaction.response.send_message(f"❌ Error al registrar la advertencia: {e}", ephemeral=True)
+        await responder(interaction, f"❌ Error al registrar la advertencia: {e}", ephemeral=True)
 
 
 
 # ==============================
 # COMANDO /VER-WARNS
 # ==============================
-@bot.tree.command(name="warnings", description="Muestra las advertencias registradas de un usuario.")
-@app_commands.describe(usuario="Usuario del que deseas ver las advertencias")
-async def ver_warns(interaction: discord.Interaction, usuario: discord.Member):
-    try:
-        data = supabase.table("warns").select("*").eq("user_id", str(usuario.id)).execute()
-
-        if not data.data:
-            await interaction.response.send_message(f"✅ {usuario.mention} no tiene advertencias registradas.", ephemeral=True)
-            return
-
-        embed = discord.Embed(
-            title=f"{EMOJI_NOTES} Advertencias de {usuario.name}",
+# Botones para recorrer las páginas de /warnings. Cambiar de página es una
+# consulta por índice, así que se edita el mensaje directamente sin diferir.
+class PaginasWarns(discord.ui.View):
+    def __init__(self, autor_id, guild_id, usuario):
+        super().__init__(timeout=300)
+        self.autor_id = autor_id
+        self.guild_id = guild_id
+        self.usuario = usuario
+        self.cursores = [None]  # cursor (warned_at, id) con el que empieza cada página visitada
+        self.pagina = 0
+        self.embed = None
+
+    def mostrar(self, pagina, total, warns, hay_mas):
+        """Preparar el embed y los botones de `pagina` con sus advertencias"""
+        if hay_mas and pagina == len(self.cursores) - 1:
+            self.cursores.append((warns[-1]["warned_at"], warns[-1]["id"]))
+        self.pagina = pagina
+        self.anterior.disabled = pagina == 0
+        self.siguiente.disabled = not hay_mas
+
+        self.embed = discord.Embed(
+            title=f"{EMOJI_NOTES} Advertencias de {self.usuario.name}",
             color=discord.Color.blue()
         )
-
-        for warn in data.data:
+        for warn in warns:
             fecha = warn["warned_at"][:19].replace("T", " ")
-            embed.add_field(
+            self.embed.add_field(
                 name=f"{EMOJI_FIRE} Motivo: {warn['reason']}",
-                value=f"{EMOJI_MOD} Por: **{warn['warned_by']}**\n🕓 {fecha}",
+                value=f"{EMOJI_MOD} Por: **{warn['warned_by']}**\n🕓 {fecha} • ID `{warn['id']}`",
                 inline=False
             )
+        paginas = max(1, -(-total // WARNS_POR_PAGINA))
+        self.embed.set_footer(text=f"Página {pagina + 1} de {paginas} • {total} advertencias • Sistema de Advertencias • Dragons")
 
-        embed.set_footer(text="Sistema de Advertencias • Dragons")
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+    async def interaction_check(self, interaction: discord.Interaction):
+        return interaction.user.id == self.autor_id
+
+    async def _ir_a(self, interaction, pagina):
+        pagina = max(0, min(pagina, len(self.cursores) - 1))
+        try:
+            total, warns, hay_mas = await cache_warns.pagina(self.guild_id, str(self.usuario.id), self.cursores[pagina])
+        except Exception as e:
+            await interaction.response.send_message(f"❌ Error al obtener advertencias: {e}", ephemeral=True)
+            return
+        if not warns and pagina > 0:
+            # Se borraron advertencias mientras tanto: volver a la primera página
+            self.cursores = [None]
+            return await self._ir_a(interaction, 0)
+        self.mostrar(pagina, total, warns, hay_mas)
+        await interaction.response.edit_message(embed=self.embed, view=self)
+
+    @discord.ui.button(label="Anterior", style=discord.ButtonStyle.secondary, emoji="◀️")
+    async def anterior(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._ir_a(interaction, self.pagina - 1)
+
+    @discord.ui.button(label="Siguiente", style=discord.ButtonStyle.secondary, emoji="▶️")
+    async def siguiente(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._ir_a(interaction, self.pagina + 1)
+
+@bot.tree.command(name="warnings", description="Muestra las advertencias registradas de un usuario.")
+@app_commands.describe(usuario="Usuario del que deseas ver las advertencias")
+@diferido(ephemeral=True)
+async def ver_warns(interaction: discord.Interaction, usuario: discord.Member):
+    try:
+        guild_id = str(interaction.guild.id)
+        total, warns, hay_mas = await cache_warns.pagina(guild_id, str(usuario.id))
+
+        if not warns:
+            await responder(interaction, f"✅ {usuario.mention} no tiene advertencias registradas.", ephemeral=True)
+            return
+
+        paginas = PaginasWarns(interaction.user.id, guild_id, usuario)
+        paginas.mostrar(0, total, warns, hay_mas)
+        if hay_mas:
+            await responder(interaction, embed=paginas.embed, view=paginas, ephemeral=True)
+        else:
+            await responder(interaction, embed=paginas.embed, ephemeral=True)
 
     except Exception as e:
-        await interaction.response.send_message(f"❌ Error al obtener advertencias: {e}", ephemeral=True)
+        await responder(interaction, f"❌ Error al obtener advertencias: {e}", ephemeral=True)
 
 # ==============================
 # COMANDO /ELIMINAR-WARN (solo administradores)
@@ -559,19 +2703,24 @@ async def ver_warns(interaction: discord.Interaction, usuario: discord.Member):
     usuario="Usuario del que deseas eliminar advertencias",
     warn_id="ID de la advertencia a eliminar (déjalo vacío para eliminar todas)"
 )
+@diferido(ephemeral=False)
 async def eliminar_warn(interaction: discord.Interaction, usuario: discord.Member, warn_id: int = None):
     # 🔒 Verificación de permisos
     if not interaction.user.guild_permissions.administrator:
-        await interaction.response.send_message(
+        await responder(interaction,
             "🚫 No tienes permiso para usar este comando. Solo administradores pueden eliminar advertencias.",
             ephemeral=True
         )
         return
 
     try:
+        guild_id = str(interaction.guild.id)
         if warn_id:
             # Eliminar una advertencia específica
-            response = supabase.table("warns").delete().eq("id", warn_id).eq("user_id", str(usuario.id)).execute()
+            response = await db_query("warns", lambda t: t.delete()
+                                      .eq("id", warn_id).eq("guild_id", guild_id).eq("user_id", str(usuario.id)))
+            cache_warns.invalidar(guild_id, str(usuario.id))
+            replica.olvidar_warns(guild_id, str(usuario.id), warn_id)
 
             if response.data:
                 embed = discord.Embed(
@@ -580,13 +2729,15 @@ async def eliminar_warn(interaction: discord.Interaction, usuario: discord.Membe
                     color=discord.Color.red()
                 )
                 embed.set_footer(text="Sistema de Advertencias • Dragons")
-                await interaction.response.send_message(embed=embed)
+                await responder(interaction, embed=embed)
             else:
-                await interaction.response.send_message(f"❌ No se encontró una advertencia con ID {warn_id} para {usuario.mention}.", ephemeral=True)
+                await responder(interaction, f"❌ No se encontró una advertencia con ID {warn_id} para {usuario.mention}.", ephemeral=True)
 
         else:
             # Eliminar todas las advertencias de un usuario
-            response = supabase.table("warns").delete().eq("user_id", str(usuario.id)).execute()
+            response = await db_query("warns", lambda t: t.delete().eq("guild_id", guild_id).eq("user_id", str(usuario.id)))
+            cache_warns.invalidar(guild_id, str(usuario.id))
+            replica.olvidar_warns(guild_id, str(usuario.id))
             total = len(response.data)
 
             embed = discord.Embed(
@@ -595,22 +2746,50 @@ async def eliminar_warn(interaction: discord.Interaction, usuario: discord.Membe
                 color=discord.Color.blue()
             )
             embed.set_footer(text="Sistema de Advertencias • Dragons")
-            await interaction.response.send_message(embed=embed)
+            await responder(interaction, embed=embed)
 
     except Exception as e:
-        await interaction.response.send_message(f"❌ Error al eliminar advertencias: {e}", ephemeral=True)
+        await responder(interaction, f"❌ Error al eliminar advertencias: {e}", ephemeral=True)
 
 
+# ==============================
+# ESTADÍSTICAS EN SEGUNDO PLANO
+# ==============================
+# Los totales se cuentan en el servidor (count=..., head=True: no se descarga
+# ninguna fila) cada ESTADISTICAS_INTERVALO segundos y /botstatistics lee la
+# última foto guardada en memoria.
+TABLAS_ESTADISTICAS = ("baneados", "usuarios", "servers", "tickets")
+estadisticas = {}
+
+async def contar_filas(tabla):
+    data = await db_query(tabla, lambda t: t.select("id", count=ESTADISTICAS_CONTEO, head=True))
+    return data.count or 0
+
+@tasks.loop(seconds=ESTADISTICAS_INTERVALO)
+async def actualizar_estadisticas():
+    try:
+        totales = await asyncio.gather(*(contar_filas(tabla) for tabla in TABLAS_ESTADISTICAS))
+        estadisticas.update(zip(TABLAS_ESTADISTICAS, totales))
+        estadisticas["actualizado_at"] = datetime.datetime.utcnow()
+    except Exception as e:
+        print(f"❌ Error actualizando estadísticas: {e}")
+
 # ==============================
 # COMANDO /BOTSTATISTICS
 # ==============================
 @bot.tree.command(name="botstatistics", description="📊 Muestra las estadísticas globales del bot Dragons")
+@diferido(ephemeral=False)
 async def bot_statistics(interaction: discord.Interaction):
     try:
-        total_baneados = len(supabase.table("baneados").select("id").execute().data)
-        total_usuarios = len(supabase.table("usuarios").select("id").execute().data)
-        total_servers = len(supabase.table("servers").select("id").execute().data)
-        total_tickets = len(supabase.table("tickets").select("id").execute().data)
+        if "actualizado_at" not in estadisticas:
+            # Primera consulta antes de que termine la carga inicial
+            await actualizar_estadisticas()
+            if "actualizado_at" not in estadisticas:
+                raise RuntimeError("Supabase no respondió")
+        total_baneados = estadisticas.get("baneados", 0)
+        total_usuarios = estadisticas.get("usuarios", 0)
+        total_servers = estadisticas.get("servers", 0)
+        total_tickets = estadisticas.get("tickets", 0)
 
         uptime = datetime.datetime.utcnow() - start_time
         days, remainder = divmod(int(uptime.total_seconds()), 86400)
@@ -631,11 +2810,13 @@ async def bot_statistics(interaction: discord.Interaction):
 
         embed.set_thumbnail(url="https://cdn.discordapp.com/emojis/1432855339732177067.webp")
         embed.set_footer(text="⚙️ Powered by Dragons Development", icon_url="https://cdn.discordapp.com/emojis/1432855375165526036.webp")
+        if "actualizado_at" in estadisticas:
+            embed.timestamp = estadisticas["actualizado_at"]
 
-        await interaction.response.send_message(embed=embed)
+        await responder(interaction, embed=embed)
 
     except Exception as e:
-        await interaction.response.send_message(f"❌ Error al obtener estadísticas: {e}", ephemeral=True)
+        await responder(interaction, f"❌ Error al obtener estadísticas: {e}", ephemeral=True)
 
 # ==============================
 # COMANDO /MUTE (solo administradores)
@@ -648,19 +2829,20 @@ async def bot_statistics(interaction: discord.Interaction):
     motivo="Motivo del mute"
 )
 @app_commands.checks.has_permissions(administrator=True)
+@diferido(ephemeral=False)
 async def mute(interaction: discord.Interaction, usuario: discord.Member, minutos: int, motivo: str = "No especificado"):
     import asyncio
 
     if not interaction.user.guild_permissions.administrator:
-        await interaction.response.send_message("🚫 No tienes permisos para usar este comando.", ephemeral=True)
+        await responder(interaction, "🚫 No tienes permisos para usar este comando.", ephemeral=True)
         return
 
     if usuario == interaction.user:
-        await interaction.response.send_message("❌ No puedes mutearte a ti mismo.", ephemeral=True)
+        await responder(interaction, "❌ No puedes mutearte a ti mismo.", ephemeral=True)
         return
 
     if usuario.guild_permissions.administrator:
-        await interaction.response.send_message("⚠️ No puedes silenciar a otro administrador.", ephemeral=True)
+        await responder(interaction, "⚠️ No puedes silenciar a otro administrador.", ephemeral=True)
         return
 
     try:
@@ -679,23 +2861,20 @@ async def mute(interaction: discord.Interaction, usuario: discord.Member, minuto
         embed.set_footer(text=f"Silenciado por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
         embed.timestamp = datetime.datetime.utcnow()
 
-        await interaction.response.send_message(embed=embed)
+        await responder(interaction, embed=embed)
 
-        try:
-            embed_dm = discord.Embed(
-                title=f" {EMOJI_MUTE} Has sido silenciado",
-                description=(
-                    f"{EMOJI_MOD} Has sido silenciado en **{interaction.guild.name}** por **{minutos} minutos**.\n"
-                    f"{EMOJI_NOTES} **Motivo:** {motivo}"
-                ),
-                color=discord.Color.dark_red()
-            )
-            await usuario.send(embed=embed_dm)
-        except:
-            pass
+        embed_dm = discord.Embed(
+            title=f" {EMOJI_MUTE} Has sido silenciado",
+            description=(
+                f"{EMOJI_MOD} Has sido silenciado en **{interaction.guild.name}** por **{minutos} minutos**.\n"
+                f"{EMOJI_NOTES} **Motivo:** {motivo}"
+            ),
+            color=discord.Color.dark_red()
+        )
+        repartidor_dms.enviar(usuario, embed=embed_dm)
 
     except Exception as e:
-        await interaction.response.send_message(f"❌ Error al aplicar el mute: `{e}`", ephemeral=True)
+        await responder(interaction, f"❌ Error al aplicar el mute: `{e}`", ephemeral=True)
 
 # ==============================
 # COMANDO /UNMUTE (solo administradores)
@@ -707,14 +2886,15 @@ async def mute(interaction: discord.Interaction, usuario: discord.Member, minuto
     motivo="Motivo para quitar el mute"
 )
 @app_commands.checks.has_permissions(administrator=True)
+@diferido(ephemeral=False)
 async def unmute(interaction: discord.Interaction, usuario: discord.Member, motivo: str = "No especificado"):
 
     if not interaction.user.guild_permissions.administrator:
-        await interaction.response.send_message("🚫 No tienes permisos para usar este comando.", ephemeral=True)
+        await responder(interaction, "🚫 No tienes permisos para usar este comando.", ephemeral=True)
         return
 
     if usuario == interaction.user:
-        await interaction.response.send_message("❌ No puedes modificar tu propio silencio.", ephemeral=True)
+        await responder(interaction, "❌ No puedes modificar tu propio silencio.", ephemeral=True)
         return
 
     try:
@@ -732,24 +2912,256 @@ async def unmute(interaction: discord.Interaction, usuario: discord.Member, moti
         embed.set_footer(text=f"Desmuteado por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
         embed.timestamp = datetime.datetime.utcnow()
 
-        await interaction.response.send_message(embed=embed)
+        await responder(interaction, embed=embed)
 
-        # Mensaje directo al usuario
+        # Mensaje directo al usuario (en segundo plano)
+        embed_dm = discord.Embed(
+            title=f" {EMOJI_DRAGON} Se te ha quitado el silencio",
+            description=(
+                f"Tu silencio en **{interaction.guild.name}** ha sido levantado.\n"
+                f"**Motivo:** {motivo}"
+            ),
+            color=discord.Color.green()
+        )
+        repartidor_dms.enviar(usuario, embed=embed_dm)
+
+    except Exception as e:
+        await responder(interaction, f"❌ Error al quitar el mute: `{e}`", ephemeral=True)
+
+# ==============================
+# MODERACIÓN MASIVA (solo administradores)
+# ==============================
+# Para raids: cada comando acepta menciones o IDs y/o "quienes entraron en los
+# últimos N minutos". Las acciones se hacen con MASIVO_CONCURRENCIA peticiones
+# a Discord en vuelo (discord.py espera los 429 de cada ruta, así que acotar la
+# concurrencia basta para no comerse el límite global), las filas se guardan en
+# un único insert y el progreso se muestra editando un solo mensaje.
+class OmitirUsuario(Exception):
+    """La acción no se aplica a este usuario (el mensaje explica por qué)"""
+
+def parsear_ids(texto):
+    """IDs únicos, en orden, de un texto con menciones o IDs"""
+    return list(dict.fromkeys(int(i) for i in re.findall(r"\d{15,20}", texto or "")))
+
+async def objetivos_masivos(interaction, usuarios, recientes=None):
+    """IDs a moderar, o None si ya se respondió con el motivo para no hacer nada"""
+    ids = parsear_ids(usuarios)
+    if recientes:
+        ids = list(dict.fromkeys(ids + detector_raids.recientes(interaction.guild.id, recientes)))
+    if not ids:
+        await responder(interaction, "❌ No se encontró ningún usuario. Indica menciones o IDs, o usa `recientes`.", ephemeral=True)
+        return None
+    if len(ids) > MASIVO_MAX:
+        await responder(interaction, f"❌ Son {len(ids)} usuarios y el máximo por comando es {MASIVO_MAX}.", ephemeral=True)
+        return None
+    return ids
+
+async def miembro_moderable(interaction, user_id, permitir_admins=False):
+    """Miembro `user_id` del servidor; lanza OmitirUsuario si no se le puede moderar"""
+    if user_id == interaction.user.id:
+        raise OmitirUsuario("eres tú")
+    miembro = await miembros_recientes.miembro(interaction.guild, user_id)
+    if miembro is None:
+        raise OmitirUsuario("no está en el servidor")
+    if not permitir_admins and miembro.guild_permissions.administrator:
+        raise OmitirUsuario("es administrador")
+    return miembro
+
+class OperacionMasiva:
+    def __init__(self, interaction, titulo, ids):
+        self.interaction = interaction
+        self.titulo = titulo
+        self.ids = ids
+        self.hechos = []    # lo que devolvió la acción para cada usuario correcto
+        self.omitidos = {}  # user_id -> motivo
+        self.errores = {}   # user_id -> error
+        self._mensaje = None
+
+    def _embed(self, terminado):
+        procesados = len(self.hechos) + len(self.omitidos) + len(self.errores)
+        embed = discord.Embed(
+            title=self.titulo,
+            description=(
+                f"{'✅ Completado' if terminado else '⏳ En curso'}: **{procesados}/{len(self.ids)}**\n"
+                f"✅ Correctos: **{len(self.hechos)}**\n"
+                f"⏭️ Omitidos: **{len(self.omitidos)}**\n"
+                f"❌ Errores: **{len(self.errores)}**"
+            ),
+            color=discord.Color.blue() if terminado else discord.Color.orange()
+        )
+        if terminado:
+            for nombre, detalle in (("⏭️ Omitidos", self.omitidos), ("❌ Errores", self.errores)):
+                if detalle:
+                    lineas = "\n".join(f"<@{user_id}>: {motivo}" for user_id, motivo in detalle.items())
+                    embed.add_field(name=nombre, value=lineas if len(lineas) <= 1024 else lineas[:1020] + "\n...", inline=False)
+        embed.set_footer(text=f"Acción realizada por: {self.interaction.user.name}", icon_url=self.interaction.user.display_avatar.url)
+        embed.timestamp = datetime.datetime.utcnow()
+        return embed
+
+    async def mostrar(self, terminado=False):
+        """Publicar o actualizar el mensaje de progreso"""
+        if self._mensaje is None:
+            self._mensaje = await responder(self.interaction, embed=self._embed(terminado))
+            return
         try:
-            embed_dm = discord.Embed(
-                title=f" {EMOJI_DRAGON} Se te ha quitado el silencio",
-                description=(
-                    f"Tu silencio en **{interaction.guild.name}** ha sido levantado.\n"
-                    f"**Motivo:** {motivo}"
-                ),
-                color=discord.Color.green()
-            )
-            await usuario.send(embed=embed_dm)
-        except:
-            pass
+            with fase("discord"):
+                await self._mensaje.edit(embed=self._embed(terminado))
+        except discord.HTTPException as e:
+            print(f"⚠️ No se pudo actualizar el progreso de {self.titulo}: {e}")
+
+    async def ejecutar(self, accion):
+        """Aplicar `accion(user_id)` a todos los IDs, actualizando el progreso cada MASIVO_PROGRESO segundos"""
+        semaforo = asyncio.Semaphore(MASIVO_CONCURRENCIA)
+
+        async def aplicar(user_id):
+            async with semaforo:
+                try:
+                    self.hechos.append(await accion(user_id))
+                except OmitirUsuario as e:
+                    self.omitidos[user_id] = str(e)
+                except discord.Forbidden:
+                    self.errores[user_id] = "sin permisos"
+                except Exception as e:
+                    self.errores[user_id] = str(e)[:100]
+
+        await self.mostrar()
+        trabajo = asyncio.ensure_future(asyncio.gather(*(aplicar(user_id) for user_id in self.ids)))
+        while not trabajo.done():
+            await asyncio.wait([trabajo], timeout=MASIVO_PROGRESO)
+            if not trabajo.done():
+                await self.mostrar()
+        await trabajo
+
+    def fallar_hechos(self, motivo):
+        """Pasar a errores lo que se hizo en Discord pero no pudo guardarse"""
+        self.errores.update({hecho.id: motivo for hecho in self.hechos})
+        self.hechos = []
+
+
+@bot.tree.command(name="mute-masivo", description="Silencia a varios usuarios a la vez (solo administradores).")
+@app_commands.describe(
+    minutos="Duración del silencio en minutos (máximo 28 días)",
+    usuarios="Menciones o IDs separados por espacios",
+    recientes="Incluir a quienes entraron en los últimos N minutos",
+    motivo="Motivo del mute"
+)
+@app_commands.checks.has_permissions(administrator=True)
+@diferido(ephemeral=False)
+async def mute_masivo(interaction: discord.Interaction, minutos: app_commands.Range[int, 1, 40320], usuarios: str = None, recientes: int = None, motivo: str = "No especificado"):
+    if not interaction.user.guild_permissions.administrator:
+        await responder(interaction, "🚫 No tienes permisos para usar este comando.", ephemeral=True)
+        return
+
+    try:
+        ids = await objetivos_masivos(interaction, usuarios, recientes)
+        if ids is None:
+            return
+        hasta = discord.utils.utcnow() + datetime.timedelta(minutes=minutos)
+
+        async def silenciar(user_id):
+            miembro = await miembro_moderable(interaction, user_id)
+            with fase("discord"):
+                await miembro.timeout(hasta, reason=motivo)
+            return miembro
+
+        operacion = OperacionMasiva(interaction, f"{EMOJI_MUTE} Mute masivo ({minutos} minutos)", ids)
+        await operacion.ejecutar(silenciar)
+        await operacion.mostrar(terminado=True)
+
+        embed_dm = discord.Embed(
+            title=f" {EMOJI_MUTE} Has sido silenciado",
+            description=(
+                f"{EMOJI_MOD} Has sido silenciado en **{interaction.guild.name}** por **{minutos} minutos**.\n"
+                f"{EMOJI_NOTES} **Motivo:** {motivo}"
+            ),
+            color=discord.Color.dark_red()
+        )
+        for miembro in operacion.hechos:
+            repartidor_dms.enviar(miembro, embed=embed_dm)
+
+    except Exception as e:
+        await responder(interaction, f"❌ Error en el mute masivo: `{e}`", ephemeral=True)
+
+
+@bot.tree.command(name="warn-masivo", description="Advierte a varios usuarios a la vez (solo administradores).")
+@app_commands.describe(
+    motivo="Motivo de la advertencia",
+    usuarios="Menciones o IDs separados por espacios",
+    recientes="Incluir a quienes entraron en los últimos N minutos"
+)
+@app_commands.checks.has_permissions(administrator=True)
+@diferido(ephemeral=False)
+async def warn_masivo(interaction: discord.Interaction, motivo: str, usuarios: str = None, recientes: int = None):
+    if not interaction.user.guild_permissions.administrator:
+        await responder(interaction, "🚫 No tienes permisos para usar este comando.", ephemeral=True)
+        return
+
+    try:
+        ids = await objetivos_masivos(interaction, usuarios, recientes)
+        if ids is None:
+            return
+        guild_id = str(interaction.guild.id)
+
+        operacion = OperacionMasiva(interaction, f"{EMOJI_WARNS} Warn masivo", ids)
+        await operacion.ejecutar(lambda user_id: miembro_moderable(interaction, user_id, permitir_admins=True))
+
+        # Todas las advertencias en un único insert
+        if operacion.hechos:
+            advertidos = [str(miembro.id) for miembro in operacion.hechos]
+            try:
+                await diario.escribir("warns", "insert", [{
+                    "guild_id": guild_id,
+                    "user_id": str(miembro.id),
+                    "username": miembro.name,
+                    "reason": motivo,
+                    "warned_by": interaction.user.name
+                } for miembro in operacion.hechos], al_confirmar=lambda: warns_guardados(guild_id, advertidos))
+            except Exception as e:
+                operacion.fallar_hechos(f"no se guardó: {str(e)[:80]}")
+        await operacion.mostrar(terminado=True)
+
+        dm_embed = discord.Embed(
+            title=f"{EMOJI_ALERT} Has sido advertido en {interaction.guild.name}",
+            description=f"**Motivo:** {motivo}\n**Moderador:** {interaction.user.name}",
+            color=discord.Color.blue()
+        )
+        dm_embed.set_footer(text="Sistema de Advertencias • Dragons")
+        for miembro in operacion.hechos:
+            repartidor_dms.enviar(miembro, embed=dm_embed)
+
+    except Exception as e:
+        await responder(interaction, f"❌ Error en el warn masivo: {e}", ephemeral=True)
+
+
+@bot.tree.command(name="unban-masivo", description="Desbanea a varios usuarios a la vez (solo administradores).")
+@app_commands.describe(usuarios="IDs de los usuarios separados por espacios")
+@app_commands.checks.has_permissions(administrator=True)
+@diferido(ephemeral=False)
+async def unban_masivo(interaction: discord.Interaction, usuarios: str):
+    if not interaction.user.guild_permissions.administrator:
+        await responder(interaction, "🚫 No tienes permisos para usar este comando.", ephemeral=True)
+        return
+
+    try:
+        ids = await objetivos_masivos(interaction, usuarios)
+        if ids is None:
+            return
+
+        async def desbanear(user_id):
+            # Basta con el ID: no hace falta pedir cada usuario a la API como en /unban
+            try:
+                with fase("discord"):
+                    await interaction.guild.unban(discord.Object(id=user_id))
+            except discord.NotFound:
+                raise OmitirUsuario("no está baneado")
+            return user_id
+
+        operacion = OperacionMasiva(interaction, f"{EMOJI_BAN} Unban masivo", ids)
+        await operacion.ejecutar(desbanear)
+        await operacion.mostrar(terminado=True)
 
     except Exception as e:
-        await interaction.response.send_message(f"❌ Error al quitar el mute: `{e}`", ephemeral=True)
+        await responder(interaction, f"❌ Ocurrió un error: {e}", ephemeral=True)
 
 # ==============================
 # COMANDO /userinfo (público)
@@ -757,14 +3169,14 @@ async def unmute(interaction: discord.Interaction, usuario: discord.Member, moti
 
 @bot.tree.command(name="userinfo", description="Muestra tu perfil o el de otro usuario.")
 @app_commands.describe(usuario="Usuario a consultar (opcional)")
+@diferido(ephemeral=False)
 async def perfil(interaction: discord.Interaction, usuario: discord.Member = None):
 
     if usuario is None:
         usuario = interaction.user
 
-    # Buscar warns del usuario en Supabase
-    warns_data = supabase.table("warns").select("*").eq("user_id", str(usuario.id)).execute()
-    total_warns = len(warns_data.data) if warns_data.data else 0
+    # Número de warns del usuario (caché o conteo sin descargar filas)
+    total_warns = await cache_warns.contar(str(interaction.guild.id), str(usuario.id))
 
     # Calcular días en el servidor
     joined_days = (datetime.datetime.utcnow() - usuario.joined_at.replace(tzinfo=None)).days
@@ -785,12 +3197,13 @@ async def perfil(interaction: discord.Interaction, usuario: discord.Member = Non
     embed.set_footer(text=f"Consulta realizada por {interaction.user.name}", icon_url=interaction.user.display_avatar.url)
     embed.timestamp = datetime.datetime.utcnow()
 
-    await interaction.response.send_message(embed=embed)
+    await responder(interaction, embed=embed)
 
 # ==============================
 # COMANDO /HELP (Lista de comandos del bot)
 # ==============================
 @bot.tree.command(name="help", description="📖 Muestra todos los comandos disponibles del sistema Dragons.")
+@diferido(ephemeral=True)
 async def help_command(interaction: discord.Interaction):
     try:
         embed = discord.Embed(
@@ -831,7 +3244,9 @@ async def help_command(interaction: discord.Interaction):
                 f"`/ban` → Banea un usuario del servidor.\n"
                 f"`/unban` → Desbanea un usuario.\n"
                 f"`/mute` → Silencia temporalmente a un usuario.\n"
-                f"`/unmute` → Quita el silencio a un usuario."
+                f"`/unmute` → Quita el silencio a un usuario.\n"
+                f"`/mute-masivo` · `/warn-masivo` · `/unban-masivo` → Moderan a varios usuarios a la vez "
+                f"(menciones, IDs o quienes entraron en los últimos N minutos)."
             ),
             inline=False
         )
@@ -874,10 +3289,10 @@ async def help_command(interaction: discord.Interaction):
         )
         embed.timestamp = datetime.datetime.utcnow()
 
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        await responder(interaction, embed=embed, ephemeral=True)
 
     except Exception as e:
-        await interaction.response.send_message(f"❌ Error al mostrar la ayuda: {e}", ephemeral=True)
+        await responder(interaction, f"❌ Error al mostrar la ayuda: {e}", ephemeral=True)
 
 
 # ==============================
@@ -891,6 +3306,7 @@ async def help_command(interaction: discord.Interaction):
     gif="URL del GIF o imagen.",
     color="Color del embed en formato hexadecimal (ejemplo: #4169e1 o 4169e1)"
 )
+@diferido(ephemeral=True)
 async def crear_despedida(interaction: discord.Interaction, canal: discord.TextChannel, encabezado: str, texto: str, gif: str, color: str = "#ff0000"):
     guild_id = str(interaction.guild.id)
 
@@ -899,7 +3315,7 @@ async def crear_despedida(interaction: discord.Interaction, canal: discord.TextC
     
     # Validar que sea un color hexadecimal válido
     if len(color_limpio) != 6 or not all(c in '0123456789abcdefABCDEF' for c in color_limpio):
-        await interaction.response.send_message(
+        await responder(interaction,
             "❌ **Color inválido.** Usa un formato hexadecimal válido.\n"
             "**Ejemplos:** `#4169e1`, `4169e1`, `#ff0000`, `00ff00`",
             ephemeral=True
@@ -911,14 +3327,16 @@ async def crear_despedida(interaction: discord.Interaction, canal: discord.TextC
         color_int = int(color_limpio, 16)
         color_embed = discord.Color(color_int)
 
-        supabase.table("despedidas").upsert({
+        fila = {
             "guild_id": guild_id,
             "canal_id": str(canal.id),
             "encabezado": encabezado,
             "texto": texto,
             "gif": gif,
             "color": color_limpio
-        }).execute()
+        }
+        respuesta = await db_query("despedidas", lambda t: t.upsert(fila))
+        config_cache.guardar("despedidas", guild_id, respuesta.data[0] if respuesta.data else fila)
 
         embed = discord.Embed(
             title=f"{EMOJI_DRAGON} **[ DV ] Dragons Despedida Configurada**",
@@ -927,26 +3345,33 @@ async def crear_despedida(interaction: discord.Interaction, canal: discord.TextC
         )
         embed.set_image(url=gif)
         embed.set_footer(text="Sistema de Despedida • Dragons")
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        await responder(interaction, embed=embed, ephemeral=True)
 
     except Exception as e:
-        await interaction.response.send_message(f"❌ Error al guardar la configuración: {e}", ephemeral=True)
+        await responder(interaction, f"❌ Error al guardar la configuración: {e}", ephemeral=True)
 
 
 # ==============================
 # EVENTO DE SALIDA DE MIEMBRO
 # ==============================
+# on_member_remove solo se emite si el miembro estaba en caché (ver MEMBER_CACHE);
+# el evento raw llega siempre, con el usuario que sale.
 @bot.event
-async def on_member_remove(member):
+async def on_raw_member_remove(payload):
     """Enviar despedida cuando un usuario sale del servidor"""
+    member = payload.user
     try:
+        miembros_recientes.olvidar(payload.guild_id, member.id)
+        guild = bot.get_guild(payload.guild_id)
+        if guild is None:
+            return
+
         # Buscar configuración de despedida
-        guild_id = str(member.guild.id)
-        data = supabase.table("despedidas").select("*").eq("guild_id", guild_id).execute()
+        guild_id = str(guild.id)
+        config = await config_cache.obtener("despedidas", guild_id)
 
-        if data.data:
-            config = data.data[0]
-            canal = member.guild.get_channel(int(config["canal_id"]))
+        if config:
+            canal = guild.get_channel(int(config["canal_id"]))
             if canal:
                 # Convertir color hex a Discord Color
                 color_embed = discord.Color(int(config["color"], 16))
@@ -964,7 +3389,7 @@ async def on_member_remove(member):
                 await canal.send(embed=embed)
 
     except Exception as e:
-        print(f"❌ Error en on_member_remove: {e}")
+        print(f"❌ Error en on_raw_member_remove: {e}")
 
 
 # ==============================
@@ -972,23 +3397,110 @@ async def on_member_remove(member):
 # ==============================
 EMOJI_GOODBYE = "👋"
 # ==============================
-# MINI SERVIDOR FLASK PARA RENDER
+# SERVIDOR WEB PARA RENDER
 # ==============================
-app = Flask("")
-
-@app.route("/")
-def home():
-    return "🐉 Bot activo en Render (Dragons)"
-
-def run():
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
-
-threading.Thread(target=run).start()
+# Servidor aiohttp en el mismo event loop que el bot (se arranca en setup_hook),
+# así que lee el estado del bot sin condiciones de carrera entre hilos.
+# /health responde 503 mientras el bot no esté listo para que Render no lo
+# considere sano antes de tiempo.
+async def home(request):
+    return web.Response(text="🐉 Bot activo en Render (Dragons)")
+
+def _websockets_gateway():
+    """shard_id -> websocket del gateway (una sola entrada sin sharding)"""
+    if isinstance(bot, commands.AutoShardedBot):
+        return {shard_id: info._parent.ws for shard_id, info in bot.shards.items()}
+    return {bot.shard_id or 0: bot.ws}
+
+def _segundos_desde_ultimo_ack(ws):
+    # discord.py no expone el instante del último ACK: se lee del keep-alive del websocket
+    keep_alive = getattr(ws, "_keep_alive", None)
+    ultimo_ack = getattr(keep_alive, "_last_ack", None)
+    return None if ultimo_ack is None else time.perf_counter() - ultimo_ack
+
+def _latencia_ms(latencia):
+    return None if latencia != latencia else round(latencia * 1000, 1)
+
+async def _supabase_accesible():
+    if time.monotonic() - _db_ultimo_exito < HEALTH_DB_TTL:
+        return True
+    try:
+        await db_query("servers", lambda t: t.select("guild_id").limit(1), timeout=3)
+        return True
+    except Exception as e:
+        print(f"⚠️ /health: Supabase no responde: {e}")
+        return False
+
+async def health(request):
+    shards = {}
+    for shard_id, ws in _websockets_gateway().items():
+        sin_ack = _segundos_desde_ultimo_ack(ws)
+        shards[shard_id] = {
+            "latencia_ms": _latencia_ms(ws.latency) if ws else None,
+            "segundos_desde_ultimo_ack": None if sin_ack is None else round(sin_ack, 1),
+            "conectado": sin_ack is not None and sin_ack < HEALTH_HEARTBEAT_MAX,
+        }
+    gateway_ok = bot.is_ready() and not bot.is_closed() and all(s["conectado"] for s in shards.values())
+    supabase_ok = await _supabase_accesible()
+    antiguedad = replica.segundos_desde_sincronizacion()
+    estado = {
+        "listo": gateway_ok and supabase_ok,
+        "gateway": {
+            "conectado": gateway_ok,
+            "latencia_ms": _latencia_ms(bot.latency),
+            "shards": shards,
+        },
+        "supabase": {"accesible": supabase_ok},
+        "diario": {"pendientes": diario.pendientes(), "circuito_abierto": diario.circuito_abierto()},
+        "replica": {
+            "lista": replica.lista,
+            "segundos_desde_sincronizacion": None if antiguedad is None else round(antiguedad, 1),
+        },
+        "servidores": len(bot.guilds),
+        "uptime_segundos": int((datetime.datetime.utcnow() - start_time).total_seconds()),
+    }
+    return web.json_response(estado, status=200 if estado["listo"] else 503)
+
+async def metrics(request):
+    return web.Response(text=metricas.exponer(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def iniciar_servidor_web():
+    app = web.Application()
+    app.router.add_get("/", home)
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+    print(f"🌐 Servidor web escuchando en el puerto {PORT}")
+    return runner
+
+metricas.medidor("dragons_gateway_latencia_segundos", "Latencia del heartbeat con el gateway de Discord", lambda: bot.latency)
+metricas.medidor("dragons_servidores", "Servidores en los que está el bot", lambda: len(bot.guilds))
+metricas.medidor("dragons_shard_latencia_segundos", "Latencia del heartbeat por shard", lambda: {
+    (("shard", shard_id),): ws.latency if ws else float("nan") for shard_id, ws in _websockets_gateway().items()
+})
+metricas.medidor("dragons_shard_servidores", "Servidores por shard", lambda: {
+    (("shard", shard_id),): cantidad
+    for shard_id, cantidad in Counter(guild.shard_id for guild in bot.guilds).items()
+})
+metricas.medidor("dragons_shard_listo_segundos", "Segundos desde el arranque hasta el primer READY de cada shard", lambda: {
+    (("shard", shard_id),): segundos for shard_id, segundos in _shards_listos_en.items()
+})
+metricas.medidor("dragons_cola_canales_pendientes", "Creaciones y borrados de canales de tickets en cola", cola_canales.pendientes)
+metricas.medidor("dragons_usuarios_lote_pendientes", "Usuarios pendientes de guardar en el próximo lote", registro_usuarios.pendientes)
+metricas.medidor("dragons_cache_config_entradas", "Filas de configuración en la caché", lambda: len(config_cache))
+metricas.medidor("dragons_cache_warns_entradas", "Usuarios en la caché de advertencias", lambda: len(cache_warns))
+metricas.medidor("dragons_cache_miembros_entradas", "Miembros y usuarios en la LRU de miembros_recientes", lambda: len(miembros_recientes))
+metricas.medidor("dragons_miembros_en_cache", "Miembros en la caché de discord.py (según MEMBER_CACHE)", lambda: sum(len(g.members) for g in bot.guilds))
+metricas.medidor("dragons_tickets_abiertos", "Tickets abiertos con registro de mensajes activo", lambda: len(tickets_abiertos))
 
 # ==============================
 # INICIAR BOT
 # ==============================
-if DISCORD_TOKEN:
-    bot.run(DISCORD_TOKEN)
-else:
-    print("❌ ERROR: No se encontró DISCORD_TOKEN en el entorno.")
\ No newline at end of file
+# Protegido con __main__ para que tools/ pueda importar los handlers sin arrancar el bot
+if __name__ == "__main__":
+    if DISCORD_TOKEN:
+        bot.run(DISCORD_TOKEN)
+    else:
+        print("❌ ERROR: No se encontró DISCORD_TOKEN en el entorno.")
@@ -0,0 +1,12 @@
+-- Clave de idempotencia de los insert del diario local de escrituras.
+-- Cada fila que el bot inserta desde el diario lleva un diario_id generado al
+-- anotarla y se envía como upsert con on_conflict=diario_id que ignora
+-- duplicados: si un envío se repite porque no se supo si llegó (timeout,
+-- apagado a mitad), Supabase no guarda la fila dos veces. Las filas anteriores
+-- quedan con diario_id nulo (los nulos no chocan en el índice único).
+
+alter table tickets add column if not exists diario_id uuid;
+create unique index if not exists tickets_diario_id_idx on tickets (diario_id);
+
+alter table warns add column if not exists diario_id uuid;
+create unique index if not exists warns_diario_id_idx on warns (diario_id);
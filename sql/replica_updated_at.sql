@@ -0,0 +1,33 @@
+-- Columna updated_at para la réplica local de lectura del bot.
+-- Cada REPLICA_INTERVALO segundos el bot pide solo las filas con updated_at
+-- posterior a la última que vio. Sin esta migración la réplica funciona igual,
+-- pero los cambios hechos fuera del bot solo se ven en la recarga completa
+-- (REPLICA_RESINCRONIZAR).
+-- now() es la hora de inicio de la transacción: una transacción larga puede
+-- confirmar con un updated_at anterior a filas ya vistas, por eso el bot pide
+-- las filas con un margen de REPLICA_SOLAPE segundos.
+
+create or replace function dragons_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at = now();
+    return new;
+end;
+$$;
+
+do $$
+declare
+    tabla text;
+begin
+    foreach tabla in array array['ticket_config', 'bienvenidas', 'despedidas', 'tickets', 'warns'] loop
+        execute format('alter table %I add column if not exists updated_at timestamptz not null default now()', tabla);
+        execute format('create index if not exists %I on %I (updated_at)', tabla || '_updated_at_idx', tabla);
+        -- Los upsert que actualizan (on conflict do update) también disparan el trigger
+        execute format('drop trigger if exists %I on %I', tabla || '_updated_at', tabla);
+        execute format('create trigger %I before update on %I for each row execute function dragons_updated_at()',
+                       tabla || '_updated_at', tabla);
+    end loop;
+end;
+$$;
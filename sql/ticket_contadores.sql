@@ -0,0 +1,38 @@
+-- Contador de tickets por servidor.
+-- reservar_tickets(guild, n) reserva n números de forma atómica y devuelve el
+-- último del bloque; el bot reparte el bloque localmente.
+
+create table if not exists ticket_contadores (
+    guild_id text primary key,
+    ultimo bigint not null default 0
+);
+
+-- Necesario para inicializar el contador desde los tickets existentes
+create index if not exists tickets_guild_numero_idx on tickets (guild_id, numero);
+
+create or replace function reservar_tickets(p_guild_id text, p_cantidad int default 1)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_ultimo bigint;
+begin
+    update ticket_contadores
+       set ultimo = ultimo + p_cantidad
+     where guild_id = p_guild_id
+    returning ultimo into v_ultimo;
+
+    if not found then
+        insert into ticket_contadores (guild_id, ultimo)
+        values (
+            p_guild_id,
+            coalesce((select max(numero) from tickets where guild_id = p_guild_id), 0) + p_cantidad
+        )
+        on conflict (guild_id) do update
+            set ultimo = ticket_contadores.ultimo + p_cantidad
+        returning ultimo into v_ultimo;
+    end if;
+
+    return v_ultimo;
+end;
+$$;
@@ -0,0 +1,12 @@
+-- Advertencias por servidor.
+-- Antes /warn no guardaba el servidor y /warnings, /userinfo y /unwarns
+-- mezclaban las advertencias de todos los servidores. Las filas anteriores a
+-- esta migración quedan con guild_id nulo y el bot ya no las muestra; si se
+-- sabe de qué servidor son, se pueden asignar con:
+--   update warns set guild_id = '<guild_id>' where guild_id is null and user_id = '<user_id>';
+
+alter table warns add column if not exists guild_id text;
+
+-- Conteos y paginación por clave (warned_at, id) de /warnings
+create index if not exists warns_guild_user_warned_idx
+    on warns (guild_id, user_id, warned_at desc, id desc);
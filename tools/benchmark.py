@@ -0,0 +1,324 @@
+"""Benchmark de todos los handlers de Dragons.py con límites de regresión.
+
+Cada comando, botón y evento se ejecuta contra objetos de Discord falsos y el
+PostgREST falso (sin latencia), y por invocación se mide: tiempo, consultas a
+Supabase, lecturas de tablas completas, llamadas a la API de Discord y memoria
+reservada. El informe se guarda en JSON y el proceso termina con código 1 si
+algún handler supera los límites de tools/benchmark_limites.json.
+
+    python tools/benchmark.py
+    python tools/benchmark.py --solo warn ver_warns --repeticiones 50
+    python tools/benchmark.py --actualizar-limites   # tras un cambio intencionado
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes_discord
+from fakes_discord import (
+    FakeInteraction, FakeUser, crear_servidor_de_pruebas, filas_de_configuracion, nuevo_id, registrar_servidores,
+    salida_de
+)
+from loadtest import preparar_entorno
+
+LIMITES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_limites.json")
+# Margen sobre lo medido al regenerar los límites de tiempo y memoria (no deterministas)
+MARGEN_MS = 3.0
+MARGEN_KB = 2.0
+
+BENCHMARKS = {}
+
+
+def benchmark(nombre):
+    """Registrar `preparar(ctx)`, que devuelve la coroutine a medir"""
+    def decorador(preparar):
+        BENCHMARKS[nombre] = preparar
+        return preparar
+    return decorador
+
+
+class Contexto:
+    def __init__(self, Dragons, servidor):
+        self.Dragons = Dragons
+        self.servidor = servidor
+        self.guild = crear_servidor_de_pruebas()
+        self.guild_raid = crear_servidor_de_pruebas()
+        registrar_servidores(Dragons.bot, self.guild, self.guild_raid)
+        for guild in (self.guild, self.guild_raid):
+            for tabla, filas in filas_de_configuracion(guild).items():
+                servidor.sembrar(tabla, filas)
+        self.guild.al_recibir_mensaje = Dragons.registrar_mensaje_ticket
+        self.objetivo = FakeUser("objetivo", guild=self.guild)
+        servidor.sembrar("warns", [
+            {"guild_id": str(self.guild.id), "user_id": str(self.objetivo.id), "username": "objetivo",
+             "reason": f"motivo {i}", "warned_by": "staff"}
+            for i in range(25)
+        ])
+
+    def interaccion(self, usuario=None, canal=None):
+        return FakeInteraction(self.guild, usuario or self.guild.staff, canal or self.guild.canal_panel)
+
+
+# ---------- eventos ----------
+@benchmark("on_guild_join")
+async def _(ctx):
+    return ctx.Dragons.on_guild_join(fakes_discord.FakeGuild("Nuevo servidor"))
+
+@benchmark("on_member_join")
+async def _(ctx):
+    # Las repeticiones seguidas activarían el modo raid: se mide una entrada normal
+    ctx.Dragons.detector_raids._anillos.pop(ctx.guild.id, None)
+    return ctx.Dragons.on_member_join(FakeUser("nuevo", guild=ctx.guild))
+
+@benchmark("on_member_join_raid")
+async def _(ctx):
+    detector = ctx.Dragons.detector_raids
+    if not detector.en_raid(ctx.guild_raid.id):
+        while not detector.en_raid(ctx.guild_raid.id):
+            await ctx.Dragons.on_member_join(FakeUser("raider", guild=ctx.guild_raid))
+        await asyncio.sleep(0.01)  # dejar que salga la alerta del canal de logs
+    return ctx.Dragons.on_member_join(FakeUser("raider", guild=ctx.guild_raid))
+
+@benchmark("on_raw_member_remove")
+async def _(ctx):
+    return ctx.Dragons.on_raw_member_remove(salida_de(FakeUser("saliente", guild=ctx.guild)))
+
+@benchmark("on_message_ticket")
+async def _(ctx):
+    canal = ctx.guild.crear_canal("ticket-bench")
+    ctx.Dragons.iniciar_registro(canal, 0)
+    mensaje = fakes_discord.FakeMessage(canal, ctx.guild.staff, "hola", {})
+    return ctx.Dragons.registrar_mensaje_ticket(mensaje)
+
+# ---------- configuración ----------
+@benchmark("crear_bienvenida")
+async def _(ctx):
+    g = ctx.guild
+    return ctx.Dragons.crear_bienvenida.callback(ctx.interaccion(), g.canal_bienvenidas, "Hola", "Hola {usuario}", "https://example.com/a.gif", "#0099ff")
+
+@benchmark("crear_despedida")
+async def _(ctx):
+    g = ctx.guild
+    return ctx.Dragons.crear_despedida.callback(ctx.interaccion(), g.canal_despedidas, "Adiós", "Chao {usuario}", "https://example.com/b.gif", "#ff0000")
+
+@benchmark("ticket_config")
+async def _(ctx):
+    g = ctx.guild
+    return ctx.Dragons.ticket_config.callback(ctx.interaccion(), g.categoria_tickets, g.canal_logs, g.rol_soporte, "Tickets", "Abre un ticket", "#4169e1")
+
+@benchmark("ticket_panel")
+async def _(ctx):
+    return ctx.Dragons.ticket_panel.callback(ctx.interaccion())
+
+# ---------- tickets ----------
+@benchmark("create_ticket")
+async def _(ctx):
+    cliente = FakeUser("cliente", guild=ctx.guild)
+    return ctx.Dragons.TicketButton().create_ticket.callback(ctx.interaccion(cliente))
+
+@benchmark("close_ticket")
+async def _(ctx):
+    cliente = FakeUser("cliente", guild=ctx.guild)
+    await ctx.Dragons.TicketButton().create_ticket.callback(ctx.interaccion(cliente))
+    await ctx.Dragons.diario.vaciar()
+    canal = max((c for c in ctx.guild.canales.values() if c.name.endswith(cliente.name)), key=lambda c: c.id)
+    return ctx.Dragons.TicketControls().close_ticket.callback(ctx.interaccion(canal=canal))
+
+# ---------- moderación ----------
+@benchmark("eliminar_ban")
+async def _(ctx):
+    return ctx.Dragons.eliminar_ban.callback(ctx.interaccion(), str(ctx.objetivo.id))
+
+@benchmark("warn")
+async def _(ctx):
+    return ctx.Dragons.warn.callback(ctx.interaccion(), FakeUser("advertido", guild=ctx.guild), "spam")
+
+@benchmark("ver_warns")
+async def _(ctx):
+    return ctx.Dragons.ver_warns.callback(ctx.interaccion(), ctx.objetivo)
+
+@benchmark("warnings_pagina")
+async def _(ctx):
+    # Clic en "Siguiente" de /warnings: una consulta por clave (la primera página sale de la caché)
+    interaccion = ctx.interaccion()
+    total, warns, hay_mas = await ctx.Dragons.cache_warns.pagina(str(ctx.guild.id), str(ctx.objetivo.id))
+    paginas = ctx.Dragons.PaginasWarns(ctx.guild.staff.id, str(ctx.guild.id), ctx.objetivo)
+    paginas.mostrar(0, total, warns, hay_mas)
+    return paginas.siguiente.callback(interaccion)
+
+@benchmark("eliminar_warn")
+async def _(ctx):
+    usuario = FakeUser("perdonado", guild=ctx.guild)
+    ctx.servidor.sembrar("warns", [{"guild_id": str(ctx.guild.id), "user_id": str(usuario.id), "username": usuario.name, "reason": "x", "warned_by": "staff"}])
+    return ctx.Dragons.eliminar_warn.callback(ctx.interaccion(), usuario, None)
+
+@benchmark("mute")
+async def _(ctx):
+    return ctx.Dragons.mute.callback(ctx.interaccion(), FakeUser("ruidoso", guild=ctx.guild), 10, "spam")
+
+@benchmark("unmute")
+async def _(ctx):
+    return ctx.Dragons.unmute.callback(ctx.interaccion(), FakeUser("ruidoso", guild=ctx.guild), "perdonado")
+
+# Comandos masivos sobre 20 usuarios: una consulta en total, no una por usuario
+@benchmark("mute_masivo")
+async def _(ctx):
+    usuarios = " ".join(f"<@{nuevo_id()}>" for _ in range(20))
+    return ctx.Dragons.mute_masivo.callback(ctx.interaccion(), 10, usuarios=usuarios, motivo="raid")
+
+@benchmark("warn_masivo")
+async def _(ctx):
+    usuarios = " ".join(f"<@{nuevo_id()}>" for _ in range(20))
+    return ctx.Dragons.warn_masivo.callback(ctx.interaccion(), "raid", usuarios=usuarios)
+
+@benchmark("unban_masivo")
+async def _(ctx):
+    return ctx.Dragons.unban_masivo.callback(ctx.interaccion(), " ".join(str(nuevo_id()) for _ in range(20)))
+
+# ---------- información ----------
+@benchmark("bot_statistics")
+async def _(ctx):
+    return ctx.Dragons.bot_statistics.callback(ctx.interaccion())
+
+@benchmark("perfil")
+async def _(ctx):
+    return ctx.Dragons.perfil.callback(ctx.interaccion(), ctx.objetivo)
+
+@benchmark("help_command")
+async def _(ctx):
+    return ctx.Dragons.help_command.callback(ctx.interaccion())
+
+
+async def completar(ctx, coro):
+    """Ejecutar el handler y esperar las escrituras, logs y DMs que dejó en cola"""
+    await coro
+    await ctx.Dragons.diario.vaciar()
+    await ctx.Dragons.logs_agrupados.vaciar()
+    await ctx.Dragons.repartidor_dms.vaciar()
+
+
+async def medir(ctx, nombre, repeticiones):
+    """Ejecutar el handler una vez para calentar cachés y `repeticiones` veces midiendo"""
+    await completar(ctx, await BENCHMARKS[nombre](ctx))
+    tiempos, consultas, escaneos, discord_api, memoria = [], [], [], [], []
+    for _ in range(repeticiones):
+        coro = await BENCHMARKS[nombre](ctx)
+        consultas_antes = ctx.servidor.total_peticiones()
+        escaneos_antes = ctx.servidor.total_escaneos()
+        discord_antes = sum(fakes_discord.llamadas_discord.values())
+        tracemalloc.reset_peak()
+        memoria_antes = tracemalloc.get_traced_memory()[0]
+        inicio = time.perf_counter()
+        await completar(ctx, coro)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        memoria.append((tracemalloc.get_traced_memory()[1] - memoria_antes) / 1024)
+        consultas.append(ctx.servidor.total_peticiones() - consultas_antes)
+        escaneos.append(ctx.servidor.total_escaneos() - escaneos_antes)
+        discord_api.append(sum(fakes_discord.llamadas_discord.values()) - discord_antes)
+    return {
+        "ms_mediana": round(statistics.median(tiempos), 3),
+        "ms_max": round(max(tiempos), 3),
+        "consultas": round(statistics.mean(consultas), 2),
+        "escaneos": round(statistics.mean(escaneos), 2),
+        "llamadas_discord": round(statistics.mean(discord_api), 2),
+        "kb_pico": round(statistics.median(memoria), 1),
+    }
+
+
+def comparar(resultados, limites):
+    """Devolver la lista de regresiones (handler, métrica, valor, límite)"""
+    regresiones = []
+    for nombre, metricas in resultados.items():
+        for metrica, limite in limites.get(nombre, {}).items():
+            valor = metricas[metrica]
+            if valor > limite:
+                regresiones.append((nombre, metrica, valor, limite))
+    return regresiones
+
+
+def _redondear_arriba(valor):
+    # Las medias dependen de en qué invocación cae, p. ej., la reserva de un bloque de tickets
+    return math.ceil(valor * 2) / 2
+
+def limites_desde(resultados):
+    return {
+        nombre: {
+            "consultas": _redondear_arriba(m["consultas"]),
+            "escaneos": m["escaneos"],
+            "llamadas_discord": _redondear_arriba(m["llamadas_discord"]),
+            "ms_mediana": round(max(m["ms_mediana"] * MARGEN_MS, 5.0), 1),
+            "kb_pico": round(max(m["kb_pico"] * MARGEN_KB, 64.0), 1),
+        }
+        for nombre, m in resultados.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los handlers de Dragons.py")
+    parser.add_argument("--solo", nargs="*", choices=sorted(BENCHMARKS), help="handlers a medir (por defecto todos)")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--informe", default="benchmark_informe.json", help="ruta del informe JSON")
+    parser.add_argument("--actualizar-limites", action="store_true", help="reescribir los límites con lo medido")
+    args = parser.parse_args()
+
+    servidor, Dragons = preparar_entorno(0.0, 0.0)
+    Dragons.TICKET_CIERRE_SEGUNDOS = 0
+    Dragons.repartidor_dms.intervalo = 0  # sin el ritmo anti-spam de los DMs
+
+    async def buscar_usuario(user_id):
+        await fakes_discord._api("fetch_user")
+        return FakeUser("baneado", user_id=user_id)
+    Dragons.bot.fetch_user = buscar_usuario
+
+    async def ejecutar():
+        ctx = Contexto(Dragons, servidor)
+        await Dragons.replica.cargar()  # como en producción: las lecturas calientes salen de la réplica
+        return {nombre: await medir(ctx, nombre, args.repeticiones) for nombre in (args.solo or BENCHMARKS)}
+
+    tracemalloc.start()
+    resultados = asyncio.run(ejecutar())
+    tracemalloc.stop()
+
+    print(f"{'handler':<20}{'ms p50':>9}{'ms máx':>9}{'consultas':>11}{'escaneos':>10}{'discord':>9}{'KB':>9}")
+    for nombre, m in resultados.items():
+        print(f"{nombre:<20}{m['ms_mediana']:>9.2f}{m['ms_max']:>9.2f}{m['consultas']:>11.2f}"
+              f"{m['escaneos']:>10.2f}{m['llamadas_discord']:>9.2f}{m['kb_pico']:>9.1f}")
+
+    with open(args.informe, "w", encoding="utf-8") as archivo:
+        json.dump({"repeticiones": args.repeticiones, "handlers": resultados}, archivo, indent=2, ensure_ascii=False)
+
+    if args.actualizar_limites:
+        limites = {}
+        if os.path.exists(LIMITES):
+            with open(LIMITES, encoding="utf-8") as archivo:
+                limites = json.load(archivo)
+        limites.update(limites_desde(resultados))
+        with open(LIMITES, "w", encoding="utf-8") as archivo:
+            json.dump(limites, archivo, indent=2, ensure_ascii=False, sort_keys=True)
+            archivo.write("\n")
+        print(f"\n📝 Límites actualizados en {LIMITES}")
+        return
+
+    with open(LIMITES, encoding="utf-8") as archivo:
+        limites = json.load(archivo)
+    regresiones = comparar(resultados, limites)
+    faltan = sorted(set(resultados) - set(limites))
+    for nombre in faltan:
+        print(f"⚠️ {nombre} no tiene límites: ejecuta con --actualizar-limites")
+    for nombre, metrica, valor, limite in regresiones:
+        print(f"❌ {nombre}: {metrica} = {valor} (límite {limite})")
+    if regresiones:
+        sys.exit(1)
+    print("\n✅ Ningún handler superó sus límites.")
+
+
+if __name__ == "__main__":
+    main()
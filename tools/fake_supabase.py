@@ -0,0 +1,328 @@
+"""Servidor PostgREST falso para medir Dragons.py sin un proyecto de Supabase.
+
+Implementa solo lo que usa el bot sobre tablas en memoria: select con filtros
+(eq, neq, lt, lte, gt, gte, in, is, or/and anidados), order/limit/offset, conteos con
+`Prefer: count=...`, insert, upsert, update, delete y la RPC reservar_tickets.
+Cada petición espera --latencia-ms (± --jitter-ms) para simular la ida y
+vuelta a Supabase.
+
+    python tools/fake_supabase.py --puerto 54321 --latencia-ms 40
+    SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_KEY=fake python Dragons.py
+"""
+import argparse
+import asyncio
+import csv
+import datetime
+import json
+import random
+import threading
+from collections import Counter
+
+from aiohttp import web
+
+# Clave usada por los upserts sin on_conflict (la clave primaria de cada tabla)
+CLAVES = {
+    "servers": "guild_id",
+    "usuarios": "user_id",
+    "bienvenidas": "guild_id",
+    "despedidas": "guild_id",
+    "ticket_config": "guild_id",
+    "tickets": "id",
+    "warns": "id",
+    "baneados": "id",
+    "ticket_contadores": "guild_id",
+}
+
+# Columnas con valor por defecto en la base de datos real
+POR_DEFECTO = {
+    "tickets": ("created_at",),
+    "warns": ("warned_at",),
+}
+
+# Tablas con updated_at y su trigger (sql/replica_updated_at.sql)
+CON_UPDATED_AT = {"ticket_config", "bienvenidas", "despedidas", "tickets", "warns"}
+
+PARAMETROS_RESERVADOS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def _ahora():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _comparable(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return str(valor)
+
+
+def _cumple(fila, filtros):
+    for columna, operador, criterio in filtros:
+        negado = operador.startswith("not.")
+        if negado:
+            operador = operador[4:]
+        valor = fila.get(columna)
+        if operador in ("or", "and"):
+            resultados = [_cumple(fila, [filtro]) for filtro in criterio]
+            ok = any(resultados) if operador == "or" else all(resultados)
+        elif operador == "eq":
+            ok = valor is not None and str(valor) == criterio
+        elif operador == "neq":
+            ok = valor is not None and str(valor) != criterio
+        elif operador == "in":
+            ok = valor is not None and str(valor) in criterio
+        elif operador == "is":
+            ok = (valor is None) if criterio == "null" else str(valor).lower() == criterio
+        elif operador in ("lt", "lte", "gt", "gte"):
+            if valor is None:
+                ok = False
+            else:
+                a, b = _comparable(valor), _comparable(criterio)
+                if type(a) is not type(b):
+                    a, b = str(valor), criterio
+                ok = {"lt": a < b, "lte": a <= b, "gt": a > b, "gte": a >= b}[operador]
+        else:
+            raise ValueError(f"operador no soportado: {operador}")
+        if ok == negado:
+            return False
+    return True
+
+
+def _parsear_filtro(columna, expresion):
+    partes = expresion.split(".", 2 if expresion.startswith("not.") else 1)
+    if expresion.startswith("not."):
+        operador, criterio = f"not.{partes[1]}", partes[2]
+    else:
+        operador, criterio = partes
+    if operador.endswith("in"):
+        criterio = set(next(csv.reader([criterio.strip("()")])))
+    elif len(criterio) > 1 and criterio[0] == criterio[-1] == '"':
+        criterio = criterio[1:-1]
+    return (columna, operador, criterio)
+
+
+def _dividir(texto):
+    """Separar por comas de primer nivel (fuera de paréntesis y comillas)"""
+    partes, actual, nivel, comillas = [], "", 0, False
+    for caracter in texto:
+        if caracter == '"':
+            comillas = not comillas
+        elif not comillas and caracter in "()":
+            nivel += 1 if caracter == "(" else -1
+        if caracter == "," and nivel == 0 and not comillas:
+            partes.append(actual)
+            actual = ""
+        else:
+            actual += caracter
+    partes.append(actual)
+    return partes
+
+
+def _parsear_logico(operador, texto):
+    """`or=(a.lt.1,and(a.eq.1,id.lt.5))` -> (None, "or", [filtros])"""
+    filtros = []
+    for parte in _dividir(texto[1:-1]):
+        if parte.startswith(("and(", "or(")):
+            anidado, _, resto = parte.partition("(")
+            filtros.append(_parsear_logico(anidado, "(" + resto))
+        else:
+            columna, expresion = parte.split(".", 1)
+            filtros.append(_parsear_filtro(columna, expresion))
+    return (None, operador, filtros)
+
+
+def _parsear_filtros(query):
+    filtros = []
+    for columna, expresion in query.items():
+        if columna in PARAMETROS_RESERVADOS:
+            continue
+        if columna in ("or", "and"):
+            filtros.append(_parsear_logico(columna, expresion))
+        else:
+            filtros.append(_parsear_filtro(columna, expresion))
+    return filtros
+
+
+class FakeSupabase:
+    def __init__(self, latencia_ms=0.0, jitter_ms=0.0):
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.tablas = {tabla: [] for tabla in CLAVES}
+        self._siguiente_id = Counter()
+        self.peticiones = Counter()  # (tabla, método) -> número de peticiones
+        self.escaneos = Counter()    # tabla -> lecturas sin filtro ni límite (descargan la tabla entera)
+        self.app = web.Application()
+        self.app.router.add_get("/_stats", self._stats)
+        self.app.router.add_post("/rest/v1/rpc/{funcion}", self._rpc)
+        self.app.router.add_route("*", "/rest/v1/{tabla}", self._tabla)
+
+    # ---------- utilidades para los scripts ----------
+    def sembrar(self, tabla, filas):
+        for fila in filas:
+            self._insertar(tabla, dict(fila))
+
+    def total_peticiones(self):
+        return sum(self.peticiones.values())
+
+    def total_escaneos(self):
+        return sum(self.escaneos.values())
+
+    def iniciar_en_hilo(self, host="127.0.0.1", puerto=0):
+        """Arrancar el servidor en un hilo propio y devolver su URL"""
+        listo = threading.Event()
+        estado = {}
+
+        def hilo():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            runner = web.AppRunner(self.app, access_log=None)
+            loop.run_until_complete(runner.setup())
+            sitio = web.TCPSite(runner, host, puerto)
+            loop.run_until_complete(sitio.start())
+            estado["puerto"] = sitio._server.sockets[0].getsockname()[1]
+            listo.set()
+            loop.run_forever()
+
+        threading.Thread(target=hilo, name="fake-supabase", daemon=True).start()
+        listo.wait()
+        return f"http://{host}:{estado['puerto']}"
+
+    # ---------- almacenamiento ----------
+    def _insertar(self, tabla, fila):
+        clave = CLAVES[tabla]
+        if clave == "id" and "id" not in fila:
+            self._siguiente_id[tabla] += 1
+            fila["id"] = self._siguiente_id[tabla]
+        for columna in POR_DEFECTO.get(tabla, ()):
+            fila.setdefault(columna, _ahora())
+        if tabla in CON_UPDATED_AT:
+            fila["updated_at"] = _ahora()
+        self.tablas[tabla].append(fila)
+        return fila
+
+    def _upsert(self, tabla, nuevas, on_conflict, ignorar_duplicados=False):
+        columnas = on_conflict.split(",") if on_conflict else [CLAVES[tabla]]
+        clave = lambda fila: tuple(str(fila.get(c)) for c in columnas)
+        existentes = {clave(f): f for f in self.tablas[tabla]}
+        afectadas = []
+        for fila in nuevas:
+            existente = existentes.get(clave(fila)) if all(c in fila for c in columnas) else None
+            if existente is None:
+                existente = existentes[clave(fila)] = self._insertar(tabla, fila)
+            elif not ignorar_duplicados:
+                existente.update(fila)
+                if tabla in CON_UPDATED_AT:
+                    existente["updated_at"] = _ahora()
+            afectadas.append(existente)
+        return afectadas
+
+    # ---------- HTTP ----------
+    async def _esperar(self):
+        if self.latencia_ms or self.jitter_ms:
+            retardo = random.gauss(self.latencia_ms, self.jitter_ms) if self.jitter_ms else self.latencia_ms
+            await asyncio.sleep(max(0.0, retardo) / 1000)
+
+    async def _stats(self, request):
+        return web.json_response({f"{tabla} {metodo}": n for (tabla, metodo), n in self.peticiones.items()})
+
+    async def _rpc(self, request):
+        funcion = request.match_info["funcion"]
+        self.peticiones[(f"rpc/{funcion}", "POST")] += 1
+        await self._esperar()
+        if funcion != "reservar_tickets":
+            return web.json_response(
+                {"code": "PGRST202", "message": f"Could not find the function public.{funcion}", "details": None, "hint": None},
+                status=404
+            )
+        parametros = await request.json()
+        guild_id, cantidad = parametros["p_guild_id"], int(parametros.get("p_cantidad", 1))
+        contadores = [f for f in self.tablas["ticket_contadores"] if f["guild_id"] == guild_id]
+        if contadores:
+            contadores[0]["ultimo"] += cantidad
+            ultimo = contadores[0]["ultimo"]
+        else:
+            numeros = [int(t["numero"]) for t in self.tablas["tickets"] if t.get("guild_id") == guild_id]
+            ultimo = max(numeros, default=0) + cantidad
+            self._insertar("ticket_contadores", {"guild_id": guild_id, "ultimo": ultimo})
+        return web.json_response(ultimo)
+
+    async def _tabla(self, request):
+        tabla = request.match_info["tabla"]
+        self.peticiones[(tabla, request.method)] += 1
+        if tabla not in self.tablas:
+            return web.json_response(
+                {"code": "42P01", "message": f'relation "public.{tabla}" does not exist', "details": None, "hint": None},
+                status=404
+            )
+        await self._esperar()
+
+        prefer = request.headers.get("Prefer", "")
+        filtros = _parsear_filtros(request.query)
+        filas = self.tablas[tabla]
+
+        if request.method in ("GET", "HEAD"):
+            if request.method == "GET" and not filtros and "limit" not in request.query:
+                self.escaneos[tabla] += 1
+            resultado = [f for f in filas if _cumple(f, filtros)]
+            total = len(resultado)
+            for orden in reversed(request.query.get("order", "").split(",") if request.query.get("order") else []):
+                columna, *modificadores = orden.split(".")
+                resultado.sort(key=lambda f: (f.get(columna) is None, _comparable(f.get(columna))), reverse="desc" in modificadores)
+            offset = int(request.query.get("offset", 0))
+            limite = request.query.get("limit")
+            resultado = resultado[offset:offset + int(limite) if limite else None]
+            columnas = [c.strip() for c in request.query.get("select", "*").split(",")]
+            if "*" not in columnas:
+                resultado = [{c: f.get(c) for c in columnas} for f in resultado]
+            cabeceras = {}
+            if "count=" in prefer:
+                rango = f"{offset}-{offset + len(resultado) - 1}" if resultado else "*"
+                cabeceras["Content-Range"] = f"{rango}/{total}"
+            if request.method == "HEAD":
+                return web.Response(status=200, headers=cabeceras)
+            return web.json_response(resultado, headers=cabeceras)
+
+        if request.method == "POST":
+            cuerpo = await request.json()
+            nuevas = cuerpo if isinstance(cuerpo, list) else [cuerpo]
+            if "resolution=" in prefer:
+                afectadas = self._upsert(tabla, [dict(f) for f in nuevas], request.query.get("on_conflict", ""),
+                                         "ignore-duplicates" in prefer)
+            else:
+                afectadas = [self._insertar(tabla, dict(f)) for f in nuevas]
+            estado = 201
+        elif request.method == "PATCH":
+            cambios = await request.json()
+            afectadas = [f for f in filas if _cumple(f, filtros)]
+            for fila in afectadas:
+                fila.update(cambios)
+                if tabla in CON_UPDATED_AT:
+                    fila["updated_at"] = _ahora()
+            estado = 200
+        elif request.method == "DELETE":
+            afectadas = [f for f in filas if _cumple(f, filtros)]
+            self.tablas[tabla] = [f for f in filas if not _cumple(f, filtros)]
+            estado = 200
+        else:
+            return web.Response(status=405)
+
+        if "return=minimal" in prefer:
+            return web.Response(status=204 if estado == 200 else estado)
+        return web.Response(status=estado, text=json.dumps(afectadas), content_type="application/json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PostgREST falso en memoria para Dragons.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=54321)
+    parser.add_argument("--latencia-ms", type=float, default=0.0, help="latencia media por petición")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="desviación de la latencia")
+    args = parser.parse_args()
+
+    servidor = FakeSupabase(args.latencia_ms, args.jitter_ms)
+    print(f"🧪 PostgREST falso en http://{args.host}:{args.puerto} (latencia {args.latencia_ms} ms)")
+    web.run_app(servidor.app, host=args.host, port=args.puerto, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
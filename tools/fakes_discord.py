@@ -0,0 +1,287 @@
+"""Objetos de Discord falsos para ejecutar los handlers de Dragons.py sin gateway.
+
+Solo implementan los atributos y métodos que usan los handlers. Cada llamada
+que en Discord sería una petición HTTP se cuenta en `llamadas_discord` y
+espera `LATENCIA_DISCORD` segundos.
+"""
+import asyncio
+import datetime
+import itertools
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import discord
+
+llamadas_discord = Counter()
+LATENCIA_DISCORD = 0.0
+_ids = itertools.count(10**17)
+
+
+async def _api(nombre):
+    llamadas_discord[nombre] += 1
+    if LATENCIA_DISCORD:
+        await asyncio.sleep(LATENCIA_DISCORD)
+
+
+def nuevo_id():
+    return next(_ids)
+
+
+class FakeAvatar:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class FakeUser:
+    def __init__(self, nombre, administrador=False, guild=None, user_id=None):
+        self.id = user_id or nuevo_id()
+        self.name = nombre
+        self.mention = f"<@{self.id}>"
+        self.guild = guild
+        self.bot = False
+        self.avatar = None
+        self.default_avatar = FakeAvatar()
+        self.display_avatar = FakeAvatar()
+        self.guild_permissions = SimpleNamespace(administrator=administrador)
+        self.joined_at = datetime.datetime.now(datetime.timezone.utc)
+        self.dms_cerrados = False
+
+    async def send(self, *args, **kwargs):
+        await _api("dm")
+        if self.dms_cerrados:
+            raise discord.Forbidden(SimpleNamespace(status=403, reason="Forbidden"), "Cannot send messages to this user")
+        return FakeMessage(None, self, args[0] if args else None, kwargs)
+
+    async def timeout(self, hasta, reason=None):
+        await _api("timeout")
+
+    def __eq__(self, otro):
+        return isinstance(otro, FakeUser) and otro.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeRole:
+    def __init__(self, nombre):
+        self.id = nuevo_id()
+        self.name = nombre
+        self.mention = f"<@&{self.id}>"
+
+
+class FakeMessage:
+    def __init__(self, canal, autor, contenido, kwargs):
+        self.id = nuevo_id()
+        self.channel = canal
+        self.author = autor
+        self.content = contenido or ""
+        self.embeds = [e for e in [kwargs.get("embed")] + list(kwargs.get("embeds") or []) if e]
+        self.attachments = []
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+
+    async def edit(self, **kwargs):
+        await _api("editar_mensaje")
+
+
+class FakeTextChannel:
+    def __init__(self, guild, nombre):
+        self.id = nuevo_id()
+        self.guild = guild
+        self.name = nombre
+        self.mention = f"<#{self.id}>"
+        self.mensajes = []
+        self.last_message_id = None
+
+    async def send(self, content=None, **kwargs):
+        await _api("enviar_mensaje")
+        if kwargs.get("file"):
+            kwargs["file"].close()
+        for archivo in kwargs.get("files") or []:
+            archivo.close()
+        mensaje = FakeMessage(self, self.guild.me, content, kwargs)
+        self.mensajes.append(mensaje)
+        self.last_message_id = mensaje.id
+        if self.guild.al_recibir_mensaje:
+            await self.guild.al_recibir_mensaje(mensaje)
+        return mensaje
+
+    async def history(self, limit=100, after=None, oldest_first=False):
+        mensajes = self.mensajes if oldest_first else list(reversed(self.mensajes))
+        if after is not None:
+            mensajes = [m for m in mensajes if m.created_at > after]
+        for i in range(0, len(mensajes) if limit is None else min(limit, len(mensajes)), 100):
+            await _api("historial")
+            for mensaje in mensajes[i:i + 100]:
+                yield mensaje
+
+    async def delete(self, reason=None):
+        await _api("borrar_canal")
+        self.guild.canales.pop(self.id, None)
+
+
+class FakeCategory:
+    def __init__(self, guild, nombre):
+        self.id = nuevo_id()
+        self.guild = guild
+        self.name = nombre
+        self.mention = f"<#{self.id}>"
+
+    async def create_text_channel(self, name, overwrites=None, **kwargs):
+        await _api("crear_canal")
+        canal = FakeTextChannel(self.guild, name)
+        self.guild.canales[canal.id] = canal
+        return canal
+
+
+class FakeGuild:
+    def __init__(self, nombre="Servidor de pruebas"):
+        self.id = nuevo_id()
+        self.name = nombre
+        self.unavailable = False
+        self.canales = {}
+        self.roles = {}
+        self.default_role = FakeRole("@everyone")
+        self.me = FakeUser("Dragons", administrador=True, guild=self)
+        self.al_recibir_mensaje = None  # callback(mensaje) para simular on_message
+
+    def crear_canal(self, nombre):
+        canal = FakeTextChannel(self, nombre)
+        self.canales[canal.id] = canal
+        return canal
+
+    def crear_categoria(self, nombre):
+        categoria = FakeCategory(self, nombre)
+        self.canales[categoria.id] = categoria
+        return categoria
+
+    def crear_rol(self, nombre):
+        rol = FakeRole(nombre)
+        self.roles[rol.id] = rol
+        return rol
+
+    def get_channel(self, canal_id):
+        return self.canales.get(canal_id)
+
+    def get_role(self, rol_id):
+        return self.roles.get(rol_id)
+
+    def get_member(self, user_id):
+        return None  # como con MEMBER_CACHE=ninguno
+
+    async def fetch_member(self, user_id):
+        await _api("fetch_member")
+        return FakeUser(f"miembro{user_id}", guild=self, user_id=user_id)
+
+    async def unban(self, user, reason=None):
+        await _api("unban")
+
+
+class FakeResponse:
+    def __init__(self, interaccion):
+        self._interaccion = interaccion
+        self._hecho = False
+
+    def is_done(self):
+        return self._hecho
+
+    async def defer(self, ephemeral=False, thinking=False):
+        await _api("interaccion_defer")
+        self._hecho = True
+
+    async def send_message(self, content=None, **kwargs):
+        await _api("interaccion_respuesta")
+        self._hecho = True
+        self._interaccion.registrar_respuesta(content, kwargs)
+
+    async def edit_message(self, **kwargs):
+        await _api("interaccion_editar_mensaje")
+        self._hecho = True
+        self._interaccion.registrar_respuesta(None, kwargs)
+
+
+class FakeFollowup:
+    def __init__(self, interaccion):
+        self._interaccion = interaccion
+
+    async def send(self, content=None, **kwargs):
+        await _api("interaccion_followup")
+        self._interaccion.registrar_respuesta(content, kwargs)
+        return FakeMessage(self._interaccion.channel, self._interaccion.guild.me, content, kwargs)
+
+
+class FakeInteraction(discord.Interaction):
+    # Atributos de clase que tapan los slots/propiedades de discord.Interaction
+    response = None
+    followup = None
+    guild = None
+    channel = None
+    user = None
+    extras = None
+
+    def __init__(self, guild, user, channel):
+        self.guild = guild
+        self.user = user
+        self.channel = channel
+        self.extras = {}
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.creada = time.perf_counter()
+        self.respondida = None  # instante de la primera respuesta visible
+        self.respuestas = []
+
+    def registrar_respuesta(self, content, kwargs):
+        if self.respondida is None:
+            self.respondida = time.perf_counter()
+        self.respuestas.append((content, kwargs))
+
+    async def delete_original_response(self):
+        await _api("interaccion_borrar_original")
+
+    async def edit_original_response(self, **kwargs):
+        await _api("interaccion_editar_original")
+
+    async def original_response(self):
+        return FakeMessage(self.channel, self.guild.me, None, {})
+
+
+def salida_de(miembro):
+    """Payload de on_raw_member_remove para `miembro`"""
+    return SimpleNamespace(guild_id=miembro.guild.id, user=miembro)
+
+
+def registrar_servidores(bot, *guilds):
+    """Hacer que bot.get_guild() encuentre los servidores falsos"""
+    servidores = {guild.id: guild for guild in guilds}
+    bot.get_guild = servidores.get
+
+
+def crear_servidor_de_pruebas():
+    """Servidor con los canales y roles que usan las configuraciones sembradas"""
+    guild = FakeGuild()
+    guild.canal_bienvenidas = guild.crear_canal("bienvenidas")
+    guild.canal_despedidas = guild.crear_canal("despedidas")
+    guild.canal_logs = guild.crear_canal("ticket-logs")
+    guild.canal_panel = guild.crear_canal("soporte")
+    guild.categoria_tickets = guild.crear_categoria("Tickets")
+    guild.rol_soporte = guild.crear_rol("Soporte")
+    guild.staff = FakeUser("staff", administrador=True, guild=guild)
+    return guild
+
+
+def filas_de_configuracion(guild):
+    """Filas de bienvenidas, despedidas y ticket_config para `guild`"""
+    return {
+        "bienvenidas": [{
+            "guild_id": str(guild.id), "canal_id": str(guild.canal_bienvenidas.id), "encabezado": "Bienvenido",
+            "texto": "Hola {usuario}", "gif": "https://example.com/a.gif", "color": "0099ff",
+        }],
+        "despedidas": [{
+            "guild_id": str(guild.id), "canal_id": str(guild.canal_despedidas.id), "encabezado": "Adiós",
+            "texto": "Chao {usuario}", "gif": "https://example.com/b.gif", "color": "ff0000",
+        }],
+        "ticket_config": [{
+            "guild_id": str(guild.id), "categoria_id": str(guild.categoria_tickets.id),
+            "canal_logs_id": str(guild.canal_logs.id), "rol_soporte_id": str(guild.rol_soporte.id),
+            "titulo": "Tickets", "descripcion": "Abre un ticket", "color": "4169e1",
+        }],
+    }
@@ -0,0 +1,161 @@
+"""Prueba de carga de Dragons.py contra el PostgREST falso.
+
+Lanza eventos sintéticos (on_member_join / on_raw_member_remove) y clics en los
+botones de tickets a un ritmo fijo, con objetos de Discord falsos, y muestra
+la latencia p50/p99 de cada handler y las consultas a Supabase por evento.
+
+    python tools/loadtest.py --escenario joins --eventos 500 --ritmo 100 --latencia-ms 40
+    python tools/loadtest.py --escenario tickets --eventos 50 --ritmo 10
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes_discord
+from fake_supabase import FakeSupabase
+from fakes_discord import (
+    FakeInteraction, FakeUser, crear_servidor_de_pruebas, filas_de_configuracion, registrar_servidores, salida_de
+)
+
+
+def preparar_entorno(latencia_ms, jitter_ms):
+    """Arrancar el PostgREST falso e importar Dragons apuntando a él"""
+    servidor = FakeSupabase(latencia_ms, jitter_ms)
+    os.environ["SUPABASE_URL"] = servidor.iniciar_en_hilo()
+    os.environ["SUPABASE_KEY"] = "fake"
+    os.environ.setdefault("TRANSCRIPTS_DIR", tempfile.mkdtemp(prefix="dragons-transcripts-"))
+    os.environ.setdefault("DIARIO_RUTA", os.path.join(tempfile.mkdtemp(prefix="dragons-diario-"), "diario.db"))
+    import Dragons
+    return servidor, Dragons
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+async def disparar(cantidad, ritmo, crear_evento):
+    """Lanzar `cantidad` eventos a `ritmo` por segundo y devolver (duraciones, errores)"""
+    loop = asyncio.get_running_loop()
+    inicio = loop.time()
+    tareas = []
+
+    async def medir(coro):
+        t0 = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            return None, e
+        return time.perf_counter() - t0, None
+
+    for i in range(cantidad):
+        espera = inicio + i / ritmo - loop.time()
+        if espera > 0:
+            await asyncio.sleep(espera)
+        tareas.append(asyncio.create_task(medir(crear_evento(i))))
+    resultados = await asyncio.gather(*tareas)
+    return [d for d, _ in resultados if d is not None], [e for _, e in resultados if e is not None]
+
+
+def imprimir(nombre, duraciones, errores, eventos, consultas, respuestas=None):
+    print(f"\n▶ {nombre}: {eventos} eventos, {len(errores)} errores")
+    print(f"   duración  p50 {percentil(duraciones, 50) * 1000:8.1f} ms   p99 {percentil(duraciones, 99) * 1000:8.1f} ms"
+          f"   máx {max(duraciones, default=0) * 1000:8.1f} ms")
+    if respuestas:
+        print(f"   respuesta p50 {percentil(respuestas, 50) * 1000:8.1f} ms   p99 {percentil(respuestas, 99) * 1000:8.1f} ms")
+    print(f"   consultas a Supabase por evento: {consultas / max(eventos, 1):.2f}")
+    for error in errores[:3]:
+        print(f"   ❌ {type(error).__name__}: {error}")
+
+
+async def escenario_joins(Dragons, servidor, guild, args):
+    Dragons.registro_usuarios.iniciar()
+    miembros = [FakeUser(f"usuario{i}", guild=guild) for i in range(args.eventos)]
+
+    antes = servidor.total_peticiones()
+    duraciones, errores = await disparar(args.eventos, args.ritmo, lambda i: Dragons.on_member_join(miembros[i]))
+    await Dragons.registro_usuarios.vaciar()
+    await Dragons.diario.vaciar()
+    imprimir("on_member_join", duraciones, errores, args.eventos, servidor.total_peticiones() - antes)
+
+    antes = servidor.total_peticiones()
+    duraciones, errores = await disparar(args.eventos, args.ritmo, lambda i: Dragons.on_raw_member_remove(salida_de(miembros[i])))
+    imprimir("on_raw_member_remove", duraciones, errores, args.eventos, servidor.total_peticiones() - antes)
+    await Dragons.registro_usuarios.detener()
+
+
+async def escenario_tickets(Dragons, servidor, guild, args):
+    guild.al_recibir_mensaje = Dragons.registrar_mensaje_ticket
+    panel = Dragons.TicketButton()
+    controles = Dragons.TicketControls()
+    usuarios = [FakeUser(f"cliente{i}", guild=guild) for i in range(args.eventos)]
+    interacciones = []
+
+    def crear(i):
+        interaccion = FakeInteraction(guild, usuarios[i], guild.canal_panel)
+        interacciones.append(interaccion)
+        return panel.create_ticket.callback(interaccion)
+
+    antes = servidor.total_peticiones()
+    duraciones, errores = await disparar(args.eventos, args.ritmo, crear)
+    await Dragons.diario.vaciar()
+    respuestas = [i.respondida - i.creada for i in interacciones if i.respondida]
+    imprimir("create_ticket", duraciones, errores, args.eventos, servidor.total_peticiones() - antes, respuestas)
+
+    canales = [c for c in guild.canales.values() if c.name.startswith("ticket-") and c is not guild.canal_logs]
+    interacciones = []
+
+    def cerrar(i):
+        interaccion = FakeInteraction(guild, guild.staff, canales[i])
+        interacciones.append(interaccion)
+        return controles.close_ticket.callback(interaccion)
+
+    antes = servidor.total_peticiones()
+    duraciones, errores = await disparar(len(canales), args.ritmo, cerrar)
+    await Dragons.diario.vaciar()
+    respuestas = [i.respondida - i.creada for i in interacciones if i.respondida]
+    imprimir("close_ticket", duraciones, errores, len(canales), servidor.total_peticiones() - antes, respuestas)
+
+
+ESCENARIOS = {"joins": escenario_joins, "tickets": escenario_tickets}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de los handlers de Dragons.py")
+    parser.add_argument("--escenario", choices=[*ESCENARIOS, "todos"], default="todos")
+    parser.add_argument("--eventos", type=int, default=200)
+    parser.add_argument("--ritmo", type=float, default=50.0, help="eventos por segundo")
+    parser.add_argument("--latencia-ms", type=float, default=30.0, help="latencia simulada de Supabase")
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--discord-ms", type=float, default=0.0, help="latencia simulada de la API de Discord")
+    args = parser.parse_args()
+
+    servidor, Dragons = preparar_entorno(args.latencia_ms, args.jitter_ms)
+    fakes_discord.LATENCIA_DISCORD = args.discord_ms / 1000
+    guild = crear_servidor_de_pruebas()
+    registrar_servidores(Dragons.bot, guild)
+    for tabla, filas in filas_de_configuracion(guild).items():
+        servidor.sembrar(tabla, filas)
+
+    async def ejecutar():
+        await Dragons.replica.cargar()
+        escenarios = ESCENARIOS if args.escenario == "todos" else {args.escenario: ESCENARIOS[args.escenario]}
+        for escenario in escenarios.values():
+            await escenario(Dragons, servidor, guild, args)
+        print(f"\nLlamadas a la API de Discord: {dict(fakes_discord.llamadas_discord)}")
+
+    asyncio.run(ejecutar())
+
+
+if __name__ == "__main__":
+    main()
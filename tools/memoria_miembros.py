@@ -0,0 +1,93 @@
+"""Memoria de la caché de miembros de discord.py con cada política de MEMBER_CACHE.
+
+Construye el estado de discord.py con los flags de cada política de Dragons.py,
+le pasa servidores sintéticos como llegarían del gateway (con todos sus
+miembros si la política hace chunk al arrancar) y una tanda de GUILD_MEMBER_ADD,
+y mide con tracemalloc lo que queda retenido.
+
+    python tools/memoria_miembros.py --servidores 20 --miembros 5000 --entradas 500
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import discord
+
+from loadtest import preparar_entorno
+
+_ids = iter(range(10**17, 10**18))
+
+
+def datos_miembro():
+    user_id = str(next(_ids))
+    return {
+        "user": {"id": user_id, "username": f"usuario{user_id[-6:]}", "discriminator": "0", "avatar": None, "global_name": None},
+        "roles": [],
+        "joined_at": "2024-01-01T00:00:00+00:00",
+        "deaf": False,
+        "mute": False,
+        "flags": 0,
+    }
+
+
+def datos_servidor(miembros):
+    return {
+        "id": str(next(_ids)),
+        "name": "Servidor sintético",
+        "member_count": len(miembros),
+        "large": True,
+        "roles": [],
+        "channels": [],
+        "members": miembros,
+        "voice_states": [],
+        "presences": [],
+    }
+
+
+def medir(flags, chunk, intents, args):
+    """KB retenidos y miembros en caché tras cargar los servidores y las entradas"""
+    cliente = discord.Client(intents=intents, member_cache_flags=flags, chunk_guilds_at_startup=chunk)
+    estado = cliente._connection
+    gc.collect()
+    antes = tracemalloc.get_traced_memory()[0]
+
+    for _ in range(args.servidores):
+        # Sin chunk, el GUILD_CREATE de un servidor grande no trae la lista de miembros
+        miembros = [datos_miembro() for _ in range(args.miembros)] if chunk else []
+        guild = discord.Guild(data=datos_servidor(miembros), state=estado)
+        estado._add_guild(guild)
+        for _ in range(args.entradas):
+            estado.parse_guild_member_add({**datos_miembro(), "guild_id": str(guild.id)})
+
+    gc.collect()
+    retenido = tracemalloc.get_traced_memory()[0] - antes
+    en_cache = sum(len(g.members) for g in estado.guilds)
+    estado.clear()
+    return retenido / 1024, en_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria de cada política de MEMBER_CACHE")
+    parser.add_argument("--servidores", type=int, default=20)
+    parser.add_argument("--miembros", type=int, default=5000, help="miembros por servidor")
+    parser.add_argument("--entradas", type=int, default=500, help="GUILD_MEMBER_ADD por servidor")
+    args = parser.parse_args()
+
+    _, Dragons = preparar_entorno(0.0, 0.0)
+    tracemalloc.start()
+    print(f"{args.servidores} servidores × {args.miembros} miembros, {args.entradas} entradas por servidor\n")
+    print(f"{'política':<12}{'miembros en caché':>20}{'MB retenidos':>15}")
+    base = None
+    for politica, (flags, chunk) in Dragons.POLITICAS_MIEMBROS.items():
+        kb, en_cache = medir(flags, chunk, Dragons.intents, args)
+        base = base or kb
+        print(f"{politica:<12}{en_cache:>20}{kb / 1024:>15.1f}   ({kb / base:.1%} de 'completo')")
+    tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main()